@@ -3,7 +3,14 @@ from .models import *
 from mptt.admin import DraggableMPTTAdmin
 
 # Register your models here.
+class AccountAdmin(admin.ModelAdmin):
+    # the balance is moved by the records, or adjusted through the API
+    def get_readonly_fields(self, request, obj=None):
+        return ('amount',) if obj is not None else ()
+
 admin.site.register(Category, DraggableMPTTAdmin)
 admin.site.register(Records)
 admin.site.register(MethodOfPayment)
-admin.site.register(Account)
+admin.site.register(Account, AccountAdmin)
+admin.site.register(RecurringRecord)
+admin.site.register(Budget)
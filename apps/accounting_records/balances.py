@@ -0,0 +1,134 @@
+'''Balances of an account at a date, read from the month-end checkpoints.
+
+``Account.amount`` only holds the current balance. The ``BalanceCheckpoint``
+rows hold the closing balance of every month since the first record of the
+account and are moved by the posting like the balance itself, so the balance
+at any date is the checkpoint of the previous month end plus the records of
+less than a month, summed on the ``(account, payment_date)`` index and, for
+the transfers into the account, on the ``(destination_account, payment_date)``
+one.
+'''
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, F, Q, Sum, Value, When
+from django.db.models.functions import TruncMonth
+
+from . import posting, summaries
+from .models import Account, BalanceCheckpoint, MonthlySummary, Records
+
+
+def signed():
+    '''Expression of how much each row (record or summary) changes its own account.'''
+    return Case(
+        When(record_type=Records.RecordType.GASTO, then=-F('amount')),
+        When(record_type=Records.RecordType.INGRESO, then=F('amount')),
+        When(record_type=Records.RecordType.TRANSFERENCIA, then=-F('amount')),
+        default=Value(Decimal('0')),
+    )
+
+
+def transfers_in(account_id):
+    '''The transfers whose destination is the account.'''
+    return Records.objects.filter(destination_account_id=account_id, record_type=Records.RecordType.TRANSFERENCIA)
+
+
+def signed_for(account_id):
+    '''Expression of how much each record changes the account, also as the destination of a transfer.'''
+    received = Q(destination_account_id=account_id, record_type=Records.RecordType.TRANSFERENCIA)
+    return Case(
+        When(received & Q(account_id=account_id), then=Value(Decimal('0'))),
+        When(received, then=F('amount')),
+        default=signed(),
+    )
+
+
+def signed_total(account_id, condition):
+    '''Sum of the records of the account that match ``condition``, the transfers into it included.'''
+    mine = Q(account_id=account_id) | Q(destination_account_id=account_id, record_type=Records.RecordType.TRANSFERENCIA)
+    total = (Records.objects.filter(condition, mine)
+        .aggregate(total=Sum(signed_for(account_id)))['total'])
+    return total or Decimal('0')
+
+
+def balance_at(account_id, day, before=None):
+    '''Return the balance of the account at the end of ``day``.
+
+    With ``before`` (the id of a record of ``day``), return the balance just
+    before that record in ``(payment_date, id)`` order. Starts from the last
+    checkpoint up to then and adds the records after it; before the first
+    checkpoint, starts from the next one (or from the current balance) and
+    subtracts the later records.
+    '''
+    checkpoints = BalanceCheckpoint.objects.filter(account_id=account_id).values_list('period_end', 'balance')
+    if before is None:
+        done = Q(payment_date__lte=day)
+        checkpoint = checkpoints.filter(period_end__lte=day)
+    else:
+        done = Q(payment_date__lt=day) | Q(payment_date=day, id__lt=before)
+        checkpoint = checkpoints.filter(period_end__lt=day)
+    checkpoint = checkpoint.order_by('-period_end').first()
+    if checkpoint is not None:
+        period_end, balance = checkpoint
+        return balance + signed_total(account_id, done & Q(payment_date__gt=period_end))
+    later = ~done
+    checkpoint = checkpoints.filter(period_end__gte=day).order_by('period_end').first()
+    if checkpoint is not None:
+        period_end, balance = checkpoint
+        later &= Q(payment_date__lte=period_end)
+    else:
+        balance = Account.objects.filter(pk=account_id).values_list('amount', flat=True).get()
+    return balance - signed_total(account_id, later)
+
+
+def running_balances(account_id, records):
+    '''Return the balance of the account after each record of ``records``.
+
+    ``records`` must be consecutive records of the account (or transfers
+    into it) in ``(payment_date, id)`` order, e.g. a page of the records list.
+    '''
+    if not records:
+        return []
+    balance = balance_at(account_id, records[0].payment_date, before=records[0].pk)
+    balances = []
+    for record in records:
+        for line in posting.journal_lines(posting.entry_for(record)):
+            if line.account_id == account_id:
+                balance += line.debit - line.credit
+        balances.append(balance)
+    return balances
+
+
+def build_checkpoints(account_id, until):
+    '''Recreate the checkpoints of the account for every month end up to ``until``.
+
+    Walks back from the current balance with the monthly totals of the
+    summary and of the transfers into the account. The account row is locked
+    so no record is posted meanwhile.
+    '''
+    with transaction.atomic():
+        balance = Account.objects.select_for_update().filter(pk=account_id).values_list('amount', flat=True).get()
+        totals = dict(MonthlySummary.objects.filter(account_id=account_id).order_by()
+            .values_list('month').annotate(total=Sum(signed())))
+        received = (transfers_in(account_id).order_by().annotate(month=TruncMonth('payment_date'))
+            .values_list('month').annotate(total=Sum('amount')))
+        for month, total in received:
+            totals[month] = totals.get(month, 0) + total
+        BalanceCheckpoint.objects.filter(account_id=account_id).delete()
+        if not totals:
+            return 0
+        # the records after the last checkpoint are already in the balance
+        for month in totals:
+            if month > summaries.month_of(until):
+                balance -= totals[month]
+        checkpoints = []
+        month = summaries.month_of(until)
+        first = min(totals)
+        while month >= first:
+            checkpoints.append(BalanceCheckpoint(account_id=account_id, period_end=summaries.month_end(month),
+                balance=balance))
+            balance -= totals.get(month, 0)
+            month = summaries.month_of(month - timedelta(days=1))
+        BalanceCheckpoint.objects.bulk_create(checkpoints)
+        return len(checkpoints)
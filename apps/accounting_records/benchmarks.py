@@ -0,0 +1,297 @@
+'''Benchmarks of the ledger operations.
+
+Every benchmark is a function registered with :func:`benchmark` that receives
+the user whose data it works on and returns a dict of metrics (``rows``,
+``bytes``, ``requests``...). It runs inside a transaction that is rolled
+back, so the benchmarks that write leave the database as they found it. Run
+them with ``manage.py run_benchmarks`` against a dataset of
+``manage.py generate_data`` to compare runs before and after a change.
+'''
+import io
+import statistics
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, Max, Min
+from django.test.utils import CaptureQueriesContext
+
+from . import exporters, importers, recurring
+from .models import Account, Records, RecurringRecord
+
+
+BENCHMARKS = {}
+
+# records written by the benchmarks of the write paths
+WRITE_SIZE = 200
+
+# monthly templates caught up for a year by the recurring benchmark
+RECURRING_TEMPLATES = 100
+
+# lines of the statement imported by the import benchmark
+IMPORT_SIZE = 5000
+
+# requests of the benchmarks of the read endpoints
+READ_REQUESTS = 20
+
+# rows rendered by the benchmarks of the list formats
+SERIALIZE_SIZE = 100000
+
+# fields of the sparse benchmarks, those of a chart
+CHART_FIELDS = ['payment_date', 'amount']
+
+
+def benchmark(name):
+    '''Register the decorated function as the benchmark ``name``.'''
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def run_once(func, owner):
+    '''Run a benchmark in a transaction rolled back; return its seconds and metrics.'''
+    with transaction.atomic():
+        started = time.perf_counter()
+        metrics = func(owner)
+        seconds = time.perf_counter() - started
+        transaction.set_rollback(True)
+    return seconds, metrics
+
+
+def run(owner, names=None, trace_memory=False, repeat=1):
+    '''Run the benchmarks (all or the given ``names``) and return their results.
+
+    Each result has the ``name``, the ``seconds`` taken, the metrics returned
+    by the benchmark and ``rows_per_second`` (or ``ms_per_request``) when it
+    reports ``rows`` (or ``requests``). With ``repeat`` every benchmark runs
+    that many times and ``seconds`` is the median, with the ``min_seconds``
+    and ``max_seconds`` of the runs. With ``trace_memory`` the peak of memory
+    allocated (``peak_kb``) is measured too, which slows the benchmarks down.
+    '''
+    results = []
+    for name, func in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        if trace_memory:
+            tracemalloc.start()
+        runs = [run_once(func, owner) for _ in range(repeat)]
+        timings = [seconds for seconds, _ in runs]
+        seconds = statistics.median(timings)
+        metrics = runs[-1][1]
+        result = {'name': name, 'seconds': round(seconds, 4)}
+        if repeat > 1:
+            result.update(min_seconds=round(min(timings), 4), max_seconds=round(max(timings), 4), runs=repeat)
+        result.update(metrics)
+        if 'rows' in metrics and seconds:
+            result['rows_per_second'] = round(metrics['rows'] / seconds, 1)
+        if metrics.get('requests'):
+            result['ms_per_request'] = round(seconds * 1000 / metrics['requests'], 2)
+        if trace_memory:
+            result['peak_kb'] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+            tracemalloc.stop()
+        results.append(result)
+    return results
+
+
+def compare(baseline, results):
+    '''Return the ``(name, baseline seconds, seconds, ratio)`` of the benchmarks in both runs.
+
+    A ratio below 1 means the benchmark got faster than in the baseline.
+    '''
+    before = {result['name']: result['seconds'] for result in baseline}
+    return [(result['name'], before[result['name']], result['seconds'],
+        round(result['seconds'] / before[result['name']], 3) if before[result['name']] else None)
+        for result in results if result['name'] in before]
+
+
+def consume(chunks):
+    '''Read a generator of byte chunks like a client would and return its size.'''
+    return sum(len(chunk) for chunk in chunks)
+
+
+@benchmark('export.csv')
+def export_csv(owner):
+    records = Records.objects.filter(owner=owner)
+    return {'rows': records.count(), 'bytes': consume(exporters.export_records(records, 'csv'))}
+
+
+@benchmark('export.xlsx')
+def export_xlsx(owner):
+    records = Records.objects.filter(owner=owner)
+    return {'rows': records.count(), 'bytes': consume(exporters.export_records(records, 'xlsx'))}
+
+
+def api_client(owner):
+    from rest_framework.test import APIClient
+    client = APIClient(SERVER_NAME='localhost')
+    client.force_authenticate(owner)
+    return client
+
+
+def new_records(owner):
+    account = Account.objects.filter(owner=owner).first() or Account.objects.create(owner=owner, name='Benchmark')
+    return [{'amount': '%d.50' % (n % 90 + 1), 'payment_date': '2025-%02d-%02d' % (n % 12 + 1, n % 28 + 1),
+        'account_id': account.pk, 'note': 'benchmark %d' % n} for n in range(WRITE_SIZE)]
+
+
+@benchmark('records.single')
+def create_one_by_one(owner):
+    client = api_client(owner)
+    for data in new_records(owner):
+        client.post('/api/records/', data, format='json')
+    return {'rows': WRITE_SIZE, 'requests': WRITE_SIZE}
+
+
+@benchmark('records.batch')
+def create_in_batch(owner):
+    operations = [{'op': 'create', 'data': data} for data in new_records(owner)]
+    api_client(owner).post('/api/records/batch/', {'operations': operations}, format='json')
+    return {'rows': WRITE_SIZE, 'requests': 1}
+
+
+def session_client(owner):
+    '''Client logged in with a session cookie, like a browser.'''
+    from django.test import Client
+    client = Client(SERVER_NAME='localhost')
+    client.force_login(owner)
+    return client
+
+
+def read(owner, *urls, client=None):
+    '''Request every url ``READ_REQUESTS`` times; return the metrics of the benchmark.'''
+    client = client or api_client(owner)
+    size = 0
+    with CaptureQueriesContext(connection) as queries:
+        for _ in range(READ_REQUESTS):
+            for url in urls:
+                response = client.get(url)
+                assert response.status_code == 200, (url, response.status_code)
+                size += len(response.content)
+    requests = READ_REQUESTS * len(urls)
+    return {'requests': requests, 'bytes': size, 'queries_per_request': round(len(queries) / requests, 2)}
+
+
+@benchmark('pages.home')
+def home_page(owner):
+    return read(owner, '/', client=session_client(owner))
+
+
+@benchmark('api.session')
+def api_with_session(owner):
+    '''An API list requested with the session of the browser instead of a token.'''
+    return read(owner, '/api/accounts/', '/api/records/?page_size=20', client=session_client(owner))
+
+
+@benchmark('api.records')
+def list_records(owner):
+    return read(owner, '/api/records/?page_size=100', '/api/records/?page_size=100&record_type=INGR')
+
+
+@benchmark('api.records.fields')
+def list_record_fields(owner):
+    return read(owner, '/api/records/?page_size=1000&fields=payment_date,amount')
+
+
+@benchmark('api.records.columnar')
+def list_record_columns(owner):
+    return read(owner, '/api/records/?page_size=1000&fields=payment_date,amount&format=columnar')
+
+
+def serialize(owner, columnar, fields=None):
+    '''Render up to ``SERIALIZE_SIZE`` records of the user as JSON, one object per row or one array per field.'''
+    from django.test import RequestFactory
+    from rest_framework.renderers import JSONRenderer
+    from apps.api.fieldsets import to_columns, value_columns
+    from apps.api.serializers import RecordsSerializer
+    request = RequestFactory(SERVER_NAME='localhost').get('/api/records/')
+    serializer = RecordsSerializer(fields=fields, context={'request': request})
+    columns = value_columns(Records, serializer.fields, request)
+    paths = sorted({path for path, _ in columns.values()} | {'payment_date', 'id'})
+    records = Records.objects.filter(owner=owner).order_by('payment_date', 'id')
+    if columnar:
+        rows = list(records.values(*paths)[:SERIALIZE_SIZE])
+        data = to_columns(rows, columns)
+    else:
+        related = {path.split('__')[0] for path in paths if '__' in path}
+        rows = list(records.select_related(*related).only(*paths)[:SERIALIZE_SIZE])
+        data = RecordsSerializer(rows, many=True, fields=fields, context={'request': request}).data
+    return {'rows': len(rows), 'bytes': len(JSONRenderer().render(data))}
+
+
+@benchmark('serialize.objects')
+def serialize_objects(owner):
+    return serialize(owner, columnar=False)
+
+
+@benchmark('serialize.columns')
+def serialize_columns(owner):
+    return serialize(owner, columnar=True)
+
+
+@benchmark('serialize.objects.chart')
+def serialize_chart_objects(owner):
+    return serialize(owner, columnar=False, fields=CHART_FIELDS)
+
+
+@benchmark('serialize.columns.chart')
+def serialize_chart_columns(owner):
+    return serialize(owner, columnar=True, fields=CHART_FIELDS)
+
+
+@benchmark('api.account_balance')
+def account_balance(owner):
+    '''Balance of the busiest account halfway through its records.'''
+    account = (Account.objects.filter(owner=owner).annotate(total=Count('records')).order_by('-total', 'pk')
+        .first())
+    if account is None:
+        return read(owner, '/api/accounts/')
+    dates = Records.objects.filter(account_id=account).aggregate(first=Min('payment_date'), last=Max('payment_date'))
+    day = dates['first'] + (dates['last'] - dates['first']) / 2 if dates['first'] else date.today()
+    return read(owner, '/api/accounts/%d/balance/?date=%s' % (account.pk, day))
+
+
+@benchmark('api.reports')
+def reports(owner):
+    return read(owner, '/api/reports/monthly/?group_by=month,category', '/api/categories/rollup/',
+        '/api/categories/tree/')
+
+
+@benchmark('api.search')
+def search_texts(owner):
+    return read(owner, '/api/search/?q=super', '/api/search/?q=farmacia&resources=records')
+
+
+@benchmark('api.changes')
+def full_sync(owner):
+    '''Walk every page of a sync from scratch.'''
+    client = api_client(owner)
+    url = '/api/changes/?page_size=1000'
+    requests = 0
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200, (url, response.status_code)
+        requests += 1
+        url = response.data['next']
+    return {'requests': requests}
+
+
+@benchmark('import.csv')
+def import_csv(owner):
+    account = Account.objects.filter(owner=owner).first() or Account.objects.create(owner=owner, name='Benchmark')
+    lines = ['fecha,importe,concepto'] + ['2025-%02d-%02d,-%d.25,import %d' % (n % 12 + 1, n % 28 + 1, n % 90 + 1, n)
+        for n in range(IMPORT_SIZE)]
+    result = importers.import_statement(io.BytesIO('\n'.join(lines).encode()), owner, account)
+    return {'rows': result.rows}
+
+
+@benchmark('recurring.catch_up')
+def catch_up_recurring(owner):
+    account = Account.objects.filter(owner=owner).first() or Account.objects.create(owner=owner, name='Benchmark')
+    start = date.today() - timedelta(days=365)
+    RecurringRecord.objects.bulk_create([RecurringRecord(owner=owner, account=account, amount=n % 90 + 1,
+        start_date=start + timedelta(days=n % 28), next_date=start + timedelta(days=n % 28))
+        for n in range(RECURRING_TEMPLATES)])
+    templates, rows = recurring.materialize()
+    return {'rows': rows, 'templates': templates}
@@ -0,0 +1,200 @@
+'''Spend of the budgets, maintained incrementally.
+
+:func:`apply_entries` is called by the posting of the records with the entries
+added and removed. The expenses of a category count for the budgets of the
+category and of every ancestor (found on the MPTT intervals, with no query per
+level), and each ``(budget, month)`` counter of ``BudgetSpend`` is moved by
+the difference instead of being summed again. A counter that reaches one of
+the thresholds of its budget leaves a ``BudgetAlert`` (once per budget, month
+and threshold), logs it and sends :data:`budget_alert`.
+
+A posting of owners without budgets costs one query. :func:`status` reads the
+budgets of a user with the spend of a month in one query. :func:`rebuild`
+recomputes the counters from the monthly summary, after a category is moved
+or deleted or a budget created, and :func:`differences` compares them.
+'''
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.dispatch import Signal
+
+from . import summaries
+from .models import Budget, BudgetAlert, BudgetSpend, Category, MonthlySummary, Records
+
+
+logger = logging.getLogger(__name__)
+
+# sent with the new BudgetAlert as ``alert``, inside the transaction of the posting
+budget_alert = Signal()
+
+
+def spend_deltas(added=(), removed=()):
+    '''Aggregate the expenses of the entries into ``{(owner_id, category_id, month): delta}``.'''
+    deltas = defaultdict(Decimal)
+    for sign, entries in ((1, added), (-1, removed)):
+        for entry in entries:
+            if entry.record_type == Records.RecordType.GASTO and entry.category_id is not None:
+                deltas[entry.owner_id, entry.category_id, summaries.month_of(entry.payment_date)] += sign * entry.amount
+    return {key: delta for key, delta in deltas.items() if delta}
+
+
+def budget_deltas(deltas):
+    '''Spread the category deltas over the budgets of the categories and their ancestors.
+
+    Returns ``({(budget_id, month): delta}, {budget_id: budget})``.
+    '''
+    budgets = list(Budget.objects.filter(owner_id__in={owner_id for owner_id, _, _ in deltas})
+        .select_related('category'))
+    if not budgets:
+        return {}, {}
+    categories = dict((pk, (tree_id, lft)) for pk, tree_id, lft in
+        Category.objects.filter(pk__in={category_id for _, category_id, _ in deltas}).values_list('pk', 'tree_id', 'lft'))
+    spread = defaultdict(Decimal)
+    for (owner_id, category_id, month), delta in deltas.items():
+        if category_id not in categories:
+            continue
+        tree_id, lft = categories[category_id]
+        for budget in budgets:
+            ancestor = budget.category
+            if (budget.owner_id == owner_id and ancestor.tree_id == tree_id
+                    and ancestor.lft <= lft <= ancestor.rght):
+                spread[budget.pk, month] += delta
+    return {key: delta for key, delta in spread.items() if delta}, {budget.pk: budget for budget in budgets}
+
+
+def add_spend(deltas):
+    '''Add the deltas to their counters; return ``{(budget_id, month): (before, after)}``.
+
+    The existing counters are locked and read, then moved with one
+    ``UPDATE`` per counter; the missing ones are inserted together, or one by
+    one if a concurrent writer created some of them meanwhile.
+    '''
+    rows = (BudgetSpend.objects.select_for_update()
+        .filter(budget_id__in={budget_id for budget_id, _ in deltas}, month__in={month for _, month in deltas})
+        .values_list('budget_id', 'month', 'spent'))
+    existing = {(budget_id, month): spent for budget_id, month, spent in rows}
+    changes = {}
+    for key in sorted(deltas, key=str):
+        if key in existing:
+            BudgetSpend.objects.filter(budget_id=key[0], month=key[1]).update(spent=F('spent') + deltas[key])
+            changes[key] = (existing[key], existing[key] + deltas[key])
+    missing = [key for key in deltas if key not in existing]
+    try:
+        with transaction.atomic():
+            BudgetSpend.objects.bulk_create([BudgetSpend(budget_id=budget_id, month=month, spent=deltas[budget_id, month])
+                for budget_id, month in missing])
+        changes.update((key, (Decimal('0'), deltas[key])) for key in missing)
+    except IntegrityError:
+        for budget_id, month in missing:
+            rows = BudgetSpend.objects.filter(budget_id=budget_id, month=month)
+            rows.update(spent=F('spent') + deltas[budget_id, month])
+            after = rows.values_list('spent', flat=True).get()
+            changes[budget_id, month] = (after - deltas[budget_id, month], after)
+    return changes
+
+
+def raise_alerts(changes, budgets):
+    '''Create the alerts of the thresholds that the counters reached.'''
+    crossed = []
+    for (budget_id, month), (before, after) in changes.items():
+        budget = budgets[budget_id]
+        for threshold in budget.threshold_list():
+            limit = budget.amount * threshold / 100
+            if before < limit <= after:
+                crossed.append(BudgetAlert(budget=budget, month=month, threshold=threshold, spent=after))
+    if not crossed:
+        return []
+    raised = set(BudgetAlert.objects.filter(budget_id__in={alert.budget_id for alert in crossed},
+        month__in={alert.month for alert in crossed}).values_list('budget_id', 'month', 'threshold'))
+    alerts = [alert for alert in crossed if (alert.budget_id, alert.month, alert.threshold) not in raised]
+    BudgetAlert.objects.bulk_create(alerts, ignore_conflicts=True)
+    for alert in alerts:
+        logger.info('Budget of %s for %s reached %d%%: %s of %s', alert.budget.category, alert.month.strftime('%Y-%m'),
+            alert.threshold, alert.spent, alert.budget.amount)
+        budget_alert.send(sender=BudgetAlert, alert=alert)
+    return alerts
+
+
+def apply_entries(added=(), removed=()):
+    '''Update the spend of the budgets with the entries added to and removed from the ledger.'''
+    deltas = spend_deltas(added, removed)
+    if not deltas:
+        return
+    spread, budgets = budget_deltas(deltas)
+    if spread:
+        raise_alerts(add_spend(spread), budgets)
+
+
+def computed_spend(budgets=None):
+    '''Return ``{(budget_id, month): spent}`` computed from the monthly summary with one query.'''
+    budget = Budget._meta.db_table
+    category = Category._meta.db_table
+    summary = MonthlySummary._meta.db_table
+    conditions = ['s.record_type = %s']
+    params = [Records.RecordType.GASTO]
+    if budgets is not None:
+        ids = list(budgets.values_list('pk', flat=True))
+        if not ids:
+            return {}
+        conditions.append('b.id IN (%s)' % ', '.join(['%s'] * len(ids)))
+        params += ids
+    sql = '''
+        SELECT b.id, s.month, SUM(s.amount)
+        FROM {budget} b
+        JOIN {category} a ON a.id = b.category_id
+        JOIN {category} d ON d.tree_id = a.tree_id AND d.lft BETWEEN a.lft AND a.rght
+        JOIN {summary} s ON s.category_id = d.id AND s.owner_id = b.owner_id
+        WHERE {conditions}
+        GROUP BY b.id, s.month
+    '''.format(budget=budget, category=category, summary=summary, conditions=' AND '.join(conditions))
+    month = MonthlySummary._meta.get_field('month')
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return {(row[0], month.to_python(row[1])): Decimal(row[2]).quantize(Decimal('0.01'))
+            for row in cursor.fetchall() if row[2]}
+
+
+def rebuild(budgets=None):
+    '''Recompute the counters of ``budgets`` (all by default). Returns the number of counters.
+
+    No alert is raised: the thresholds crossed on the way are not known.
+    '''
+    spend = computed_spend(budgets)
+    with transaction.atomic():
+        rows = BudgetSpend.objects.all() if budgets is None else BudgetSpend.objects.filter(budget__in=budgets)
+        rows.delete()
+        BudgetSpend.objects.bulk_create([BudgetSpend(budget_id=budget_id, month=month, spent=spent)
+            for (budget_id, month), spent in spend.items()], batch_size=1000)
+    return len(spend)
+
+
+def differences():
+    '''Return ``(budget_id, month, stored, computed)`` for every counter that is wrong.'''
+    stored = {(budget_id, month): spent for budget_id, month, spent
+        in BudgetSpend.objects.exclude(spent=0).values_list('budget_id', 'month', 'spent')}
+    result = []
+    for key, computed in computed_spend().items():
+        value = stored.pop(key, None)
+        if value != computed:
+            result.append((*key, value, computed))
+    result.extend((*key, value, None) for key, value in stored.items())
+    return result
+
+
+def status(owner, month):
+    '''Return the budgets of ``owner`` with their spend of ``month``, one query for all of them.'''
+    spent = BudgetSpend.objects.filter(budget=OuterRef('pk'), month=summaries.month_of(month)).values('spent')[:1]
+    budgets = (Budget.objects.filter(owner=owner).select_related('category')
+        .annotate(spent=Coalesce(Subquery(spent), Value(Decimal('0')), output_field=DecimalField())))
+    rows = []
+    for budget in budgets:
+        percent = (budget.spent * 100 / budget.amount).quantize(Decimal('0.1'))
+        rows.append({'id': budget.pk, 'category': budget.category_id, 'category_name': budget.category.name,
+            'amount': budget.amount, 'spent': budget.spent, 'remaining': budget.amount - budget.spent,
+            'percent': percent, 'reached': [threshold for threshold in budget.threshold_list()
+                if budget.spent >= budget.amount * threshold / 100]})
+    return rows
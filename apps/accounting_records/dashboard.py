@@ -0,0 +1,87 @@
+'''Per-user dashboard KPIs, cached under the version tokens of their sources.
+
+The dashboard is computed once per user and version: the posting bumps the
+``records`` token of the owners it touches, and the signals bump ``accounts``,
+``customers`` and ``categories`` when those are edited. A dashboard hit is one
+lookup of the tokens plus one lookup of the cached KPIs.
+'''
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum
+
+from . import summaries, versioning
+from .models import Account, Category, Records
+
+
+DASHBOARD_TIMEOUT = 24 * 60 * 60
+
+TOP_CUSTOMERS = 5
+
+# days of records ranked for the top customers
+CUSTOMERS_PERIOD = 365
+
+RESOURCES = ('records', 'accounts', 'customers', 'categories')
+
+
+def account_balances(owner):
+    '''Total balance of the accounts of ``owner`` per account type.'''
+    labels = dict(Account.AccountType.choices)
+    rows = (Account.objects.filter(owner=owner).order_by('account_type').values('account_type')
+        .annotate(total=Sum('amount'), accounts=Count('id')))
+    return [{'account_type': row['account_type'], 'label': str(labels[row['account_type']]),
+        'total': row['total'], 'accounts': row['accounts']} for row in rows]
+
+
+def month_spend(owner, today):
+    '''Expenses of ``owner`` from the first of the month to ``today`` per category type.'''
+    labels = dict(Category.CategoryType.choices)
+    rows = (Records.objects.filter(owner=owner, record_type=Records.RecordType.GASTO,
+            payment_date__gte=summaries.month_of(today), payment_date__lte=today)
+        .order_by().values('category_id__category_type').annotate(total=Sum('amount')).order_by('-total'))
+    return [{'category_type': row['category_id__category_type'],
+        'label': str(labels.get(row['category_id__category_type'], 'Sin categoria')),
+        'total': row['total']} for row in rows]
+
+
+def top_customers(owner, today):
+    '''Customers of ``owner`` with the largest income in the last year.
+
+    ``total`` is the income less the expenses of the customer; the transfers
+    are not sales nor purchases and are left out.
+    '''
+    income = Sum('amount', filter=Q(record_type=Records.RecordType.INGRESO), default=Decimal('0'))
+    expenses = Sum('amount', filter=Q(record_type=Records.RecordType.GASTO), default=Decimal('0'))
+    rows = (Records.objects.filter(owner=owner, customer_id__isnull=False,
+            record_type__in=[Records.RecordType.INGRESO, Records.RecordType.GASTO],
+            payment_date__gt=today - timedelta(days=CUSTOMERS_PERIOD), payment_date__lte=today)
+        .order_by().values('customer_id', 'customer_id__name')
+        .annotate(income=income, total=income - expenses, records=Count('id'))
+        .order_by('-income', '-total', 'customer_id')[:TOP_CUSTOMERS])
+    return [{'id': row['customer_id'], 'name': row['customer_id__name'], 'income': row['income'],
+        'total': row['total'], 'records': row['records']} for row in rows]
+
+
+def build_dashboard(owner, today):
+    spend = month_spend(owner, today)
+    return {
+        'date': today,
+        'balances': account_balances(owner),
+        'month_spend': spend,
+        'month_spend_total': sum((row['total'] for row in spend), Decimal('0')),
+        'top_customers': top_customers(owner, today),
+    }
+
+
+def dashboard(owner, today=None):
+    '''Return the KPIs of ``owner``, from the cache unless one of their sources changed.'''
+    today = today or date.today()
+    pairs = [(owner.pk, resource) for resource in RESOURCES] + [(None, 'categories')]
+    tokens = versioning.get_tokens(pairs)
+    key = 'dashboard:%s:%s:%s' % (owner.pk, today.isoformat(), ':'.join(tokens[pair] for pair in pairs))
+    data = cache.get(key)
+    if data is None:
+        data = build_dashboard(owner, today)
+        cache.set(key, data, DASHBOARD_TIMEOUT)
+    return data
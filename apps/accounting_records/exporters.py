@@ -0,0 +1,181 @@
+'''Streaming export of the records to CSV and XLSX.
+
+The rows are read with one query that resolves the account, category, payment
+method and customer names through joins and iterated in chunks; every format
+is a generator of byte chunks, so the memory used does not depend on the
+number of records exported.
+'''
+import csv
+import io
+import re
+import zipfile
+from datetime import date
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+
+COLUMNS = (
+    ('id', 'id'),
+    ('fecha', 'payment_date'),
+    ('tipo', 'record_type'),
+    ('importe', 'amount'),
+    ('nota', 'note'),
+    ('cuenta', 'account_id__name'),
+    ('destino', 'destination_account_id__name'),
+    ('categoria', 'category_id__name'),
+    ('forma de pago', 'method_of_payment_id__name'),
+    ('cliente', 'customer_id__name'),
+)
+
+CHUNK_SIZE = 2000
+
+# bytes buffered before a chunk is handed to the response
+FLUSH_SIZE = 64 * 1024
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def export_rows(queryset):
+    '''Iterate the export columns of the records of ``queryset`` in chunks.'''
+    return (queryset.order_by('payment_date', 'id')
+        .values_list(*(field for _, field in COLUMNS))
+        .iterator(chunk_size=CHUNK_SIZE))
+
+
+class Buffer:
+    '''File-like object that collects what is written until it is drained.'''
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, data):
+        self.parts.append(data)
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(part if isinstance(part, bytes) else part.encode('utf-8') for part in self.parts)
+        self.parts = []
+        self.size = 0
+        return data
+
+
+def csv_chunks(rows):
+    '''Yield the rows as UTF-8 CSV (with BOM so spreadsheets detect the encoding).'''
+    buffer = Buffer()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow([title for title, _ in COLUMNS])
+    for row in rows:
+        writer.writerow(row)
+        if buffer.size >= FLUSH_SIZE:
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+        'officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Registros" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+        'worksheet" Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+        'styles" Target="styles.xml"/>'
+        '</Relationships>'),
+    # style 1 shows the date serial numbers as dates (built-in format 14)
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="1"><font/></fonts>'
+        '<fills count="1"><fill/></fills>'
+        '<borders count="1"><border/></borders>'
+        '<cellStyleXfs count="1"><xf/></cellStyleXfs>'
+        '<cellXfs count="2"><xf/><xf numFmtId="14" applyNumberFormat="1"/></cellXfs>'
+        '</styleSheet>'),
+}
+
+SHEET_START = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+SHEET_END = '</sheetData></worksheet>'
+
+EXCEL_EPOCH = date(1899, 12, 30)
+
+# control characters are not allowed in XML 1.0
+XML_INVALID = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def xlsx_cell(value):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, date):
+        return '<c s="1"><v>%d</v></c>' % (value - EXCEL_EPOCH).days
+    if isinstance(value, (int, float, Decimal)):
+        return '<c><v>%s</v></c>' % value
+    return '<c t="inlineStr"><is><t>%s</t></is></c>' % escape(XML_INVALID.sub('', str(value)))
+
+
+def xlsx_row(values):
+    return '<row>%s</row>' % ''.join(xlsx_cell(value) for value in values)
+
+
+def xlsx_chunks(rows):
+    '''Yield the rows as a one-sheet XLSX workbook.
+
+    The zip archive is written to a buffer without seeking (the entries use
+    data descriptors), so it can be drained while the sheet is generated.
+    '''
+    buffer = Buffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_PARTS.items():
+            archive.writestr(name, content)
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            text = io.TextIOWrapper(sheet, encoding='utf-8')
+            text.write(SHEET_START)
+            text.write(xlsx_row(title for title, _ in COLUMNS))
+            for row in rows:
+                text.write(xlsx_row(row))
+                if buffer.size >= FLUSH_SIZE:
+                    yield buffer.drain()
+            text.write(SHEET_END)
+            text.flush()
+            text.detach()
+    yield buffer.drain()
+
+
+FORMATS = {'csv': csv_chunks, 'xlsx': xlsx_chunks}
+
+
+def export_records(queryset, fmt='csv'):
+    '''Return a generator of the byte chunks of the records of ``queryset`` in ``fmt``.'''
+    return FORMATS[fmt](export_rows(queryset))
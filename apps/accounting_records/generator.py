@@ -0,0 +1,234 @@
+'''Synthetic ledgers to measure against.
+
+:func:`generate` creates users with their accounts, payment methods,
+customers, a deep category tree and years of records. Everything is drawn
+from a random generator seeded with the seed and the number of the user, so
+the same arguments always give the same dataset (only the ids and the
+creation times change), whatever was generated before.
+
+The records follow the usual shape of a household or small business ledger:
+a salary in the first days of every month and expenses spread over the
+period with more of them (and larger) in December and July and on the
+weekends. They are written with batched ``INSERT`` statements and posted once
+per user, and the balance checkpoints are built at the end, so the balances,
+the monthly summary and the search index are the ones the application would
+have kept.
+'''
+import random
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import balances, posting, recurring
+from .models import Account, Category, Customer, MethodOfPayment, Records
+
+
+# a fixed end keeps the datasets of different days identical
+END = date(2025, 12, 31)
+
+# name, category type and (mu, sigma) of the lognormal amount of the records of each root category
+CATEGORY_ROOTS = (
+    ('Alimentación', Category.CategoryType.NECESIDAD, (3.4, 0.8)),
+    ('Hogar', Category.CategoryType.FIJO, (4.6, 0.9)),
+    ('Ingresos', Category.CategoryType.INGRESO, None),
+    ('Ocio', Category.CategoryType.PRESCINDIBLE, (3.6, 1.0)),
+    ('Salud', Category.CategoryType.NECESIDAD, (3.9, 0.9)),
+    ('Transporte', Category.CategoryType.NECESIDAD, (3.0, 0.7)),
+)
+
+CATEGORY_WORDS = ('Compras', 'Cuotas', 'Extras', 'Impuestos', 'Mantenimiento', 'Servicios', 'Suscripciones',
+    'Varios')
+
+NOTES = {
+    'Alimentación': ('Supermercado', 'Verdulería', 'Carnicería', 'Panadería', 'Almacén', 'Delivery'),
+    'Hogar': ('Alquiler', 'Expensas', 'Luz', 'Gas', 'Agua', 'Internet', 'Ferretería', 'Limpieza'),
+    'Ingresos': ('Sueldo', 'Honorarios', 'Aguinaldo'),
+    'Ocio': ('Cine', 'Restaurante', 'Libros', 'Viaje', 'Streaming', 'Regalo'),
+    'Salud': ('Farmacia', 'Consulta médica', 'Obra social', 'Dentista', 'Análisis'),
+    'Transporte': ('Combustible', 'Colectivo', 'Peaje', 'Estacionamiento', 'Taxi', 'Seguro del auto'),
+}
+
+ACCOUNTS = (
+    ('Efectivo', Account.AccountType.EFECTIVO),
+    ('Banco', Account.AccountType.BANCARIA),
+    ('Tarjeta de crédito', Account.AccountType.CREDITO),
+    ('Ahorros', Account.AccountType.AHORRO),
+    ('Inversiones', Account.AccountType.INVERSION),
+)
+
+METHODS_OF_PAYMENT = ('Efectivo', 'Débito', 'Crédito', 'Transferencia')
+
+FIRST_NAMES = ('Ana', 'Bruno', 'Carla', 'Diego', 'Elena', 'Federico', 'Gabriela', 'Hernán', 'Inés', 'Julián',
+    'Lucía', 'Martín', 'Natalia', 'Pablo', 'Romina', 'Sergio')
+LAST_NAMES = ('Acosta', 'Benítez', 'Castro', 'Domínguez', 'Fernández', 'Gómez', 'Herrera', 'López', 'Medina',
+    'Núñez', 'Pérez', 'Ríos', 'Sosa', 'Torres')
+COMPANIES = ('Distribuidora', 'Servicios', 'Comercial', 'Consultora', 'Logística', 'Construcciones')
+
+# relative number of expenses per month (December and the July holidays peak) and weekday
+MONTH_WEIGHTS = (1.0, 0.9, 1.0, 1.0, 1.0, 0.95, 1.25, 1.0, 1.0, 1.0, 1.1, 1.6)
+WEEKDAY_WEIGHTS = (0.9, 0.9, 0.95, 1.0, 1.2, 1.5, 1.1)
+
+# share of the expenses with a customer
+CUSTOMER_SHARE = 0.2
+
+RECORD_FIELDS = ('owner', 'record_type', 'amount', 'note', 'account_id', 'category_id', 'method_of_payment_id',
+    'customer_id', 'created_at', 'updated_at', 'payment_date')
+
+
+def user_random(seed, number):
+    '''The generator of the data of the user ``number`` (a string seed is hashed, not salted).'''
+    return random.Random('%s:%d' % (seed, number))
+
+
+def create_users(prefix, count):
+    existing = User.objects.filter(username__startswith=prefix).exists()
+    if existing:
+        raise ValueError('There are users named %s* already' % prefix)
+    # unusable passwords: hashing a real one would take longer than the rest of the user
+    User.objects.bulk_create([User(username='%s%05d' % (prefix, number), password=make_password(None))
+        for number in range(count)])
+    return list(User.objects.filter(username__startswith=prefix).order_by('username'))
+
+
+def create_categories(owner, depth, branching, rng):
+    '''Create a tree of ``depth`` levels below each root; return the leaves of every root.
+
+    The nested set intervals are computed here and the levels are inserted
+    with one ``bulk_create`` each, instead of one MPTT insertion per node.
+    '''
+    tree_id = (Category.objects.aggregate(last=Max('tree_id'))['last'] or 0)
+    levels = defaultdict(list)
+    leaves = {}
+
+    def build(name, category_type, level, parent, counter):
+        node = Category(owner=owner, name=name, category_type=category_type, parent=parent, level=level,
+            tree_id=tree_id, lft=counter[0])
+        counter[0] += 1
+        children = []
+        if level + 1 < depth:
+            for word in sorted(rng.sample(CATEGORY_WORDS, min(branching, len(CATEGORY_WORDS)))):
+                children.append(build('%s %s' % (word, name.split()[-1].lower()) if level else word,
+                    category_type, level + 1, node, counter))
+        node.rght = counter[0]
+        counter[0] += 1
+        levels[level].append(node)
+        return [node] if not children else [leaf for child in children for leaf in child]
+
+    for name, category_type, _ in CATEGORY_ROOTS:
+        tree_id += 1
+        leaves[name] = build(name, category_type, 0, None, [1])
+    # the parents are saved first, so their children get their ids
+    for level in sorted(levels):
+        Category.objects.bulk_create(levels[level])
+    return leaves
+
+
+def create_customers(owner, count, rng):
+    customers = []
+    for _ in range(count):
+        if rng.random() < 0.4:
+            name = '%s %s' % (rng.choice(COMPANIES), rng.choice(LAST_NAMES))
+            customer_type = Customer.CustomerType.CLIENTEB
+        else:
+            name = '%s %s' % (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))
+            customer_type = Customer.CustomerType.CLIENTEC
+        customers.append(Customer(owner=owner, name=name, customertype=customer_type,
+            description='Cliente desde %d' % rng.randint(2010, END.year)))
+    return Customer.objects.bulk_create(customers)
+
+
+def expense_days(start, end):
+    '''Return the days of the period and the cumulative weights of having an expense on each.'''
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    weights = [MONTH_WEIGHTS[day.month - 1] * WEEKDAY_WEIGHTS[day.weekday()] for day in days]
+    return days, list(accumulate(weights))
+
+
+def months_between(start, end):
+    month = start.replace(day=1)
+    while month <= end:
+        yield month
+        month = (month + timedelta(days=32)).replace(day=1)
+
+
+def generate_records(owner, accounts, methods, customers, leaves, count, start, end, rng):
+    '''Return ``count`` records of ``owner`` as ``(payment_date, record_type, amount, note, account,
+    category, method, customer)`` tuples, by date.'''
+    days, cumulative = expense_days(start, end)
+    months = list(months_between(start, end))
+    expense_roots = [(name, amount) for name, _, amount in CATEGORY_ROOTS if amount]
+    account_weights = [2 ** -index for index in range(len(accounts))]
+    spent = defaultdict(Decimal)
+    records = []
+    for day in rng.choices(days, cum_weights=cumulative, k=max(count - len(months), 0)):
+        root, (mu, sigma) = rng.choice(expense_roots)
+        amount = Decimal(str(round(rng.lognormvariate(mu, sigma) * MONTH_WEIGHTS[day.month - 1], 2)))
+        amount = max(amount, Decimal('0.01'))
+        spent[day.year, day.month] += amount
+        customer = rng.choice(customers) if customers and rng.random() < CUSTOMER_SHARE else None
+        records.append((day, Records.RecordType.GASTO, amount, rng.choice(NOTES[root]),
+            rng.choices(accounts, weights=account_weights)[0], rng.choice(leaves[root]), rng.choice(methods),
+            customer))
+    # the salary covers the month with some savings
+    for month in months[:count]:
+        day = min(month.replace(day=rng.randint(1, 5)), end)
+        amount = (spent[month.year, month.month] * Decimal(str(round(rng.uniform(1.05, 1.3), 2)))
+            or Decimal(rng.randint(500, 3000))).quantize(Decimal('0.01'))
+        records.append((day, Records.RecordType.INGRESO, amount, rng.choice(NOTES['Ingresos'][:2]),
+            accounts[min(1, len(accounts) - 1)], rng.choice(leaves['Ingresos']), rng.choice(methods), None))
+    records.sort(key=lambda record: record[0])
+    return records
+
+
+def generate_user(owner, rng, records, start, end, accounts, customers, depth, branching):
+    '''Create the data of one user; return the number of records.'''
+    ops = connection.ops
+    now = ops.adapt_datetimefield_value(timezone.now())
+    amount_field = Records._meta.get_field('amount')
+    leaves = create_categories(owner, depth, branching, rng)
+    openings = [Decimal(rng.randint(0, 50000)) for _ in ACCOUNTS[:accounts]]
+    account_rows = Account.objects.bulk_create([Account(owner=owner, name=name, account_type=account_type,
+        amount=opening, opening_balance=opening) for (name, account_type), opening in zip(ACCOUNTS, openings)])
+    methods = MethodOfPayment.objects.bulk_create([MethodOfPayment(owner=owner, name=name)
+        for name in METHODS_OF_PAYMENT])
+    customer_rows = create_customers(owner, customers, rng)
+    rows = [(owner.pk, record_type,
+        ops.adapt_decimalfield_value(amount, amount_field.max_digits, amount_field.decimal_places), note,
+        account.pk, category.pk, method.pk, customer.pk if customer else None, now, now,
+        ops.adapt_datefield_value(day))
+        for day, record_type, amount, note, account, category, method, customer
+        in generate_records(owner, account_rows, methods, customer_rows, leaves, records, start, end, rng)]
+    recurring.insert_records(rows, RECORD_FIELDS)
+    posting.post(added=posting.aggregate_entries(Records.objects.filter(owner=owner)))
+    for account in account_rows:
+        balances.build_checkpoints(account.pk, end)
+    return len(rows)
+
+
+def generate(users=10, records=10000, years=3, end=END, accounts=3, customers=20, category_depth=4,
+        category_branching=3, seed=0, prefix='demo', progress=None):
+    '''Generate ``users`` users named ``prefix00000``... with ``records`` records each.
+
+    The records span the ``years`` before ``end``. Each user is written in
+    its own transaction; ``progress`` is called with every user done.
+    Returns the number of users and of records created.
+    '''
+    # from the first day of the month after the one ``years`` before the end
+    start = (date(end.year - years, end.month, 1) + timedelta(days=32)).replace(day=1)
+    with transaction.atomic():
+        owners = create_users(prefix, users)
+    total = 0
+    for number, owner in enumerate(owners):
+        with transaction.atomic():
+            total += generate_user(owner, user_random(seed, number), records, start, end,
+                min(accounts, len(ACCOUNTS)), customers, category_depth, category_branching)
+        if progress:
+            progress(owner)
+    return len(owners), total
@@ -0,0 +1,128 @@
+'''Background processing of the uploaded vouchers and customer images.
+
+Saving a model with a new upload only queues its processing once the
+transaction commits; a pool of ``IMAGE_WORKERS`` threads then writes a small
+JPEG thumbnail and a normalized preview (EXIF orientation applied, RGB, at
+most ``IMAGE_PREVIEW_SIZE``) and records the dimensions and size of the
+original, so the request returns as soon as the upload is stored. Uploads that
+are not images (e.g. PDF vouchers) only get their size recorded.
+
+The processed state lives in the ``<field>_size`` column: uploads without it
+are pending, and ``manage.py process_images`` picks up any that a restart left
+behind.
+'''
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from . import versioning
+from .models import Customer, Records
+
+
+logger = logging.getLogger(__name__)
+
+# models and file fields processed, with their derived fields named <field>_*
+IMAGE_FIELDS = (
+    (Records, 'voucher'),
+    (Customer, 'img'),
+)
+
+# version bumped when the renditions of an upload are stored
+RESOURCES = {Records: 'records', Customer: 'customers'}
+
+THUMBNAIL_QUALITY = 75
+PREVIEW_QUALITY = 85
+
+_executor = None
+
+
+def fields_of(model):
+    return [field for image_model, field in IMAGE_FIELDS if image_model is model]
+
+
+def executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.IMAGE_WORKERS, thread_name_prefix='images')
+    return _executor
+
+
+def render(image, size, quality):
+    '''Return ``image`` shrunk to fit ``size`` as JPEG bytes.'''
+    image = image.copy()
+    image.thumbnail(size, Image.Resampling.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=quality, optimize=True, progressive=True)
+    return output.getvalue()
+
+
+def normalized(image):
+    '''Apply the EXIF orientation and flatten the image to RGB on white.'''
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def process(model, pk, field):
+    '''Generate the thumbnail and preview of an upload and store its metadata.
+
+    The row is only updated if it still holds the same upload, so a file
+    replaced meanwhile is left to its own job.
+    '''
+    instance = model.objects.filter(pk=pk).first()
+    upload = getattr(instance, field, None)
+    if not upload:
+        return
+    name = upload.name
+    # the delta sync sends the rows with the renditions again
+    values = {field + '_size': upload.size, 'updated_at': timezone.now()}
+    try:
+        with upload.open('rb'), Image.open(upload) as image:
+            values[field + '_width'], values[field + '_height'] = image.size
+            image = normalized(image)
+            base = os.path.splitext(os.path.basename(name))[0] + '.jpg'
+            for kind, size, quality in (('thumbnail', settings.IMAGE_THUMBNAIL_SIZE, THUMBNAIL_QUALITY),
+                    ('preview', settings.IMAGE_PREVIEW_SIZE, PREVIEW_QUALITY)):
+                rendition = getattr(instance, '%s_%s' % (field, kind))
+                rendition.save(base, ContentFile(render(image, size, quality)), save=False)
+                values['%s_%s' % (field, kind)] = rendition.name
+    except (UnidentifiedImageError, OSError) as exc:
+        # not an image (or a broken one): only its size is recorded
+        logger.info('Not generating renditions of %s: %s', name, exc)
+    if model.objects.filter(pk=pk, **{field: name}).update(**values):
+        versioning.bump(instance.owner_id, RESOURCES[model])
+
+
+def run(model, pk, field):
+    try:
+        process(model, pk, field)
+    except Exception:
+        logger.exception('Processing %s of %s %s failed', field, model.__name__, pk)
+    finally:
+        # the worker threads open their own connection
+        connection.close()
+
+
+def schedule(model, pk, field):
+    '''Queue the processing of an upload for when the current transaction commits.'''
+    if settings.IMAGE_WORKERS:
+        transaction.on_commit(lambda: executor().submit(run, model, pk, field))
+    else:
+        transaction.on_commit(lambda: process(model, pk, field))
+
+
+def pending(model, field):
+    '''Queryset of the rows with an upload not processed yet.'''
+    return (model.objects.exclude(**{field: ''}).exclude(**{field + '__isnull': True})
+        .filter(**{field + '_size__isnull': True}))
@@ -0,0 +1,216 @@
+'''Streaming import of bank statements (CSV and OFX) into the records.
+
+The statement is parsed line by line and written in batches with
+``bulk_create``; the balance of the account is posted once per batch with the
+aggregated delta, so the memory used does not depend on the size of the file.
+The whole import is one transaction: a line that can not be parsed leaves no
+record behind, so the corrected statement can be uploaded again.
+'''
+import codecs
+import csv
+import io
+import time
+from collections import namedtuple
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from .models import Category, Records
+from .posting import entry_for, post
+
+
+StatementLine = namedtuple('StatementLine', 'payment_date amount note category record_type')
+
+DEFAULT_BATCH_SIZE = 1000
+
+# accepted CSV headers (lowercase) for every field of a statement line
+CSV_COLUMNS = {
+    'payment_date': ('date', 'fecha', 'payment_date'),
+    'amount': ('amount', 'importe', 'monto'),
+    'note': ('note', 'description', 'descripcion', 'descripción', 'concepto', 'memo'),
+    'category': ('category', 'categoria', 'categoría'),
+    'record_type': ('type', 'tipo', 'record_type'),
+}
+
+RECORD_TYPES = {
+    'gast': Records.RecordType.GASTO, 'gasto': Records.RecordType.GASTO, 'debit': Records.RecordType.GASTO,
+    'ingr': Records.RecordType.INGRESO, 'ingreso': Records.RecordType.INGRESO, 'credit': Records.RecordType.INGRESO,
+}
+
+
+class StatementError(ValueError):
+    '''Raised when a statement line can not be parsed'''
+
+
+class ImportResult(namedtuple('ImportResult', 'rows skipped seconds')):
+    '''Outcome of an import: rows written, rows skipped and elapsed time'''
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else float(self.rows)
+
+
+def parse_amount(value):
+    '''Parse an amount written as ``-1234.56``, ``-1.234,56`` or ``1,234.56``.'''
+    value = value.strip().replace(' ', '').replace('$', '')
+    if ',' in value and '.' in value:
+        thousands = '.' if value.rindex(',') > value.rindex('.') else ','
+        value = value.replace(thousands, '')
+    value = value.replace(',', '.')
+    try:
+        return Decimal(value).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise StatementError('Invalid amount: %r' % value)
+
+
+def parse_date(value):
+    '''Parse an ISO (``2025-03-31``), day first (``31/03/2025``) or OFX (``20250331...``) date.'''
+    value = value.strip()
+    for fmt, size in (('%Y-%m-%d', 10), ('%d/%m/%Y', 10), ('%Y%m%d', 8)):
+        try:
+            return datetime.strptime(value[:size], fmt).date()
+        except ValueError:
+            continue
+    raise StatementError('Invalid date: %r' % value)
+
+
+def text_stream(stream, encoding='utf-8-sig'):
+    '''Return a text stream over ``stream`` decoding it incrementally.'''
+    if isinstance(stream, io.TextIOBase):
+        return stream
+    if isinstance(stream, io.IOBase):
+        return io.TextIOWrapper(stream, encoding=encoding, newline='')
+    return codecs.getreader(encoding)(stream)
+
+
+def parse_csv(stream):
+    '''Yield the statement lines of a CSV file with a header row.'''
+    reader = csv.reader(text_stream(stream))
+    header = [name.strip().lower() for name in next(reader, [])]
+    columns = {}
+    for field, names in CSV_COLUMNS.items():
+        for name in names:
+            if name in header:
+                columns[field] = header.index(name)
+                break
+    if 'payment_date' not in columns or 'amount' not in columns:
+        raise StatementError('The CSV header needs a date and an amount column')
+
+    def column(row, field):
+        index = columns.get(field)
+        return row[index].strip() if index is not None and index < len(row) else ''
+
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        record_type = column(row, 'record_type').lower()
+        yield StatementLine(parse_date(column(row, 'payment_date')), parse_amount(column(row, 'amount')),
+            column(row, 'note'), column(row, 'category'), RECORD_TYPES.get(record_type))
+
+
+def ofx_tags(stream, chunk_size=64 * 1024):
+    '''Yield the ``(tag, value)`` pairs of an OFX file, reading it in chunks.
+
+    Works for both the SGML flavour (values without closing tags, often the
+    whole file in one line) and the XML flavour.
+    '''
+    stream = text_stream(stream, encoding='latin-1')
+    pending = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        pending += chunk
+        parts = pending.split('<')
+        # the last part may be cut in the middle, keep it for the next chunk
+        pending = parts.pop() if chunk else ''
+        for part in parts:
+            if '>' in part:
+                tag, _, value = part.partition('>')
+                yield tag.strip().upper(), value.strip()
+        if not chunk:
+            if pending and '>' in pending:
+                tag, _, value = pending.partition('>')
+                yield tag.strip().upper(), value.strip()
+            return
+
+
+def parse_ofx(stream):
+    '''Yield the statement lines of the ``<STMTTRN>`` transactions of an OFX file.'''
+    transaction_tags = None
+    for tag, value in ofx_tags(stream):
+        if tag == 'STMTTRN':
+            transaction_tags = {}
+        elif tag == '/STMTTRN' and transaction_tags is not None:
+            if 'DTPOSTED' not in transaction_tags or 'TRNAMT' not in transaction_tags:
+                raise StatementError('OFX transaction without DTPOSTED or TRNAMT')
+            note = transaction_tags.get('MEMO') or transaction_tags.get('NAME', '')
+            yield StatementLine(parse_date(transaction_tags['DTPOSTED']),
+                parse_amount(transaction_tags['TRNAMT']), note, '', None)
+            transaction_tags = None
+        elif transaction_tags is not None and not tag.startswith('/'):
+            transaction_tags[tag] = value
+
+
+PARSERS = {'csv': parse_csv, 'ofx': parse_ofx}
+
+
+def guess_format(filename):
+    '''Return the statement format for a file name, defaulting to CSV.'''
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return extension if extension in PARSERS else 'csv'
+
+
+def batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_lines(lines, owner, account, batch_size=DEFAULT_BATCH_SIZE):
+    '''Write the statement lines as records of ``account``.
+
+    Every batch is written with one ``bulk_create`` and the balance of the
+    account is posted once per batch, all in one transaction that a
+    :class:`StatementError` rolls back. Lines with a zero amount are skipped.
+    Returns an :class:`ImportResult`.
+    '''
+    started = time.perf_counter()
+    categories = {}
+    rows = skipped = 0
+
+    def category_for(name):
+        if not name:
+            return None
+        key = name.lower()
+        if key not in categories:
+            categories[key] = Category.objects.filter(owner=owner, name__iexact=name).first()
+        return categories[key]
+
+    with transaction.atomic():
+        for batch in batches(lines, batch_size):
+            records = []
+            for line in batch:
+                if not line.amount:
+                    skipped += 1
+                    continue
+                record_type = line.record_type or (
+                    Records.RecordType.GASTO if line.amount < 0 else Records.RecordType.INGRESO)
+                records.append(Records(owner=owner, account_id=account, record_type=record_type,
+                    amount=abs(line.amount), note=line.note[:100] or None, payment_date=line.payment_date,
+                    category_id=category_for(line.category)))
+            Records.objects.bulk_create(records)
+            post(added=[entry_for(record) for record in records])
+            rows += len(records)
+    return ImportResult(rows, skipped, time.perf_counter() - started)
+
+
+def import_statement(stream, owner, account, fmt='csv', batch_size=DEFAULT_BATCH_SIZE):
+    '''Parse a CSV or OFX statement from ``stream`` and import it into ``account``.'''
+    if fmt not in PARSERS:
+        raise StatementError('Unknown statement format: %r' % fmt)
+    return import_lines(PARSERS[fmt](stream), owner, account, batch_size=batch_size)
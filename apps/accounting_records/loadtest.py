@@ -0,0 +1,123 @@
+'''Concurrent load on the API, to compare database setups.
+
+:func:`run` starts ``workers`` processes (like the gunicorn workers, or
+threads), each one a client of one of the users with its own database
+connection, that for ``duration`` seconds list records, read balances and
+reports and, a ``write_ratio`` of the time, create or edit a record. The throughput,
+the latency percentiles and the failed requests ("database is locked" above
+all) tell how the setup copes with concurrent writers. The records created
+are deleted at the end. Run it with ``manage.py load_test``.
+'''
+import multiprocessing
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection, connections
+
+from apps.metrics import SECONDS_BUCKETS, Histogram
+
+from .models import Account, Records
+
+
+NOTE = 'load test'
+
+READS = (
+    '/api/records/?page_size=50',
+    '/api/accounts/%(account)d/balance/?date=%(date)s',
+    '/api/reports/monthly/?group_by=month',
+)
+
+
+def api_client(owner):
+    from rest_framework.test import APIClient
+    client = APIClient(SERVER_NAME='localhost', raise_request_exception=False)
+    client.force_authenticate(owner)
+    return client
+
+
+def worker(owner, account, duration, write_ratio, seed):
+    '''Act as a client of ``owner`` for ``duration`` seconds; return the latencies, errors and writes.'''
+    rng = random.Random(seed)
+    client = api_client(owner)
+    latencies = []
+    errors = Counter()
+    writes = 0
+    created = []
+    context = {'account': account.pk, 'date': '2025-06-30'}
+    deadline = time.perf_counter() + duration
+    try:
+        while time.perf_counter() < deadline:
+            write = rng.random() < write_ratio
+            started = time.perf_counter()
+            if write and created and rng.random() < 0.5:
+                # an edit reads the record before writing it
+                response = client.patch('/api/records/%d/' % rng.choice(created),
+                    {'amount': '%d.25' % rng.randint(1, 500)}, format='json')
+            elif write:
+                response = client.post('/api/records/', {'amount': '%d.50' % rng.randint(1, 500),
+                    'payment_date': '2025-%02d-%02d' % (rng.randint(1, 12), rng.randint(1, 28)),
+                    'account_id': account.pk, 'note': NOTE}, format='json')
+                if response.status_code == 201:
+                    created.append(response.data['id'])
+            else:
+                response = client.get(rng.choice(READS) % context)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors[error_of(response)] += 1
+            elif write:
+                writes += 1
+    finally:
+        connection.close()
+    return latencies, errors, writes
+
+
+def error_of(response):
+    '''Short description of a failed request: its status and the exception of a 500.'''
+    exception = getattr(response, 'exc_info', None)
+    if exception and exception[1] is not None:
+        return '%d %s: %s' % (response.status_code, type(exception[1]).__name__, exception[1])
+    return str(response.status_code)
+
+
+def run(owners, workers=8, duration=10, write_ratio=0.3, seed=0, processes=True):
+    '''Load the API with ``workers`` clients of ``owners`` (round robin) and return the figures.
+
+    The threads of ``processes=False`` share the interpreter lock, so they
+    measure Python more than the database.
+    '''
+    accounts = [Account.objects.filter(owner=owner).order_by('pk').first()
+        or Account.objects.create(owner=owner, name='Load test') for owner in owners]
+    arguments = [(owners[n % len(owners)], accounts[n % len(owners)], duration, write_ratio, '%s:%d' % (seed, n))
+        for n in range(workers)]
+    started = time.perf_counter()
+    if processes:
+        # the forked workers must not share the connection of this one
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            results = pool.starmap(worker, arguments)
+    else:
+        with ThreadPoolExecutor(workers) as executor:
+            results = list(executor.map(worker, *zip(*arguments)))
+    seconds = time.perf_counter() - started
+    latency = Histogram(SECONDS_BUCKETS)
+    errors = Counter()
+    writes = 0
+    for worker_latencies, worker_errors, worker_writes in results:
+        for value in worker_latencies:
+            latency.observe(value)
+        errors.update(worker_errors)
+        writes += worker_writes
+    Records.objects.filter(owner__in=owners, note=NOTE).delete()
+    return {
+        'workers': workers,
+        'seconds': round(seconds, 3),
+        'requests': latency.count,
+        'writes': writes,
+        'failed': sum(errors.values()),
+        'requests_per_second': round(latency.count / seconds, 1),
+        'writes_per_second': round(writes / seconds, 1),
+        'latency': latency.summary(),
+        'errors': dict(errors.most_common(10)),
+    }
@@ -0,0 +1,22 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from apps.accounting_records import balances, summaries
+from apps.accounting_records.models import Account
+
+
+class Command(BaseCommand):
+    help = 'Recreate the month-end balance checkpoints of the accounts (run it monthly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', type=int, nargs='+', help='ids of the accounts (default: all)')
+        parser.add_argument('--until', type=date.fromisoformat, help='last month to checkpoint (default: this month)')
+
+    def handle(self, *args, **options):
+        until = summaries.month_end(options['until'] or date.today())
+        accounts = Account.objects.order_by('pk').values_list('pk', flat=True)
+        if options['account']:
+            accounts = accounts.filter(pk__in=options['account'])
+        checkpoints = sum(balances.build_checkpoints(account_id, until) for account_id in list(accounts))
+        self.stdout.write(self.style.SUCCESS('Built %d checkpoints up to %s' % (checkpoints, until)))
@@ -0,0 +1,44 @@
+import time
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.accounting_records.exporters import FORMATS, export_records
+from apps.accounting_records.models import Records
+
+
+class Command(BaseCommand):
+    help = 'Export the records of a user to a CSV or XLSX file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='output file')
+        parser.add_argument('--user', required=True, help='username of the owner of the records')
+        parser.add_argument('--format', choices=sorted(FORMATS), help='file format (default: from the file extension)')
+        parser.add_argument('--since', type=date.fromisoformat, help='first payment date (YYYY-MM-DD)')
+        parser.add_argument('--until', type=date.fromisoformat, help='last payment date (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        try:
+            owner = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError('Unknown user')
+        fmt = options['format'] or options['path'].rpartition('.')[2].lower()
+        if fmt not in FORMATS:
+            raise CommandError('Unknown export format: %s' % fmt)
+        records = Records.objects.filter(owner=owner)
+        if options['since']:
+            records = records.filter(payment_date__gte=options['since'])
+        if options['until']:
+            records = records.filter(payment_date__lte=options['until'])
+
+        started = time.perf_counter()
+        size = 0
+        with open(options['path'], 'wb') as output:
+            for chunk in export_records(records, fmt):
+                output.write(chunk)
+                size += len(chunk)
+        seconds = time.perf_counter() - started
+        rows = records.count()
+        self.stdout.write(self.style.SUCCESS('Exported %d records (%d bytes) in %.2fs, %.0f rows/s' % (
+            rows, size, seconds, rows / seconds if seconds else 0)))
@@ -0,0 +1,42 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.accounting_records import generator
+
+
+class Command(BaseCommand):
+    help = 'Generate a reproducible synthetic dataset (users, accounts, categories, customers and records)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='users to create (default: 10)')
+        parser.add_argument('--records', type=int, default=10000, help='records of each user (default: 10000)')
+        parser.add_argument('--years', type=int, default=3, help='years covered by the records (default: 3)')
+        parser.add_argument('--end', type=date.fromisoformat, default=generator.END,
+            help='last day of the records (default: %s)' % generator.END)
+        parser.add_argument('--accounts', type=int, default=3, help='accounts of each user (default: 3, max: %d)'
+            % len(generator.ACCOUNTS))
+        parser.add_argument('--customers', type=int, default=20, help='customers of each user (default: 20)')
+        parser.add_argument('--category-depth', type=int, default=4,
+            help='levels of each category tree (default: 4)')
+        parser.add_argument('--category-branching', type=int, default=3,
+            help='subcategories of each category (default: 3)')
+        parser.add_argument('--seed', default='0', help='the same seed always gives the same data (default: 0)')
+        parser.add_argument('--prefix', default='demo', help='prefix of the usernames (default: demo)')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['records'] < 0 or options['years'] < 1 or options['category_depth'] < 1:
+            raise CommandError('--users, --years and --category-depth must be positive and --records not negative')
+
+        def progress(owner):
+            self.stdout.write('%s done' % owner.username)
+
+        try:
+            users, records = generator.generate(users=options['users'], records=options['records'],
+                years=options['years'], end=options['end'], accounts=options['accounts'],
+                customers=options['customers'], category_depth=options['category_depth'],
+                category_branching=options['category_branching'], seed=options['seed'], prefix=options['prefix'],
+                progress=progress if options['verbosity'] > 1 else None)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS('Generated %d users with %d records' % (users, records)))
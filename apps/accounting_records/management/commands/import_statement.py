@@ -0,0 +1,31 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.accounting_records.importers import DEFAULT_BATCH_SIZE, PARSERS, StatementError, guess_format, import_statement
+from apps.accounting_records.models import Account
+
+
+class Command(BaseCommand):
+    help = 'Import a bank statement (CSV or OFX) into the records of an account'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='statement file')
+        parser.add_argument('--user', required=True, help='username of the owner of the records')
+        parser.add_argument('--account', required=True, type=int, help='id of the account of the statement')
+        parser.add_argument('--format', choices=sorted(PARSERS), help='statement format (default: from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            owner = User.objects.get(username=options['user'])
+            account = Account.objects.get(pk=options['account'], owner=owner)
+        except (User.DoesNotExist, Account.DoesNotExist):
+            raise CommandError('Unknown user or account of the user')
+        fmt = options['format'] or guess_format(options['path'])
+        try:
+            with open(options['path'], 'rb') as stream:
+                result = import_statement(stream, owner, account, fmt=fmt, batch_size=options['batch_size'])
+        except (OSError, StatementError) as exc:
+            raise CommandError(exc)
+        self.stdout.write(self.style.SUCCESS('Imported %d records (%d skipped) in %.2fs, %.0f rows/s' % (
+            result.rows, result.skipped, result.seconds, result.rows_per_second)))
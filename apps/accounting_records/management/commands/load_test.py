@@ -0,0 +1,51 @@
+import json
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+
+from apps.accounting_records import loadtest
+
+
+class Command(BaseCommand):
+    help = 'Load the API with concurrent readers and writers and print the throughput as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='concurrent clients (default: 8)')
+        parser.add_argument('--duration', type=float, default=10, help='seconds of load (default: 10)')
+        parser.add_argument('--write-ratio', type=float, default=0.3,
+            help='share of the requests that create a record (default: 0.3)')
+        parser.add_argument('--users', type=int, default=4,
+            help='users the clients act as, those with most records (default: 4)')
+        parser.add_argument('--threads', action='store_true',
+            help='run the clients as threads instead of processes (bound by the interpreter lock)')
+        parser.add_argument('--seed', default='0')
+        parser.add_argument('--output', help='JSON file for the results (default: stdout)')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['users'] < 1 or not 0 <= options['write_ratio'] <= 1:
+            raise CommandError('--workers and --users must be positive and --write-ratio between 0 and 1')
+        owners = list(User.objects.annotate(total=Count('records')).order_by('-total', 'pk')[:options['users']])
+        if not owners:
+            raise CommandError('There is no user to load the API with (see generate_data)')
+        database = settings.DATABASES['default']
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode' if connection.vendor == 'sqlite' else 'SELECT NULL')
+            journal_mode = cursor.fetchone()[0]
+        report = {
+            'database': {'engine': database['ENGINE'], 'journal_mode': journal_mode,
+                'conn_max_age': database.get('CONN_MAX_AGE', 0),
+                'transaction_mode': database.get('OPTIONS', {}).get('transaction_mode')},
+            'users': [owner.username for owner in owners],
+            'results': loadtest.run(owners, workers=options['workers'], duration=options['duration'],
+                write_ratio=options['write_ratio'], seed=options['seed'], processes=not options['threads']),
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write('%(requests_per_second)s requests/s, %(writes_per_second)s writes/s, %(failed)d failed'
+                % report['results'])
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
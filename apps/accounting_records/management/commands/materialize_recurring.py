@@ -0,0 +1,18 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from apps.accounting_records import recurring
+
+
+class Command(BaseCommand):
+    help = 'Create the records of the recurring templates due until today (safe to rerun, run it daily)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--until', type=date.fromisoformat, help='last day to materialize (default: today)')
+        parser.add_argument('--chunk-size', type=int, default=recurring.CHUNK_SIZE,
+            help='templates materialized per transaction')
+
+    def handle(self, *args, **options):
+        templates, records = recurring.materialize(options['until'], options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS('Created %d records from %d recurring templates' % (records, templates)))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from apps.accounting_records import images
+
+
+class Command(BaseCommand):
+    help = 'Generate the thumbnails and previews of the uploads still pending (e.g. after a restart)'
+
+    def handle(self, *args, **options):
+        for model, field in images.IMAGE_FIELDS:
+            pks = list(images.pending(model, field).values_list('pk', flat=True))
+            for pk in pks:
+                images.process(model, pk, field)
+            self.stdout.write('%s.%s: processed %d uploads' % (model.__name__, field, len(pks)))
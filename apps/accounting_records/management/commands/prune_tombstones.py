@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.accounting_records.models import Tombstone
+
+
+class Command(BaseCommand):
+    help = 'Delete the tombstones of the delta sync older than the retention (clients with older tokens resync)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90)
+
+    def handle(self, *args, **options):
+        deleted, _ = Tombstone.objects.filter(deleted_at__lt=timezone.now() - timedelta(days=options['days'])).delete()
+        self.stdout.write(self.style.SUCCESS('Deleted %d tombstones' % deleted))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.accounting_records import budgets
+
+
+class Command(BaseCommand):
+    help = 'Recompute the spend of the budgets from the monthly summary, or only compare it with --check'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='report the differences without writing')
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            rows = budgets.rebuild()
+            self.stdout.write(self.style.SUCCESS('Rebuilt %d budget counters' % rows))
+            return
+        differences = budgets.differences()
+        for budget_id, month, stored, computed in differences:
+            self.stdout.write('budget %s, %s: stored %s, computed %s' % (budget_id, month.strftime('%Y-%m'),
+                stored, computed))
+        if differences:
+            raise CommandError('%d budget counters differ from the summary' % len(differences))
+        self.stdout.write(self.style.SUCCESS('The spend of the budgets matches the summary'))
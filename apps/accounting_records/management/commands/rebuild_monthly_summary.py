@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.accounting_records import summaries
+
+
+class Command(BaseCommand):
+    help = 'Recompute the monthly summary from the records, or only compare it with --check'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='report the differences without writing')
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            rows = summaries.rebuild()
+            self.stdout.write(self.style.SUCCESS('Rebuilt %d summary rows' % rows))
+            return
+        differences = summaries.differences()
+        for key, stored, computed in differences:
+            self.stdout.write('%s: stored %s, computed %s' % (dict(zip(summaries.KEY_FIELDS, key)), stored, computed))
+        if differences:
+            raise CommandError('%d summary rows differ from the records' % len(differences))
+        self.stdout.write(self.style.SUCCESS('The monthly summary matches the records'))
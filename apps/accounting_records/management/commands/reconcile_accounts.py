@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.accounting_records import reconciliation
+
+
+class Command(BaseCommand):
+    help = ('Verify Account.amount against the records of the accounts that may have changed since the last '
+        'run (or all with --full) and repair the differences with --repair')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='verify every account, not only the pending ones')
+        parser.add_argument('--repair', action='store_true', help='set the wrong balances to the computed ones')
+        parser.add_argument('--workers', type=int, default=1, help='processes verifying the chunks (default: 1)')
+        parser.add_argument('--chunk-size', type=int, default=reconciliation.CHUNK_SIZE,
+            help='accounts per aggregate (default: %d)' % reconciliation.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('--workers and --chunk-size must be positive')
+        result = reconciliation.run(full=options['full'], repair_them=options['repair'], workers=options['workers'],
+            chunk_size=options['chunk_size'])
+        repaired = {found.account_id for found in result.repaired}
+        for discrepancy in result.discrepancies:
+            self.stdout.write('account %d: stored %s, records say %s%s' % (discrepancy.account_id,
+                discrepancy.stored, discrepancy.expected, ' (repaired)' if discrepancy.account_id in repaired else ''))
+        summary = 'Verified %d accounts (%d records) in %.2f s' % (result.accounts, result.records, result.seconds)
+        if result.discrepancies and not options['repair']:
+            raise CommandError('%s: %d balances differ from the records' % (summary, len(result.discrepancies)))
+        self.stdout.write(self.style.SUCCESS('%s, %d repaired' % (summary, len(result.repaired))))
@@ -0,0 +1,69 @@
+import json
+import platform
+from datetime import datetime
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+
+from apps.accounting_records import benchmarks
+from apps.accounting_records.models import Records
+
+
+class Command(BaseCommand):
+    help = 'Run the ledger benchmarks and print (or save) the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='username whose data is used (default: the one with most records)')
+        parser.add_argument('--only', nargs='+', metavar='NAME', help='benchmarks to run: %s' % ', '.join(benchmarks.BENCHMARKS))
+        parser.add_argument('--memory', action='store_true', help='also measure the peak of memory allocated')
+        parser.add_argument('--repeat', type=int, default=1, help='runs of every benchmark, the median is reported')
+        parser.add_argument('--output', help='JSON file for the results (default: stdout)')
+        parser.add_argument('--compare', metavar='FILE', help='JSON results of a previous run to compare with')
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options['user']:
+            owner = users.filter(username=options['user']).first()
+        else:
+            owner = users.annotate(total=Count('records')).order_by('-total').first()
+        if owner is None:
+            raise CommandError('There is no user to run the benchmarks with')
+        unknown = set(options['only'] or ()) - set(benchmarks.BENCHMARKS)
+        if unknown:
+            raise CommandError('Unknown benchmarks: %s' % ', '.join(sorted(unknown)))
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be positive')
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as previous:
+                    baseline = json.load(previous)['results']
+            except (OSError, ValueError, KeyError) as exc:
+                raise CommandError('Can not read the results to compare with: %s' % exc)
+
+        report = {
+            'started': datetime.now().isoformat(timespec='seconds'),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'user': owner.username,
+            'dataset': {'users': users.count(), 'records': Records.objects.count(),
+                'user_records': Records.objects.filter(owner=owner).count()},
+            'results': benchmarks.run(owner, names=options['only'], trace_memory=options['memory'],
+                repeat=options['repeat']),
+        }
+        if baseline is not None:
+            report['comparison'] = [{'name': name, 'baseline_seconds': before, 'seconds': after, 'ratio': ratio}
+                for name, before, after, ratio in benchmarks.compare(baseline, report['results'])]
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            for result in report['results']:
+                self.stdout.write('%(name)s: %(seconds)ss' % result)
+            for row in report.get('comparison', ()):
+                self.stdout.write('%(name)s: %(baseline_seconds)ss -> %(seconds)ss (x%(ratio)s)' % row)
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,119 @@
+# Generated by Django 4.1.2 on 2026-10-18 12:35
+
+import datetime
+from decimal import Decimal
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+import mptt.fields
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Account',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('account_type', models.CharField(choices=[('GRAL', 'General'), ('EFEC', 'Efectivo'), ('BANC', 'Cuenta Bancaria'), ('CRED', 'Tarjeta de Credito'), ('AHOR', 'Cuenta de ahorros'), ('EXTR', 'Extra'), ('SEGU', 'Seguro'), ('INVE', 'Inversión'), ('PRES', 'Prestamo'), ('HIPO', 'Hipoteca')], default='GRAL', max_length=4)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=10, validators=[django.core.validators.MinValueValidator(Decimal('0.00'))])),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Cuenta',
+                'verbose_name_plural': 'Cuentas',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Category',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('description', models.CharField(blank=True, max_length=255, null=True)),
+                ('category_type', models.CharField(choices=[('F', 'Gasto Fijo(Obligatorio)'), ('N', 'Gasto Necesario(Sobrevivencia)'), ('P', 'Gasto Prescindible(Lujo)'), ('I', 'Ingreso de dinero'), ('C', 'Categoria Padre (admin)')], default='F', max_length=1)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('lft', models.PositiveIntegerField(editable=False)),
+                ('rght', models.PositiveIntegerField(editable=False)),
+                ('tree_id', models.PositiveIntegerField(db_index=True, editable=False)),
+                ('level', models.PositiveIntegerField(editable=False)),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('parent', mptt.fields.TreeForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', related_query_name='subcategoria', to='accounting_records.category')),
+            ],
+            options={
+                'verbose_name': 'Categoria',
+                'verbose_name_plural': 'Categorias',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Customer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('img', models.ImageField(blank=True, null=True, upload_to='customers/img/')),
+                ('name', models.CharField(max_length=255)),
+                ('email', models.EmailField(blank=True, max_length=255, null=True)),
+                ('phone', models.CharField(blank=True, max_length=255, null=True)),
+                ('address', models.CharField(blank=True, max_length=255, null=True)),
+                ('website', models.URLField(blank=True, max_length=255, null=True)),
+                ('cuil_cuit', models.CharField(blank=True, max_length=255, null=True)),
+                ('ivatype', models.CharField(blank=True, choices=[('1', 'IVA Responsable Inscripto'), ('2', 'IVA Responsable No Inscripto'), ('3', 'IVA No Responsable'), ('4', 'IVA Sujeto Exento'), ('5', 'Consumidor Final'), ('6', 'Responsable Monotributo'), ('7', 'Sujeto No Categorizado'), ('8', 'Proveedor del Exterior'), ('9', 'Cliente del Exterior'), ('10', 'IVA Liberado - Ley Nº 19.640'), ('11', 'IVA Responsable Inscripto - Agente de Percepción'), ('12', 'Pequeño Contribuyente Eventual'), ('13', 'Monotributista Social'), ('14', 'Pequeño Contribuyente Social Eventual'), ('15', 'IVA No Alcanzado'), ('16', 'Monotributista Trabajador Independiente Promovido')], default='1', max_length=2, null=True)),
+                ('customertype', models.CharField(blank=True, choices=[('A', 'Cliente A - Empresa Grande'), ('B', 'Cliente B - Pyme'), ('C', 'Cliente C - Particular')], default='A', max_length=1, null=True)),
+                ('description', models.CharField(blank=True, max_length=255, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Cliente',
+                'verbose_name_plural': 'Clientes',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MethodOfPayment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Forma de pago',
+                'verbose_name_plural': 'Forma de pagos',
+            },
+        ),
+        migrations.CreateModel(
+            name='Records',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('record_type', models.CharField(choices=[('GAST', 'Gasto'), ('INGR', 'Ingreso'), ('TRAN', 'Transferencia')], default='GAST', max_length=4)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=15, validators=[django.core.validators.MinValueValidator(Decimal('0.01'))])),
+                ('note', models.CharField(blank=True, max_length=100, null=True)),
+                ('payment_date', models.DateField(default=datetime.date.today)),
+                ('voucher', models.FileField(blank=True, null=True, upload_to='vouchers/')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('account_id', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='accounting_records.account')),
+                ('category_id', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='accounting_records.category')),
+                ('customer_id', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='accounting_records.customer')),
+                ('method_of_payment_id', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='accounting_records.methodofpayment')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='records', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Registro',
+                'verbose_name_plural': 'Registros',
+                'ordering': ['payment_date'],
+            },
+        ),
+    ]
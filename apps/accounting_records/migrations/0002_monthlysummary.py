@@ -0,0 +1,56 @@
+# Generated by Django 4.1.2 on 2026-10-18 12:38
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+import django.db.models.deletion
+import django.db.models.functions.comparison
+
+
+def build_summary(apps, schema_editor):
+    Records = apps.get_model('accounting_records', 'Records')
+    MonthlySummary = apps.get_model('accounting_records', 'MonthlySummary')
+    rows = (Records.objects.order_by()
+        .annotate(month=TruncMonth('payment_date'))
+        .values('owner_id', 'account_id_id', 'category_id_id', 'record_type', 'month')
+        .annotate(total=Sum('amount'), count=Count('id')))
+    MonthlySummary.objects.bulk_create(
+        (MonthlySummary(owner_id=row['owner_id'], account_id=row['account_id_id'], category_id=row['category_id_id'],
+            record_type=row['record_type'], month=row['month'], amount=row['total'], records_count=row['count'])
+            for row in rows.iterator()),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('accounting_records', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('record_type', models.CharField(choices=[('GAST', 'Gasto'), ('INGR', 'Ingreso'), ('TRAN', 'Transferencia')], max_length=4)),
+                ('month', models.DateField(help_text='First day of the month')),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('records_count', models.IntegerField(default=0)),
+                ('account', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='accounting_records.account')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='accounting_records.category')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Resumen mensual',
+                'verbose_name_plural': 'Resumenes mensuales',
+                'ordering': ['month'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='monthlysummary',
+            constraint=models.UniqueConstraint(models.F('owner'), models.F('month'), models.F('record_type'), django.db.models.functions.comparison.Coalesce('account', 0), django.db.models.functions.comparison.Coalesce('category', 0), name='monthly_summary_key'),
+        ),
+        migrations.RunPython(build_summary, migrations.RunPython.noop),
+    ]
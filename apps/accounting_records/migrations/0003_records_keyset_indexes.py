@@ -0,0 +1,29 @@
+# Generated by Django 4.1.2 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting_records', '0002_monthlysummary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='records',
+            index=models.Index(fields=['owner', 'payment_date', 'id'], name='records_owner_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='records',
+            index=models.Index(fields=['owner', 'record_type', 'payment_date', 'id'], name='records_owner_type_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='records',
+            index=models.Index(fields=['account_id', 'payment_date', 'id'], name='records_account_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='records',
+            index=models.Index(fields=['category_id', 'payment_date', 'id'], name='records_category_date_idx'),
+        ),
+    ]
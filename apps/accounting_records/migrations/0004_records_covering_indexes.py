@@ -0,0 +1,47 @@
+# Generated by Django 4.1.2 on 2026-10-18 12:41
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('accounting_records', '0003_records_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='records',
+            name='records_account_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='records',
+            name='records_category_date_idx',
+        ),
+        migrations.AlterField(
+            model_name='records',
+            name='account_id',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='accounting_records.account'),
+        ),
+        migrations.AlterField(
+            model_name='records',
+            name='category_id',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='accounting_records.category'),
+        ),
+        migrations.AlterField(
+            model_name='records',
+            name='owner',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='records', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='records',
+            index=models.Index(fields=['account_id', 'payment_date', 'id', 'record_type', 'amount'], name='records_account_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='records',
+            index=models.Index(fields=['category_id', 'payment_date', 'id', 'record_type', 'amount'], name='records_category_date_idx'),
+        ),
+    ]
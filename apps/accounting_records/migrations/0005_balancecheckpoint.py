@@ -0,0 +1,32 @@
+# Generated by Django 4.1.2 on 2026-10-18 12:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting_records', '0004_records_covering_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_end', models.DateField(help_text='Last day of the month')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='accounting_records.account')),
+            ],
+            options={
+                'verbose_name': 'Saldo de cierre',
+                'verbose_name_plural': 'Saldos de cierre',
+                'ordering': ['period_end'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='balancecheckpoint',
+            constraint=models.UniqueConstraint(fields=('account', 'period_end'), name='balance_checkpoint_key'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 4.1.2 on 2026-10-18 12:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting_records', '0005_balancecheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='img_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='img_preview',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='customers/img/previews/'),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='img_size',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='img_thumbnail',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='customers/img/thumbnails/'),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='img_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='records',
+            name='voucher_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='records',
+            name='voucher_preview',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='vouchers/previews/'),
+        ),
+        migrations.AddField(
+            model_name='records',
+            name='voucher_size',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='records',
+            name='voucher_thumbnail',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='vouchers/thumbnails/'),
+        ),
+        migrations.AddField(
+            model_name='records',
+            name='voucher_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
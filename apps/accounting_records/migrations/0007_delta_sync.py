@@ -0,0 +1,60 @@
+# Generated by Django 4.1.2 on 2026-10-18 13:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('accounting_records', '0006_upload_renditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource', models.CharField(max_length=32)),
+                ('object_id', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Eliminado',
+                'verbose_name_plural': 'Eliminados',
+                'ordering': ['deleted_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='methodofpayment',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='account',
+            index=models.Index(fields=['owner', 'updated_at', 'id'], name='account_owner_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['owner', 'updated_at', 'id'], name='category_owner_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='methodofpayment',
+            index=models.Index(fields=['owner', 'updated_at', 'id'], name='payment_owner_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='records',
+            index=models.Index(fields=['owner', 'updated_at', 'id'], name='records_owner_updated_idx'),
+        ),
+        migrations.AddField(
+            model_name='tombstone',
+            name='owner',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['owner', 'deleted_at', 'id'], name='tombstone_owner_deleted_idx'),
+        ),
+    ]
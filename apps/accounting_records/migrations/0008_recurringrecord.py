@@ -0,0 +1,83 @@
+# Generated by Django 4.1.2 on 2026-10-18 13:04
+
+import datetime
+from decimal import Decimal
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('accounting_records', '0007_delta_sync'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecurringRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('record_type', models.CharField(choices=[('GAST', 'Gasto'), ('INGR', 'Ingreso'), ('TRAN', 'Transferencia')], default='GAST', max_length=4)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=15, validators=[django.core.validators.MinValueValidator(Decimal('0.01'))])),
+                ('note', models.CharField(blank=True, max_length=100, null=True)),
+                ('frequency', models.CharField(choices=[('D', 'Diaria'), ('S', 'Semanal'), ('M', 'Mensual'), ('A', 'Anual')], default='M', max_length=1)),
+                ('interval', models.PositiveSmallIntegerField(default=1, help_text='Days, weeks, months or years between occurrences', validators=[django.core.validators.MinValueValidator(1)])),
+                ('start_date', models.DateField(default=datetime.date.today, help_text='First occurrence, also the day of the month kept')),
+                ('end_date', models.DateField(blank=True, help_text='Last day an occurrence can fall on', null=True)),
+                ('next_date', models.DateField(editable=False)),
+                ('active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Registro recurrente',
+                'verbose_name_plural': 'Registros recurrentes',
+                'ordering': ['next_date'],
+            },
+        ),
+        migrations.AddField(
+            model_name='recurringrecord',
+            name='account',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='accounting_records.account'),
+        ),
+        migrations.AddField(
+            model_name='recurringrecord',
+            name='category',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='accounting_records.category'),
+        ),
+        migrations.AddField(
+            model_name='recurringrecord',
+            name='customer',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='accounting_records.customer'),
+        ),
+        migrations.AddField(
+            model_name='recurringrecord',
+            name='method_of_payment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='accounting_records.methodofpayment'),
+        ),
+        migrations.AddField(
+            model_name='recurringrecord',
+            name='owner',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='recurring_records', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='records',
+            name='recurring_id',
+            field=models.ForeignKey(blank=True, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='records', to='accounting_records.recurringrecord'),
+        ),
+        migrations.AddIndex(
+            model_name='recurringrecord',
+            index=models.Index(fields=['active', 'next_date'], name='recurring_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recurringrecord',
+            index=models.Index(fields=['owner', 'next_date'], name='recurring_owner_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='records',
+            constraint=models.UniqueConstraint(fields=('recurring_id', 'payment_date'), name='records_recurring_date_key'),
+        ),
+    ]
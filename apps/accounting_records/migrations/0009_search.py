@@ -0,0 +1,33 @@
+from django.db import migrations
+
+
+# on SQLite the FTS5 index is created by apps.accounting_records.search.install
+# after every migrate, since a table rebuilt by a later migration loses its triggers
+MYSQL_INDEXES = (
+    ('accounting_records_records', 'records_note_fts', 'note'),
+    ('accounting_records_customer', 'customer_text_fts', 'name, description'),
+    ('accounting_records_category', 'category_name_fts', 'name'),
+)
+
+
+def add_fulltext_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        for table, name, columns in MYSQL_INDEXES:
+            schema_editor.execute('ALTER TABLE %s ADD FULLTEXT INDEX %s (%s)' % (table, name, columns))
+
+
+def drop_fulltext_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        for table, name, _ in MYSQL_INDEXES:
+            schema_editor.execute('ALTER TABLE %s DROP INDEX %s' % (table, name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting_records', '0008_recurringrecord'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_fulltext_indexes, drop_fulltext_indexes),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.1.2 on 2026-10-18 13:44
+
+import calendar
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+from django.db.models.functions import TruncMonth
+import django.db.models.deletion
+
+
+def keep_transfers_unposted(apps, schema_editor, sign=1):
+    # the existing transfers have no destination and were never posted: the
+    # balance of their account stays as it is, and the checkpoints before
+    # them take their amount, as if it were part of the opening balance
+    Records = apps.get_model('accounting_records', 'Records')
+    BalanceCheckpoint = apps.get_model('accounting_records', 'BalanceCheckpoint')
+    rows = (Records.objects.filter(record_type='TRAN', account_id__isnull=False).order_by()
+        .annotate(month=TruncMonth('payment_date')).values_list('account_id_id', 'month')
+        .annotate(total=Sum('amount')))
+    for account_id, month, total in rows:
+        period_end = month.replace(day=calendar.monthrange(month.year, month.month)[1])
+        BalanceCheckpoint.objects.filter(account_id=account_id, period_end__lt=period_end).update(
+            balance=F('balance') + sign * total)
+
+
+def restore_checkpoints(apps, schema_editor):
+    keep_transfers_unposted(apps, schema_editor, sign=-1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting_records', '0009_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='records',
+            name='destination_account_id',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transfers_in', to='accounting_records.account'),
+        ),
+        migrations.AddField(
+            model_name='recurringrecord',
+            name='destination_account',
+            field=models.ForeignKey(blank=True, help_text='Account the transfers go to', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='recurring_transfers_in', to='accounting_records.account'),
+        ),
+        migrations.AddIndex(
+            model_name='records',
+            index=models.Index(condition=models.Q(('record_type', 'TRAN')), fields=['destination_account_id', 'payment_date', 'id', 'amount'], name='records_destination_date_idx'),
+        ),
+        migrations.RunPython(keep_transfers_unposted, restore_checkpoints),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 4.1.2 on 2026-10-18 13:48
+
+import apps.accounting_records.models
+from decimal import Decimal
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('accounting_records', '0010_transfers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Budget',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=15, validators=[django.core.validators.MinValueValidator(Decimal('0.01'))])),
+                ('thresholds', models.CharField(default='80,100', help_text='Percentages of the amount that raise an alert, comma separated', max_length=64, validators=[apps.accounting_records.models.validate_thresholds])),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='budgets', to='accounting_records.category')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='budgets', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Presupuesto',
+                'verbose_name_plural': 'Presupuestos',
+                'ordering': ['category'],
+            },
+        ),
+        migrations.CreateModel(
+            name='BudgetSpend',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the month')),
+                ('spent', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('budget', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='spend', to='accounting_records.budget')),
+            ],
+            options={
+                'verbose_name': 'Gasto presupuestado',
+                'verbose_name_plural': 'Gastos presupuestados',
+                'ordering': ['month'],
+            },
+        ),
+        migrations.CreateModel(
+            name='BudgetAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the month')),
+                ('threshold', models.PositiveSmallIntegerField(help_text='Percentage of the amount reached')),
+                ('spent', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('budget', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alerts', to='accounting_records.budget')),
+            ],
+            options={
+                'verbose_name': 'Alerta de presupuesto',
+                'verbose_name_plural': 'Alertas de presupuesto',
+                'ordering': ['created_at'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='budgetspend',
+            constraint=models.UniqueConstraint(fields=('budget', 'month'), name='budget_spend_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='budgetalert',
+            constraint=models.UniqueConstraint(fields=('budget', 'month', 'threshold'), name='budget_alert_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='budget',
+            constraint=models.UniqueConstraint(fields=('owner', 'category'), name='budget_category_key'),
+        ),
+    ]
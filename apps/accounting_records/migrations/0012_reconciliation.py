@@ -0,0 +1,50 @@
+# Generated by Django 4.1.2 on 2026-10-18 13:51
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Case, F, Sum, Value, When
+
+
+def set_opening_balances(apps, schema_editor):
+    # the current balances are taken as right: the opening balance is what
+    # the records do not explain
+    Account = apps.get_model('accounting_records', 'Account')
+    Records = apps.get_model('accounting_records', 'Records')
+    signed = Case(
+        When(record_type='GAST', then=-F('amount')),
+        When(record_type='INGR', then=F('amount')),
+        When(record_type='TRAN', then=-F('amount')),
+        default=Value(Decimal('0')),
+    )
+    totals = dict(Records.objects.filter(account_id__isnull=False).order_by().values_list('account_id_id')
+        .annotate(total=Sum(signed)))
+    received = (Records.objects.filter(record_type='TRAN', destination_account_id__isnull=False).order_by()
+        .values_list('destination_account_id_id').annotate(total=Sum('amount')))
+    for account_id, total in received:
+        totals[account_id] = totals.get(account_id, 0) + total
+    Account.objects.update(opening_balance=F('amount'))
+    for account_id, total in totals.items():
+        if total:
+            Account.objects.filter(pk=account_id).update(opening_balance=F('amount') - total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting_records', '0011_budgets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='opening_balance',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=15),
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='reconciled_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(set_opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.2 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting_records', '0012_reconciliation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='reconciled_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=15, null=True),
+        ),
+    ]
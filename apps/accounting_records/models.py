@@ -1,7 +1,9 @@
 from decimal import Decimal
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
 from mptt.models import MPTTModel, TreeForeignKey
 from datetime import date
 from django.utils.translation import gettext_lazy as _
@@ -27,6 +29,11 @@ class Account (models.Model):
         HIPOTECA = 'HIPO', _('Hipoteca')
     account_type = models.CharField(max_length=4, choices=AccountType.choices, default=AccountType.GENERAL)
     amount= models.DecimalField(max_digits=10, decimal_places=2, default=0, validators=[MinValueValidator(Decimal('0.00'))])
+    # balance before any record: the amount is this plus the records, which the reconciliation verifies
+    opening_balance = models.DecimalField(max_digits=15, decimal_places=2, default=0, editable=False)
+    # start of the last reconciliation that found the amount right (or repaired it), and that amount
+    reconciled_at = models.DateTimeField(null=True, blank=True, editable=False)
+    reconciled_amount = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -34,6 +41,39 @@ class Account (models.Model):
         verbose_name_plural="Cuentas"
         verbose_name="Cuenta"
         ordering = ['name']
+        # the delta sync reads the changes of a user in (updated_at, id) order
+        indexes = [models.Index(fields=['owner', 'updated_at', 'id'], name='account_owner_updated_idx')]
+
+    #the balance is moved by the posting of the records: a save writes it only with 'amount' in
+    #update_fields (see adjust), a deliberate change that moves the whole history, checkpoints and
+    #opening balance included
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if self._state.adding:
+            self.opening_balance = self.amount
+            return super(Account, self).save(*args, **kwargs)
+        if update_fields is None or 'amount' not in update_fields:
+            # the balance of a stale instance would undo the records posted since it was loaded
+            if update_fields is None:
+                kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                    if not field.primary_key and field.name not in ('amount', 'opening_balance', 'reconciled_at', 'reconciled_amount')]
+            super(Account, self).save(*args, **kwargs)
+            self.amount = Account.objects.filter(pk=self.pk).values_list('amount', flat=True).get()
+            return
+        with transaction.atomic():
+            previous = (Account.objects.select_for_update().filter(pk=self.pk)
+                .values_list('amount', 'opening_balance').first())
+            if previous is not None:
+                self.opening_balance = previous[1] + (self.amount - previous[0])
+                kwargs['update_fields'] = set(update_fields) | {'opening_balance'}
+            super(Account, self).save(*args, **kwargs)
+            if previous is not None and previous[0] != self.amount:
+                self.checkpoints.update(balance=models.F('balance') + (self.amount - previous[0]))
+
+    def adjust(self, amount):
+        '''Set the balance to ``amount``, moving the opening balance and the checkpoints with it'''
+        self.amount = amount
+        self.save(update_fields=['amount', 'updated_at'])
 
     def __str__(self):
         return self.name
@@ -63,6 +103,7 @@ class Category (MPTTModel):
         verbose_name_plural = "Categorias"
         verbose_name = "Categoria"
         ordering = ['name']
+        indexes = [models.Index(fields=['owner', 'updated_at', 'id'], name='category_owner_updated_idx')]
 
     def __str__(self):
         return self.name
@@ -73,17 +114,50 @@ class MethodOfPayment (models.Model):
     
     owner = models.ForeignKey(User, on_delete=models.CASCADE,null=True, blank=True)
     name = models.CharField(max_length=255)
+    updated_at = models.DateTimeField(auto_now=True)
     class Meta:
         verbose_name_plural="Forma de pagos"
         verbose_name="Forma de pago"        
+        indexes = [models.Index(fields=['owner', 'updated_at', 'id'], name='payment_owner_updated_idx')]
 
     def __str__(self):
         return self.name
 
 
+class RecordsQuerySet(models.QuerySet):
+    '''QuerySet that keeps the account balances in sync on bulk deletes and updates'''
+
+    def delete(self):
+        from .posting import aggregate_entries, post
+        with transaction.atomic():
+            removed = aggregate_entries(self)
+            result = super().delete()
+            post(removed=removed)
+        return result
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def update(self, **kwargs):
+        from .posting import POSTING_FIELDS, aggregate_entries, post
+        from .versioning import bump
+        if POSTING_FIELDS.isdisjoint(kwargs):
+            with transaction.atomic():
+                for owner_id in self.order_by().values_list('owner_id', flat=True).distinct():
+                    bump(owner_id, 'records')
+                return super().update(**kwargs)
+        with transaction.atomic():
+            pks = list(self.select_for_update().values_list('pk', flat=True))
+            removed = aggregate_entries(Records.objects.filter(pk__in=pks))
+            rows = super().update(**kwargs)
+            post(added=aggregate_entries(Records.objects.filter(pk__in=pks)), removed=removed)
+        return rows
+    update.alters_data = True
+
+
 class Records(models.Model):
     '''Records model for save the records of income and expense by user'''
-    owner = models.ForeignKey(User,related_name='records', on_delete=models.CASCADE)
+    # deleting the user also deletes every row derived from the records (accounts, summaries, budgets)
+    owner = models.ForeignKey(User,related_name='records', on_delete=models.CASCADE, db_index=False)
     class RecordType (models.TextChoices):
         GASTO = 'GAST', _('Gasto')
         INGRESO ='INGR', _('Ingreso')
@@ -92,11 +166,25 @@ class Records(models.Model):
     amount = models.DecimalField(max_digits=15,  decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))])
     note = models.CharField(max_length=100, blank=True, null=True)
     payment_date = models.DateField(default=date.today)
-    category_id = models.ForeignKey("Category", on_delete=models.SET_NULL, null=True)
-    account_id = models.ForeignKey('Account', on_delete=models.SET_NULL, null=True)
+    # indexed by the composite indexes of Meta.indexes, which start with them
+    category_id = models.ForeignKey("Category", on_delete=models.SET_NULL, null=True, db_index=False)
+    account_id = models.ForeignKey('Account', on_delete=models.SET_NULL, null=True, db_index=False)
+    # account a transfer goes to, the record's account being the one it comes from
+    destination_account_id = models.ForeignKey('Account', related_name='transfers_in', on_delete=models.SET_NULL,
+        null=True, blank=True, db_index=False)
+    # the records of a deleted method of payment are deleted (and posted) by a pre_delete signal
     method_of_payment_id = models.ForeignKey('MethodOfPayment', on_delete=models.CASCADE, null=True, blank=True)
     customer_id = models.ForeignKey('Customer', on_delete=models.SET_NULL, null=True, blank=True)
+    # template the record was materialized from, with one record per template and date
+    recurring_id = models.ForeignKey('RecurringRecord', related_name='records', on_delete=models.SET_NULL,
+        null=True, blank=True, editable=False, db_index=False)
     voucher = models.FileField(upload_to='vouchers/', null=True, blank=True)
+    # derived from the voucher in the background by apps.accounting_records.images
+    voucher_thumbnail = models.ImageField(upload_to='vouchers/thumbnails/', null=True, blank=True, editable=False)
+    voucher_preview = models.ImageField(upload_to='vouchers/previews/', null=True, blank=True, editable=False)
+    voucher_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    voucher_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    voucher_size = models.PositiveIntegerField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -104,43 +192,55 @@ class Records(models.Model):
         verbose_name_plural = "Registros"
         verbose_name = "Registro"
         ordering = ['payment_date']
+        # the API lists and filters the records in (payment_date, id) order;
+        # the account and category indexes also carry record_type and amount
+        # so the balance and rollup sums are answered from the index alone
+        indexes = [
+            models.Index(fields=['owner', 'payment_date', 'id'], name='records_owner_date_idx'),
+            models.Index(fields=['owner', 'record_type', 'payment_date', 'id'], name='records_owner_type_date_idx'),
+            models.Index(fields=['account_id', 'payment_date', 'id', 'record_type', 'amount'],
+                name='records_account_date_idx'),
+            models.Index(fields=['category_id', 'payment_date', 'id', 'record_type', 'amount'],
+                name='records_category_date_idx'),
+            # only the transfers: NULL for every other record, the column would look unselective
+            models.Index(fields=['destination_account_id', 'payment_date', 'id', 'amount'],
+                condition=models.Q(record_type='TRAN'), name='records_destination_date_idx'),
+            models.Index(fields=['owner', 'updated_at', 'id'], name='records_owner_updated_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['recurring_id', 'payment_date'], name='records_recurring_date_key'),
+        ]
+
+    objects = RecordsQuerySet.as_manager()
 
     def save(self, *args, **kwargs):
-        account= Account.objects.get(id=self.account_id.id)        
-        if self.record_type == 'GAST':
-            account.amount -= self.amount
-        elif self.record_type == 'INGR':
-            account.amount += self.amount
-        account.save()
-        super(Records, self).save(*args, **kwargs)
+        from .posting import POSTING_FIELDS, entries_for, entry_for, post
+        from .versioning import bump
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and POSTING_FIELDS.isdisjoint(update_fields):
+            bump(self.owner_id, 'records')
+            return super(Records, self).save(*args, **kwargs)
+        with transaction.atomic():
+            removed = []
+            if not self._state.adding:
+                removed = entries_for(Records.objects.select_for_update().filter(pk=self.pk))
+            super(Records, self).save(*args, **kwargs)
+            post(added=[entry_for(self)], removed=removed)
     
-    #make delete method to update the account amount
+    #reverse the stored record on its account when it is deleted
     def delete(self, *args, **kwargs):
-        account= Account.objects.get(id=self.account_id.id)        
-        if self.record_type == 'GAST':
-            account.amount += self.amount
-        elif self.record_type == 'INGR':
-            account.amount -= self.amount
-        account.save()
-        super(Records, self).delete(*args, **kwargs)
+        from .posting import entries_for, post
+        with transaction.atomic():
+            removed = entries_for(Records.objects.select_for_update().filter(pk=self.pk))
+            result = super(Records, self).delete(*args, **kwargs)
+            post(removed=removed)
+        return result
     
-    #make update method to update the account amount
-    def update(self, *args, **kwargs):
-        account= Account.objects.get(id=self.account_id.id)
-        old_amount = Records.objects.get(id=self.id).amount
-
-        if self.record_type == 'GAST':
-            if old_amount > self.amount:
-                account.amount += old_amount - self.amount
-            elif old_amount < self.amount:
-                account.amount -= self.amount - old_amount
-        elif self.record_type == 'INGR':
-            if old_amount > self.amount:
-                account.amount -= old_amount - self.amount
-            elif old_amount < self.amount:
-                account.amount += self.amount - old_amount
-        account.save()
-        super(Records, self).update(*args, **kwargs)
+    #set the given fields and post only the difference with the stored record
+    def update(self, **fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.save()
             
     def __str__(self):
         return self.get_record_type_display() + " - " + str(self.amount) + " - " + str(self.payment_date)
@@ -153,6 +253,12 @@ class Customer (models.Model):
     '''Customer model for save the customers of the user'''
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     img = models.ImageField(upload_to='customers/img/', null=True, blank=True)
+    # derived from the image in the background by apps.accounting_records.images
+    img_thumbnail = models.ImageField(upload_to='customers/img/thumbnails/', null=True, blank=True, editable=False)
+    img_preview = models.ImageField(upload_to='customers/img/previews/', null=True, blank=True, editable=False)
+    img_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    img_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    img_size = models.PositiveIntegerField(null=True, blank=True, editable=False)
     name = models.CharField(max_length=255)
     email = models.EmailField(max_length=255, null=True, blank=True)
     phone = models.CharField(max_length=255, null=True, blank=True)
@@ -192,4 +298,201 @@ class Customer (models.Model):
         ordering = ['name']
 
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+
+class RecurringRecord (models.Model):
+    '''Template of a record repeated on a schedule (rent, salaries, subscriptions).
+
+    ``next_date`` is the first occurrence not materialized yet; the
+    ``materialize_recurring`` command creates the records of every due
+    occurrence and moves it forward.
+    '''
+    owner = models.ForeignKey(User, related_name='recurring_records', on_delete=models.CASCADE, db_index=False)
+    record_type = models.CharField(max_length=4, choices=Records.RecordType.choices, default=Records.RecordType.GASTO)
+    amount = models.DecimalField(max_digits=15, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))])
+    note = models.CharField(max_length=100, blank=True, null=True)
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    destination_account = models.ForeignKey(Account, related_name='recurring_transfers_in', on_delete=models.SET_NULL,
+        null=True, blank=True, help_text=_('Account the transfers go to'))
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True)
+    method_of_payment = models.ForeignKey(MethodOfPayment, on_delete=models.SET_NULL, null=True, blank=True)
+    customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True)
+    class Frequency (models.TextChoices):
+        DIARIA = 'D', _('Diaria')
+        SEMANAL = 'S', _('Semanal')
+        MENSUAL = 'M', _('Mensual')
+        ANUAL = 'A', _('Anual')
+    frequency = models.CharField(max_length=1, choices=Frequency.choices, default=Frequency.MENSUAL)
+    interval = models.PositiveSmallIntegerField(default=1, validators=[MinValueValidator(1)],
+        help_text=_('Days, weeks, months or years between occurrences'))
+    start_date = models.DateField(default=date.today, help_text=_('First occurrence, also the day of the month kept'))
+    end_date = models.DateField(null=True, blank=True, help_text=_('Last day an occurrence can fall on'))
+    next_date = models.DateField(editable=False)
+    active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "Registros recurrentes"
+        verbose_name = "Registro recurrente"
+        ordering = ['next_date']
+        # the scheduler looks up the due templates of all the users
+        indexes = [
+            models.Index(fields=['active', 'next_date'], name='recurring_due_idx'),
+            models.Index(fields=['owner', 'next_date'], name='recurring_owner_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.next_date is None:
+            self.next_date = self.start_date
+        return super(RecurringRecord, self).save(*args, **kwargs)
+
+    def __str__(self):
+        return self.get_frequency_display() + " - " + self.get_record_type_display() + " - " + str(self.amount)
+
+
+class MonthlySummary (models.Model):
+    '''Totals of the records of a user per account, category, type and month.
+
+    Maintained incrementally by the posting of the records, so the reports
+    read a handful of rows instead of scanning the ledger.
+    '''
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, null=True, blank=True)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True)
+    record_type = models.CharField(max_length=4, choices=Records.RecordType.choices)
+    month = models.DateField(help_text=_('First day of the month'))
+    amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    records_count = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "Resumenes mensuales"
+        verbose_name = "Resumen mensual"
+        ordering = ['month']
+        constraints = [
+            # records without account or category are summarized together,
+            # so NULL must count as a value of the key
+            models.UniqueConstraint(
+                'owner', 'month', 'record_type', Coalesce('account', 0), Coalesce('category', 0),
+                name='monthly_summary_key'),
+        ]
+
+    def __str__(self):
+        return self.month.strftime('%Y-%m') + " - " + self.get_record_type_display() + " - " + str(self.amount)
+
+
+
+class BalanceCheckpoint (models.Model):
+    '''Closing balance of an account at the end of a month.
+
+    Kept up to date by the posting of the records (a record posted on a date
+    moves every checkpoint from that date on), so the balance at any date is
+    the nearest checkpoint plus the records of less than a month.
+    '''
+    account = models.ForeignKey(Account, related_name='checkpoints', on_delete=models.CASCADE)
+    period_end = models.DateField(help_text=_('Last day of the month'))
+    balance = models.DecimalField(max_digits=15, decimal_places=2)
+
+    class Meta:
+        verbose_name_plural = "Saldos de cierre"
+        verbose_name = "Saldo de cierre"
+        ordering = ['period_end']
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'period_end'], name='balance_checkpoint_key'),
+        ]
+
+    def __str__(self):
+        return str(self.account) + " - " + str(self.period_end) + " - " + str(self.balance)
+
+
+class Tombstone (models.Model):
+    '''Record of a deleted object, so the delta sync can tell the clients to remove it.'''
+    # without constraint: the tombstones outlive the objects and even their owner
+    owner = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True)
+    resource = models.CharField(max_length=32)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = "Eliminados"
+        verbose_name = "Eliminado"
+        ordering = ['deleted_at']
+        indexes = [models.Index(fields=['owner', 'deleted_at', 'id'], name='tombstone_owner_deleted_idx')]
+
+    def __str__(self):
+        return self.resource + " " + str(self.object_id) + " - " + str(self.deleted_at)
+
+
+def validate_thresholds(value):
+    '''Comma separated percentages, e.g. ``80,100``.'''
+    parts = [part.strip() for part in value.split(',') if part.strip()]
+    if not parts or not all(part.isdigit() and 0 < int(part) <= 1000 for part in parts):
+        raise ValidationError(_('Enter percentages between 1 and 1000 separated by commas.'))
+
+
+class Budget (models.Model):
+    '''Monthly spending limit of a category, its subcategories included.
+
+    The spend of every month is counted in ``BudgetSpend`` by the posting of
+    the records; crossing one of the ``thresholds`` leaves a ``BudgetAlert``.
+    '''
+    owner = models.ForeignKey(User, related_name='budgets', on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, related_name='budgets', on_delete=models.CASCADE)
+    amount = models.DecimalField(max_digits=15, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))])
+    thresholds = models.CharField(max_length=64, default='80,100', validators=[validate_thresholds],
+        help_text=_('Percentages of the amount that raise an alert, comma separated'))
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "Presupuestos"
+        verbose_name = "Presupuesto"
+        ordering = ['category']
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'category'], name='budget_category_key'),
+        ]
+
+    def threshold_list(self):
+        return sorted({int(part) for part in self.thresholds.split(',') if part.strip()})
+
+    def __str__(self):
+        return str(self.category) + " - " + str(self.amount)
+
+
+class BudgetSpend (models.Model):
+    '''Expenses of a month counted against a budget.'''
+    budget = models.ForeignKey(Budget, related_name='spend', on_delete=models.CASCADE)
+    month = models.DateField(help_text=_('First day of the month'))
+    spent = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name_plural = "Gastos presupuestados"
+        verbose_name = "Gasto presupuestado"
+        ordering = ['month']
+        constraints = [
+            models.UniqueConstraint(fields=['budget', 'month'], name='budget_spend_key'),
+        ]
+
+    def __str__(self):
+        return self.month.strftime('%Y-%m') + " - " + str(self.spent)
+
+
+class BudgetAlert (models.Model):
+    '''A budget whose spend of a month reached one of its thresholds, raised once.'''
+    budget = models.ForeignKey(Budget, related_name='alerts', on_delete=models.CASCADE)
+    month = models.DateField(help_text=_('First day of the month'))
+    threshold = models.PositiveSmallIntegerField(help_text=_('Percentage of the amount reached'))
+    spent = models.DecimalField(max_digits=15, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = "Alertas de presupuesto"
+        verbose_name = "Alerta de presupuesto"
+        ordering = ['created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['budget', 'month', 'threshold'], name='budget_alert_key'),
+        ]
+
+    def __str__(self):
+        return str(self.budget) + " - " + self.month.strftime('%Y-%m') + " - " + str(self.threshold) + "%"
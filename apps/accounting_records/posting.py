@@ -0,0 +1,221 @@
+'''Balance posting for the accounting records.
+
+Every write that changes the ledger (saving, editing or deleting records) goes
+through :func:`post`: the API, the admin, the imports and the recurring
+scheduler alike. Each record added or removed becomes balanced journal lines
+(:func:`journal_lines`), a debit and a credit of the same amount; the lines of
+the whole posting are netted into one delta per account and each delta is
+applied with a single ``UPDATE`` computed by the database, so concurrent
+writers never overwrite each other and both sides of a transfer move in the
+same transaction.
+The same entries keep the balance checkpoints, the monthly summary
+(:mod:`.summaries`) and the spend of the budgets (:mod:`.budgets`) up to date and bump the ``records`` and ``accounts``
+versions of their owners (:mod:`.versioning`).
+'''
+import threading
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import connection
+from django.db.models import Count, F, Sum
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from . import budgets, summaries, versioning
+from .models import Account, BalanceCheckpoint, Records
+
+
+# Snapshot of the fields of a record that affect the balances.
+Entry = namedtuple('Entry', 'owner_id account_id category_id record_type amount payment_date count destination_id',
+    defaults=(None,))
+
+# One side of the posting of an entry; ``account_id`` None stands for the
+# outside of the ledger (the income or expense of the category).
+JournalLine = namedtuple('JournalLine', 'account_id debit credit')
+
+ENTRY_FIELDS = ('owner_id', 'account_id_id', 'category_id_id', 'record_type', 'payment_date',
+    'destination_account_id_id')
+
+# Fields of ``Records`` whose change requires re-posting the record, by name
+# and by column (``bulk_update`` updates the foreign keys by column).
+POSTING_FIELDS = frozenset(('record_type', 'amount', 'payment_date', 'category_id', 'account_id', 'owner',
+    'destination_account_id', 'category_id_id', 'account_id_id', 'owner_id', 'destination_account_id_id'))
+
+
+def entry_for(record):
+    '''Return the posting entry of a record instance.'''
+    return Entry(record.owner_id, record.account_id_id, record.category_id_id,
+        record.record_type, record.amount, record.payment_date, 1, record.destination_account_id_id)
+
+
+def entries_for(queryset):
+    '''Return the posting entries of the records of a queryset, one per row.'''
+    rows = queryset.values_list('owner_id', 'account_id_id', 'category_id_id', 'record_type', 'amount', 'payment_date',
+        'destination_account_id_id')
+    return [Entry(*row[:6], count=1, destination_id=row[6]) for row in rows]
+
+
+def aggregate_entries(queryset):
+    '''Return the posting entries of a queryset grouped in the database.
+
+    Used by the bulk paths so the memory needed does not depend on the number
+    of records but on the number of distinct accounts, categories and dates.
+    '''
+    rows = (queryset.order_by().values(*ENTRY_FIELDS)
+        .annotate(total=Sum('amount'), rows=Count('id')))
+    return [Entry(row['owner_id'], row['account_id_id'], row['category_id_id'], row['record_type'],
+        row['total'], row['payment_date'], row['rows'], row['destination_account_id_id']) for row in rows]
+
+
+def signed_amount(record_type, amount):
+    '''Return how much a record of the given type changes its own account.
+
+    A transfer takes the amount out of its account; the destination gets it
+    from the debit line of :func:`journal_lines`.
+    '''
+    if record_type == Records.RecordType.GASTO:
+        return -amount
+    if record_type == Records.RecordType.INGRESO:
+        return amount
+    if record_type == Records.RecordType.TRANSFERENCIA:
+        return -amount
+    return Decimal('0')
+
+
+def journal_lines(entry):
+    '''Return the balanced journal lines of an entry, its debits equal to its credits.
+
+    An expense credits its account and an income debits it, against the
+    outside of the ledger. A transfer credits its account and debits the
+    destination; once the destination is deleted the money has simply left
+    the ledger.
+    '''
+    if entry.record_type == Records.RecordType.GASTO:
+        return (JournalLine(None, entry.amount, 0), JournalLine(entry.account_id, 0, entry.amount))
+    if entry.record_type == Records.RecordType.INGRESO:
+        return (JournalLine(entry.account_id, entry.amount, 0), JournalLine(None, 0, entry.amount))
+    if entry.record_type == Records.RecordType.TRANSFERENCIA:
+        return (JournalLine(entry.destination_id, entry.amount, 0), JournalLine(entry.account_id, 0, entry.amount))
+    return ()
+
+
+def account_lines(added=(), removed=()):
+    '''Yield ``(sign, entry, line)`` for the lines of the entries that fall on an account.'''
+    for sign, entries in ((1, added), (-1, removed)):
+        for entry in entries:
+            for line in journal_lines(entry):
+                if line.account_id is not None:
+                    yield sign, entry, line
+
+
+def balance_deltas(added=(), removed=()):
+    '''Aggregate the journal lines of the entries added and removed into one delta per account.'''
+    deltas = defaultdict(Decimal)
+    for sign, entry, line in account_lines(added, removed):
+        deltas[line.account_id] += sign * (line.debit - line.credit)
+    return {account_id: delta for account_id, delta in deltas.items() if delta}
+
+
+def apply_balance_deltas(deltas):
+    '''Apply the deltas with one ``UPDATE ... SET amount = amount + delta`` per account.
+
+    Postings of many accounts (e.g. the recurring scheduler) update them
+    ``BULK_SIZE`` accounts per statement instead.
+    '''
+    now = timezone.now()
+    accounts = sorted(deltas)
+    if len(accounts) > summaries.BULK_THRESHOLD:
+        for start in range(0, len(accounts), summaries.BULK_SIZE):
+            chunk = accounts[start:start + summaries.BULK_SIZE]
+            change = summaries.by_pk({pk: str(deltas[pk]) for pk in chunk}, Account._meta.get_field('amount'))
+            Account.objects.filter(pk__in=chunk).update(amount=F('amount') + change, updated_at=now)
+        return
+    for account_id in accounts:
+        Account.objects.filter(pk=account_id).update(amount=F('amount') + deltas[account_id], updated_at=now)
+
+
+def checkpoint_deltas(added=(), removed=()):
+    '''Aggregate the entries into one delta per account and month end.
+
+    A record moves the checkpoints of its month and all the later ones, so a
+    backdated record is applied to every checkpoint since its date.
+    '''
+    deltas = defaultdict(Decimal)
+    for sign, entry, line in account_lines(added, removed):
+        deltas[line.account_id, summaries.month_end(entry.payment_date)] += sign * (line.debit - line.credit)
+    return {key: delta for key, delta in deltas.items() if delta}
+
+
+def apply_checkpoint_deltas(deltas):
+    '''Add each delta to the checkpoints of its account from its month end on.
+
+    Uses one ``UPDATE`` per account: a checkpoint gets the sum of the deltas
+    of its month end and the earlier ones. When several accounts are posted,
+    those without checkpoints from the first month end on are skipped.
+    '''
+    by_account = defaultdict(dict)
+    for (account_id, period_end), delta in deltas.items():
+        by_account[account_id][period_end] = delta
+    accounts = sorted(by_account)
+    if len(accounts) > 1:
+        accounts = sorted(set(BalanceCheckpoint.objects.filter(account_id__in=accounts,
+            period_end__gte=min(period_end for _, period_end in deltas)).values_list('account_id', flat=True)))
+    for account_id in accounts:
+        months = sorted(by_account[account_id])
+        total = Decimal('0')
+        params = []
+        for period_end in months:
+            total += by_account[account_id][period_end]
+            params[:0] = [connection.ops.adapt_datefield_value(period_end), str(total)]
+        change = total
+        if len(months) > 1:
+            # raw SQL: compiling a Case of one When per month costs more than the update itself
+            change = RawSQL('CASE %s END' % ' '.join(['WHEN period_end >= %s THEN %s'] * len(months)), params,
+                output_field=BalanceCheckpoint._meta.get_field('balance'))
+        (BalanceCheckpoint.objects.filter(account_id=account_id, period_end__gte=months[0])
+            .update(balance=F('balance') + change))
+
+
+# entries collected by the deferred() blocks of each thread
+_deferred = threading.local()
+
+
+@contextmanager
+def deferred():
+    '''Collect the entries posted inside the block and post them once at its end.
+
+    Lets a batch of writes (bulk creates, updates and deletes of several
+    records) touch each account, checkpoint and summary row once. Must be used
+    inside the transaction of the writes; nested blocks join the outer one.
+    '''
+    if getattr(_deferred, 'entries', None) is not None:
+        yield
+        return
+    _deferred.entries = ([], [])
+    try:
+        yield
+        added, removed = _deferred.entries
+    finally:
+        _deferred.entries = None
+    post(added, removed)
+
+
+def post(added=(), removed=()):
+    '''Post the entries added to and removed from the ledger.
+
+    Must be called inside the transaction that writes the records so the
+    balances and the monthly summary are committed (or rolled back) together
+    with them.
+    '''
+    pending = getattr(_deferred, 'entries', None)
+    if pending is not None:
+        pending[0].extend(added)
+        pending[1].extend(removed)
+        return
+    apply_balance_deltas(balance_deltas(added, removed))
+    apply_checkpoint_deltas(checkpoint_deltas(added, removed))
+    summaries.apply_entries(added, removed)
+    budgets.apply_entries(added, removed)
+    for owner_id in {entry.owner_id for entry in added} | {entry.owner_id for entry in removed}:
+        versioning.bump(owner_id, 'records', 'accounts')
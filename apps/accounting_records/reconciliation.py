@@ -0,0 +1,158 @@
+'''Reconciliation of the account balances with their records.
+
+``Account.amount`` is a running total moved by the posting, so a write that
+bypasses it (raw SQL, a restored backup, a bug) leaves it wrong for good.
+:func:`run` recomputes the balance of every account as its
+``opening_balance`` plus its records (the transfers into it included), with
+one grouped aggregate per chunk of ``CHUNK_SIZE`` accounts read from the
+covering account index, and reports the accounts whose amount differs. With
+``repair`` each of them is checked again with the account locked and set to
+the computed balance, its checkpoints rebuilt.
+
+The chunks are verified by a pool of ``workers`` forked processes, each with
+its own database connection. The run is incremental: an account found right
+(or repaired) is stamped with the start of the run in ``reconciled_at`` and
+its amount in ``reconciled_amount``, and unless it is ``full`` the next run
+only reads the accounts that may have changed since (:func:`pending`). A
+balance written behind the model shows as an amount other than the one
+verified; the records are watched per owner, through their ``updated_at``
+and the tombstones of the deleted ones. Only a write of the records that
+bypasses both (raw SQL that keeps ``updated_at``, a delete without
+tombstone) needs a ``full`` run to be found.
+'''
+import multiprocessing
+import time
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import connection, connections, transaction
+from django.db.models import Count, Exists, F, OuterRef, Q, Sum
+from django.utils import timezone
+
+from . import balances, versioning
+from .models import Account, BalanceCheckpoint, Records, Tombstone
+
+
+CHUNK_SIZE = 1000
+
+CENT = Decimal('0.01')
+
+Discrepancy = namedtuple('Discrepancy', 'account_id owner_id stored expected')
+
+Result = namedtuple('Result', 'accounts records discrepancies repaired seconds')
+
+
+def pending(full=False):
+    '''The accounts to verify: all of them, or those that may have changed since their last reconciliation.
+
+    That is the accounts never reconciled, those whose amount is not the one
+    verified or was written since, and those of the owners with records
+    written or deleted since.
+    '''
+    accounts = Account.objects.all()
+    if full:
+        return accounts
+    since = OuterRef('reconciled_at')
+    written = Records.objects.filter(owner=OuterRef('owner'), updated_at__gt=since)
+    deleted = Tombstone.objects.filter(owner=OuterRef('owner'), resource='records', deleted_at__gt=since)
+    return accounts.filter(Q(reconciled_at__isnull=True) | Q(reconciled_amount__isnull=True)
+        | ~Q(amount=F('reconciled_amount')) | Q(updated_at__gt=F('reconciled_at'))
+        | Exists(written) | Exists(deleted))
+
+
+def record_totals(account_ids):
+    '''Return ``{account_id: (total, records)}`` of the records of the accounts, transfers in included.'''
+    totals = {}
+    rows = (Records.objects.filter(account_id__in=account_ids).order_by().values_list('account_id_id')
+        .annotate(total=Sum(balances.signed()), rows=Count('id')))
+    for account_id, total, count in rows:
+        totals[account_id] = (total, count)
+    received = (Records.objects.filter(destination_account_id__in=account_ids,
+        record_type=Records.RecordType.TRANSFERENCIA).order_by().values_list('destination_account_id_id')
+        .annotate(total=Sum('amount'), rows=Count('id')))
+    for account_id, total, count in received:
+        own, own_count = totals.get(account_id, (Decimal('0'), 0))
+        totals[account_id] = (own + total, own_count + count)
+    return totals
+
+
+def verify(account_ids):
+    '''Verify the accounts; return the number of records read and the discrepancies.'''
+    accounts = Account.objects.filter(pk__in=account_ids).values_list('pk', 'owner_id', 'amount', 'opening_balance')
+    totals = record_totals(account_ids)
+    records = 0
+    discrepancies = []
+    for account_id, owner_id, amount, opening_balance in accounts:
+        total, count = totals.get(account_id, (Decimal('0'), 0))
+        records += count
+        # SQLite sums the decimals as floats
+        expected = (opening_balance + total).quantize(CENT)
+        if expected != amount:
+            discrepancies.append(Discrepancy(account_id, owner_id, amount, expected))
+    return records, discrepancies
+
+
+def verify_chunk(account_ids):
+    ''':func:`verify` in a worker process, which closes its connection when done.'''
+    try:
+        return verify(account_ids)
+    finally:
+        connection.close()
+
+
+def repair(discrepancy):
+    '''Set the account to its computed balance, if it still differs with the account locked.
+
+    Returns the discrepancy found under the lock, or None.
+    '''
+    with transaction.atomic():
+        if not Account.objects.select_for_update().filter(pk=discrepancy.account_id).exists():
+            return None
+        _, found = verify([discrepancy.account_id])
+        if not found:
+            return None
+        found = found[0]
+        Account.objects.filter(pk=found.account_id).update(amount=found.expected, updated_at=timezone.now())
+        last = (BalanceCheckpoint.objects.filter(account_id=found.account_id)
+            .order_by('-period_end').values_list('period_end', flat=True).first())
+        if last is not None:
+            balances.build_checkpoints(found.account_id, last)
+        versioning.bump(found.owner_id, 'accounts')
+    return found
+
+
+def mark_reconciled(account_ids, started):
+    '''Stamp the accounts with ``started`` and their amount, or as never reconciled with None.'''
+    amount = None if started is None else F('amount')
+    for start in range(0, len(account_ids), CHUNK_SIZE):
+        Account.objects.filter(pk__in=account_ids[start:start + CHUNK_SIZE]).update(reconciled_at=started,
+            reconciled_amount=amount)
+
+
+def run(full=False, repair_them=False, workers=1, chunk_size=CHUNK_SIZE):
+    '''Verify the pending accounts (all with ``full``) in chunks over ``workers`` processes.
+
+    Returns the accounts and records read, the discrepancies found and the
+    ones repaired. The accounts left wrong are verified again by the next run.
+    '''
+    started = timezone.now()
+    clock = time.perf_counter()
+    account_ids = list(pending(full).order_by('pk').values_list('pk', flat=True))
+    chunks = [account_ids[start:start + chunk_size] for start in range(0, len(account_ids), chunk_size)]
+    if workers > 1 and len(chunks) > 1:
+        # the forked workers must not share the connection of this one
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(min(workers, len(chunks))) as pool:
+            results = pool.map(verify_chunk, chunks)
+    else:
+        results = [verify(chunk) for chunk in chunks]
+    records = sum(count for count, _ in results)
+    discrepancies = [discrepancy for _, found in results for discrepancy in found]
+    repaired = []
+    if repair_them:
+        repaired = [found for found in map(repair, discrepancies) if found is not None]
+    # repaired, or found right (or deleted) under the lock
+    wrong = set() if repair_them else {discrepancy.account_id for discrepancy in discrepancies}
+    mark_reconciled([account_id for account_id in account_ids if account_id not in wrong], started)
+    mark_reconciled(sorted(wrong), None)
+    return Result(len(account_ids), records, discrepancies, repaired, time.perf_counter() - clock)
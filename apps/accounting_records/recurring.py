@@ -0,0 +1,145 @@
+'''Materialization of the recurring records.
+
+:func:`materialize` walks the due templates of all the users in chunks and,
+per chunk and in one transaction, creates the records of every occurrence
+until today with one batched ``INSERT``, posts them together (one balance
+update per account, see :mod:`.posting`) and moves the ``next_date`` of the
+templates forward, deactivating those past their end. A crash rolls the whole
+chunk back, so rerunning it never duplicates an occurrence; the unique
+(template, date) key of the records guards against two schedulers running at
+once.
+'''
+import calendar
+from collections import defaultdict
+from datetime import date, timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import posting
+from .models import Records, RecurringRecord
+
+
+CHUNK_SIZE = 500
+
+BATCH_SIZE = 1000
+
+
+def add_months(day, months, anchor):
+    '''Return ``day`` moved ``months`` ahead on the day ``anchor`` (or the last day of a shorter month).'''
+    index = day.year * 12 + day.month - 1 + months
+    year, month = divmod(index, 12)
+    return date(year, month + 1, min(anchor, calendar.monthrange(year, month + 1)[1]))
+
+
+def following(template, day):
+    '''Return the occurrence of ``template`` after the one on ``day``.'''
+    frequency = RecurringRecord.Frequency
+    if template.frequency == frequency.DIARIA:
+        return day + timedelta(days=template.interval)
+    if template.frequency == frequency.SEMANAL:
+        return day + timedelta(weeks=template.interval)
+    months = template.interval * (12 if template.frequency == frequency.ANUAL else 1)
+    return add_months(day, months, template.start_date.day)
+
+
+def occurrences(template, until):
+    '''Return the due dates of ``template`` up to ``until`` and the next date after them.'''
+    if template.end_date is not None:
+        until = min(until, template.end_date)
+    dates = []
+    day = template.next_date
+    while day <= until:
+        dates.append(day)
+        day = following(template, day)
+    return dates, day
+
+
+# columns written for every occurrence; the rest of the record is left NULL
+INSERT_FIELDS = ('owner', 'record_type', 'amount', 'note', 'account_id', 'destination_account_id', 'category_id',
+    'method_of_payment_id', 'customer_id', 'recurring_id', 'created_at', 'updated_at', 'payment_date')
+
+
+def template_values(template, ops, now):
+    '''Return the database values of the records of ``template`` but their date.'''
+    amount = Records._meta.get_field('amount')
+    return (template.owner_id, template.record_type,
+        ops.adapt_decimalfield_value(template.amount, amount.max_digits, amount.decimal_places), template.note,
+        template.account_id, template.destination_account_id, template.category_id, template.method_of_payment_id,
+        template.customer_id, template.pk, now, now)
+
+
+def insert_records(rows, fields=INSERT_FIELDS):
+    '''Insert the records with one ``executemany`` per batch.
+
+    Way faster than ``bulk_create`` for a catch-up of thousands of records,
+    which would prepare every field of every instance: here the values of a
+    template are prepared once and only the date changes. ``rows`` hold the
+    database values of ``fields``.
+    '''
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(Records._meta.get_field(name).column) for name in fields)
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (quote(Records._meta.db_table), columns,
+        ', '.join(['%s'] * len(fields)))
+    for start in range(0, len(rows), BATCH_SIZE):
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, rows[start:start + BATCH_SIZE])
+
+
+def due(today):
+    return RecurringRecord.objects.filter(active=True, next_date__lte=today)
+
+
+def materialize_chunk(templates, today):
+    '''Create the due records of ``templates`` and advance them; return the records created.'''
+    ops = connection.ops
+    now = ops.adapt_datetimefield_value(timezone.now())
+    rows = []
+    entries = []
+    for template in templates:
+        dates, template.next_date = occurrences(template, today)
+        if template.end_date is not None and template.next_date > template.end_date:
+            template.active = False
+        if not dates:
+            continue
+        values = template_values(template, ops, now)
+        for day in dates:
+            rows.append(values + (ops.adapt_datefield_value(day),))
+            entries.append(posting.Entry(template.owner_id, template.account_id, template.category_id,
+                template.record_type, template.amount, day, 1, template.destination_account_id))
+    insert_records(rows)
+    posting.post(added=entries)
+    advance(templates)
+    return len(rows)
+
+
+def advance(templates):
+    '''Store the new ``next_date`` and ``active`` of the templates.
+
+    Most templates of a run move to the same few dates, so they are updated
+    with one ``UPDATE`` per distinct value instead of a ``bulk_update``.
+    '''
+    groups = defaultdict(list)
+    for template in templates:
+        groups[template.next_date, template.active].append(template.pk)
+    for (next_date, active), pks in groups.items():
+        RecurringRecord.objects.filter(pk__in=pks).update(next_date=next_date, active=active)
+
+
+def materialize(today=None, chunk_size=CHUNK_SIZE):
+    '''Materialize the occurrences of all the templates due by ``today``.
+
+    Returns the number of templates advanced and of records created.
+    '''
+    today = today or date.today()
+    templates_count = records_count = 0
+    last = 0
+    while True:
+        with transaction.atomic():
+            templates = list(due(today).select_for_update().filter(pk__gt=last).order_by('pk')[:chunk_size])
+            if not templates:
+                break
+            records_count += materialize_chunk(templates, today)
+        templates_count += len(templates)
+        last = templates[-1].pk
+    return templates_count, records_count
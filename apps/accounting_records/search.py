@@ -0,0 +1,221 @@
+'''Full-text search over the record notes, the customers and the categories.
+
+On SQLite the texts live in the FTS5 table ``accounting_records_search``,
+kept up to date by triggers on the three tables, so every write (bulk and raw
+ones included) updates the index in its own transaction. :func:`install`
+creates them after every ``migrate``, since rebuilding a table in a later
+migration drops its triggers. The ``unicode61`` tokenizer folds the case and
+removes the diacritics, so "plomeria" finds "Plomería". On MySQL the
+``FULLTEXT`` indexes of the same columns (migration 0009) are used, whose
+accent insensitive collations fold the same way; any other database falls
+back to ``icontains`` scans.
+
+The results are ranked (``score``, higher is better), limited to the texts of
+the owner (and the shared categories) and paginated with ``limit``/``offset``.
+'''
+import re
+
+from django.db import connection, connections
+from django.db.models import Q
+
+from .models import Category, Customer, Records
+
+
+# resources searched and their columns, in the order of their rowid slot
+SOURCES = {
+    'records': (Records, ('note',)),
+    'customers': (Customer, ('name', 'description')),
+    'categories': (Category, ('name',)),
+}
+
+# the FTS5 rowid of a text is ``id * SLOTS + slot of its resource``
+SLOTS = 4
+
+TABLE = 'accounting_records_search'
+
+# terms of a query, the rest is ignored
+MAX_TERMS = 8
+
+WORD = re.compile(r'\w+')
+
+# owner token and text indexed of a row of each resource (``{row}`` is new, old or t)
+SQLITE_TEXTS = {
+    'records': ("'u' || {row}.owner_id", "COALESCE({row}.note, '')"),
+    'customers': ("'u' || {row}.owner_id", "{row}.name || ' ' || COALESCE({row}.description, '')"),
+    'categories': ("CASE WHEN {row}.owner_id IS NULL THEN 'shared' ELSE 'u' || {row}.owner_id END", '{row}.name'),
+}
+
+SQLITE_TABLE = ("CREATE VIRTUAL TABLE {table} USING fts5"
+    "(owner, kind, body, tokenize = 'unicode61 remove_diacritics 2')")
+
+SQLITE_INSERT = ("INSERT INTO {table} (rowid, owner, kind, body) "
+    "SELECT {row}.id * {slots} + {slot}, {owner}, '{resource}', {body} {source}WHERE {body} != ''")
+
+SQLITE_DELETE = 'DELETE FROM {table} WHERE rowid = old.id * {slots} + {slot}'
+
+# the triggers of each resource; updates only reindex when an indexed column changes
+SQLITE_TRIGGERS = {
+    'insert': 'AFTER INSERT ON {source_table} BEGIN %s; END' % SQLITE_INSERT,
+    'update': 'AFTER UPDATE OF {columns} ON {source_table} BEGIN %s; %s; END' % (SQLITE_DELETE, SQLITE_INSERT),
+    'delete': 'AFTER DELETE ON {source_table} BEGIN %s; END' % SQLITE_DELETE,
+}
+
+
+def sqlite_values(resource, row, **extra):
+    model, columns = SOURCES[resource]
+    owner, body = SQLITE_TEXTS[resource]
+    values = dict(table=TABLE, source_table=model._meta.db_table, columns=', '.join(columns + ('owner_id',)),
+        slots=SLOTS, slot=list(SOURCES).index(resource), resource=resource, row=row,
+        owner=owner.format(row=row), body=body.format(row=row), source='')
+    values.update(extra)
+    return values
+
+
+def sqlite_schema():
+    '''Return ``{name: CREATE statement}`` of the FTS5 table and its triggers.'''
+    schema = {TABLE: SQLITE_TABLE.format(table=TABLE)}
+    for resource in SOURCES:
+        for event, trigger in SQLITE_TRIGGERS.items():
+            name = '%s_%s_%s' % (TABLE, resource, event)
+            schema[name] = ('CREATE TRIGGER %s ' % name) + trigger.format(**sqlite_values(resource, 'new'))
+    return schema
+
+
+def reindex(using='default'):
+    '''Rebuild the FTS5 table from the three tables.'''
+    with connections[using].cursor() as cursor:
+        cursor.execute('DELETE FROM %s' % TABLE)
+        for resource, (model, _) in SOURCES.items():
+            cursor.execute(SQLITE_INSERT.format(**sqlite_values(resource, 't',
+                source='FROM %s t ' % model._meta.db_table)))
+
+
+def install(using='default'):
+    '''Create the FTS5 table and triggers missing on a SQLite database and reindex.
+
+    Returns whether anything was missing.
+    '''
+    db = connections[using]
+    if db.vendor != 'sqlite':
+        return False
+    schema = sqlite_schema()
+    with db.cursor() as cursor:
+        if not {model._meta.db_table for model, _ in SOURCES.values()} <= set(db.introspection.table_names(cursor)):
+            # migrated back before the tables exist
+            return False
+        cursor.execute('SELECT name FROM sqlite_master WHERE name IN (%s)' % ', '.join(['%s'] * len(schema)),
+            list(schema))
+        existing = {row[0] for row in cursor.fetchall()}
+        missing = [name for name in schema if name not in existing]
+        for name in missing:
+            cursor.execute(schema[name])
+    if missing:
+        reindex(using)
+    return bool(missing)
+
+
+def warm_up(db):
+    '''Load the FTS5 table on a new SQLite connection, out of any transaction.
+
+    FTS5 reads its configuration the first time a statement of the connection
+    uses the table, e.g. when an ``INSERT`` firing the triggers is prepared.
+    Inside a deferred transaction that read takes a shared lock that SQLite
+    then cannot upgrade while another connection writes, failing at once with
+    "database is locked" instead of waiting for ``timeout``.
+
+    Whether the table exists is looked up in ``sqlite_master`` once per
+    database wrapper (i.e. per thread and alias), not on every connection.
+    '''
+    cursor = db.connection.cursor()
+    try:
+        if not getattr(db, 'search_table_exists', False):
+            cursor.execute('SELECT name FROM sqlite_master WHERE name = ?', [TABLE])
+            if not cursor.fetchone():
+                return
+            db.search_table_exists = True
+        try:
+            cursor.execute('SELECT rowid FROM %s WHERE 0' % TABLE).fetchall()
+        except db.Database.OperationalError:
+            # dropped since (migrated back)
+            db.search_table_exists = False
+    finally:
+        cursor.close()
+
+
+def terms_of(text):
+    '''Return the words of a search text (every one must match, the last as a prefix).'''
+    return [term.lower() for term in WORD.findall(text)][:MAX_TERMS]
+
+
+def owner_condition(owner, resource):
+    if resource == 'categories':
+        return Q(owner=owner) | Q(owner__isnull=True)
+    return Q(owner=owner)
+
+
+def match_expression(owner, terms, resources):
+    '''Return the FTS5 query of ``terms`` in the texts of ``owner`` of the given resources.
+
+    Every term is quoted, so the search text cannot use the query syntax nor
+    reach the ``owner`` and ``kind`` columns.
+    '''
+    words = ' '.join('"%s"' % term for term in terms[:-1])
+    words += ' "%s"*' % terms[-1]
+    return 'owner : (u%d OR shared) AND kind : (%s) AND body : (%s)' % (
+        owner.pk, ' OR '.join(resources), words.strip())
+
+
+def sqlite_search(owner, terms, resources, limit, offset):
+    sql = '''
+        SELECT rowid, bm25({table}, 0.0, 0.0, 1.0) AS rank FROM {table}
+        WHERE {table} MATCH %s
+        ORDER BY rank, rowid
+        LIMIT %s OFFSET %s
+    '''.format(table=TABLE)
+    names = list(SOURCES)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [match_expression(owner, terms, resources), limit, offset])
+        return [(names[rowid % SLOTS], rowid // SLOTS, round(-rank, 6)) for rowid, rank in cursor.fetchall()]
+
+
+def mysql_search(owner, terms, resources, limit, offset):
+    against = ' '.join('+%s' % term for term in terms) + '*'
+    selects = []
+    params = []
+    for resource in resources:
+        model, columns = SOURCES[resource]
+        match = 'MATCH (%s) AGAINST (%%s IN BOOLEAN MODE)' % ', '.join(columns)
+        owned = 'owner_id = %s' if resource != 'categories' else '(owner_id = %s OR owner_id IS NULL)'
+        selects.append("SELECT '%s' AS resource, id, %s AS score FROM %s WHERE %s AND %s" % (
+            resource, match, model._meta.db_table, owned, match))
+        params += [against, owner.pk, against]
+    sql = '%s ORDER BY score DESC, id LIMIT %%s OFFSET %%s' % ' UNION ALL '.join(selects)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [limit, offset])
+        return [(resource, pk, round(score, 6)) for resource, pk, score in cursor.fetchall()]
+
+
+def scan_search(owner, terms, resources, limit, offset):
+    hits = []
+    for resource in resources:
+        model, columns = SOURCES[resource]
+        rows = model.objects.filter(owner_condition(owner, resource))
+        for term in terms:
+            condition = Q()
+            for column in columns:
+                condition |= Q(**{column + '__icontains': term})
+            rows = rows.filter(condition)
+        hits += [(resource, pk, 0.0) for pk in rows.order_by('pk').values_list('pk', flat=True)[:limit + offset]]
+    return hits[offset:offset + limit]
+
+
+BACKENDS = {'sqlite': sqlite_search, 'mysql': mysql_search}
+
+
+def search(owner, text, resources=None, limit=20, offset=0):
+    '''Return the ``(resource, id, score)`` of the texts of ``owner`` that match ``text``, best first.'''
+    terms = terms_of(text)
+    resources = [resource for resource in SOURCES if resources is None or resource in resources]
+    if not terms or not resources:
+        return []
+    return BACKENDS.get(connection.vendor, scan_search)(owner, terms, resources, limit, offset)
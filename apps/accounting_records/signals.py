@@ -0,0 +1,132 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete, pre_save
+from django.db.models import Q
+from django.dispatch import receiver
+from django.utils import timezone
+from mptt.signals import node_moved
+
+from . import budgets, images, search, summaries, versioning
+from .models import Account, Budget, Category, Customer, MethodOfPayment, Records, Tombstone
+
+
+@receiver(pre_delete, sender=Account)
+def detach_account_summary(sender, instance, **kwargs):
+    summaries.detach(account_id=instance.pk)
+
+
+@receiver(pre_delete, sender=Category)
+def detach_category_summary(sender, instance, **kwargs):
+    summaries.detach(category_id=instance.pk)
+
+
+# the records of a deleted method of payment go with it (CASCADE): deleted
+# here first, so their removal is posted like any other
+@receiver(pre_delete, sender=MethodOfPayment)
+def delete_method_of_payment_records(sender, instance, **kwargs):
+    Records.objects.filter(method_of_payment_id=instance.pk).delete()
+
+
+# the records left without their account or category (SET_NULL) change
+# without a save: the delta sync only sends them again with a newer updated_at
+@receiver(pre_delete, sender=Account)
+def touch_account_records(sender, instance, **kwargs):
+    Records.objects.filter(Q(account_id=instance.pk) | Q(destination_account_id=instance.pk)).update(
+        updated_at=timezone.now())
+
+
+@receiver(pre_delete, sender=Category)
+def touch_category_records(sender, instance, **kwargs):
+    Records.objects.filter(category_id=instance.pk).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(node_moved, sender=Category)
+def bump_categories_version(sender, instance, **kwargs):
+    versioning.bump(instance.owner_id, 'categories')
+
+
+# a moved or deleted category changes what the budgets of its ancestors count
+@receiver(post_delete, sender=Category)
+@receiver(node_moved, sender=Category)
+def rebuild_budgets(sender, instance, **kwargs):
+    # the shared categories can hold the budgets of any user
+    affected = Budget.objects.all() if instance.owner_id is None else Budget.objects.filter(owner_id=instance.owner_id)
+    budgets.rebuild(affected)
+
+
+@receiver(post_save, sender=Budget)
+def rebuild_budget_spend(sender, instance, **kwargs):
+    budgets.rebuild(Budget.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Budget)
+@receiver(post_delete, sender=Budget)
+def bump_budgets_version(sender, instance, **kwargs):
+    versioning.bump(instance.owner_id, 'budgets')
+
+
+@receiver(post_save, sender=Account)
+@receiver(post_delete, sender=Account)
+def bump_accounts_version(sender, instance, **kwargs):
+    versioning.bump(instance.owner_id, 'accounts')
+
+
+@receiver(post_save, sender=MethodOfPayment)
+@receiver(post_delete, sender=MethodOfPayment)
+def bump_methods_of_payment_version(sender, instance, **kwargs):
+    versioning.bump(instance.owner_id, 'methods_of_payment')
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def bump_customers_version(sender, instance, **kwargs):
+    versioning.bump(instance.owner_id, 'customers')
+
+
+@receiver(pre_save, sender=Records)
+@receiver(pre_save, sender=Customer)
+def reset_upload_renditions(sender, instance, **kwargs):
+    # a newly assigned upload is not committed to the storage yet
+    for field in images.fields_of(sender):
+        upload = getattr(instance, field)
+        if not upload or not upload._committed:
+            for derived in ('thumbnail', 'preview', 'width', 'height', 'size'):
+                setattr(instance, '%s_%s' % (field, derived), None)
+
+
+@receiver(post_save, sender=Records)
+@receiver(post_save, sender=Customer)
+def schedule_upload_renditions(sender, instance, **kwargs):
+    for field in images.fields_of(sender):
+        if getattr(instance, field) and getattr(instance, field + '_size') is None:
+            images.schedule(sender, instance.pk, field)
+
+
+# resources of the delta sync, by model
+SYNC_RESOURCES = {
+    Account: 'accounts',
+    Category: 'categories',
+    MethodOfPayment: 'methods_of_payment',
+    Records: 'records',
+}
+
+
+@receiver(post_delete, sender=Account)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=MethodOfPayment)
+@receiver(post_delete, sender=Records)
+def leave_tombstone(sender, instance, **kwargs):
+    Tombstone.objects.create(owner_id=instance.owner_id, resource=SYNC_RESOURCES[sender], object_id=instance.pk)
+
+
+@receiver(post_migrate)
+def install_search_index(sender, using, **kwargs):
+    if sender.name == 'apps.accounting_records':
+        search.install(using)
+
+
+@receiver(connection_created)
+def warm_up_search_index(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        search.warm_up(connection)
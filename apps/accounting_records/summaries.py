@@ -0,0 +1,196 @@
+'''Monthly summary of the records, maintained incrementally.
+
+:func:`apply_entries` is called by the posting of the records with the entries
+added and removed and updates one ``MonthlySummary`` row per distinct
+(owner, account, category, type, month). :func:`rebuild` recomputes the whole
+table from the records to verify it.
+'''
+import calendar
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, IntegerField, Sum
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import TruncMonth
+
+from .models import MonthlySummary, Records
+
+
+KEY_FIELDS = ('owner_id', 'account_id', 'category_id', 'record_type', 'month')
+
+# postings touching more keys than this (bulk writes, the recurring
+# scheduler) are applied BULK_SIZE keys per query instead of key by key
+BULK_THRESHOLD = 20
+BULK_SIZE = 500
+
+# dimensions a report can be grouped by
+DIMENSIONS = {
+    'month': 'month',
+    'account': 'account_id',
+    'category': 'category_id',
+    'record_type': 'record_type',
+}
+
+
+def month_of(day):
+    return day.replace(day=1)
+
+
+def month_end(day):
+    return day.replace(day=calendar.monthrange(day.year, day.month)[1])
+
+
+def summary_deltas(added=(), removed=()):
+    '''Aggregate the entries into ``{key: [total, count]}`` deltas.'''
+    deltas = defaultdict(lambda: [Decimal('0'), 0])
+    for sign, entries in ((1, added), (-1, removed)):
+        for entry in entries:
+            key = (entry.owner_id, entry.account_id, entry.category_id, entry.record_type,
+                month_of(entry.payment_date))
+            deltas[key][0] += sign * entry.amount
+            deltas[key][1] += sign * entry.count
+    return {key: value for key, value in deltas.items() if value[0] or value[1]}
+
+
+def key_filter(key):
+    return dict(zip(KEY_FIELDS, key))
+
+
+def add_to_summary(key, total, count):
+    '''Add ``total`` and ``count`` to the summary row of ``key``, creating it if needed.'''
+    rows = MonthlySummary.objects.filter(**key_filter(key))
+    if rows.update(amount=F('amount') + total, records_count=F('records_count') + count):
+        if count < 0:
+            rows.filter(records_count__lte=0).delete()
+        return
+    try:
+        with transaction.atomic():
+            MonthlySummary.objects.create(amount=total, records_count=count, **key_filter(key))
+    except IntegrityError:
+        # created by a concurrent writer since the update above
+        rows.update(amount=F('amount') + total, records_count=F('records_count') + count)
+
+
+def by_pk(values, output_field):
+    '''Return ``CASE id WHEN <pk> THEN <value> ... END`` for the ``{pk: value}`` given.
+
+    Built as raw SQL: compiling a ``Case`` of hundreds of ``When`` takes longer
+    than running the update.
+    '''
+    params = [param for pk, value in values.items() for param in (pk, value)]
+    return RawSQL('CASE id %s END' % ' '.join(['WHEN %s THEN %s'] * len(values)), params, output_field=output_field)
+
+
+def add_many_to_summary(deltas):
+    '''Apply many deltas with a few queries per ``BULK_SIZE`` keys.
+
+    The existing rows are locked and incremented by one ``UPDATE`` and the
+    missing ones inserted by one ``INSERT``; if a concurrent writer created
+    some of them meanwhile, the chunk falls back to :func:`add_to_summary`.
+    '''
+    keys = sorted(deltas, key=str)
+    for start in range(0, len(keys), BULK_SIZE):
+        chunk = keys[start:start + BULK_SIZE]
+        rows = (MonthlySummary.objects.select_for_update()
+            .filter(owner_id__in={key[0] for key in chunk}, month__in={key[4] for key in chunk})
+            .values_list('pk', *KEY_FIELDS))
+        existing = {tuple(row[1:]): row[0] for row in rows}
+        found = [key for key in chunk if key in existing]
+        if found:
+            ids = [existing[key] for key in found]
+            MonthlySummary.objects.filter(pk__in=ids).update(
+                amount=F('amount') + by_pk({existing[key]: str(deltas[key][0]) for key in found},
+                    MonthlySummary._meta.get_field('amount')),
+                records_count=F('records_count') + by_pk({existing[key]: deltas[key][1] for key in found},
+                    IntegerField()))
+            if any(deltas[key][1] < 0 for key in found):
+                MonthlySummary.objects.filter(pk__in=ids, records_count__lte=0).delete()
+        missing = [key for key in chunk if key not in existing]
+        if not missing:
+            continue
+        try:
+            with transaction.atomic():
+                MonthlySummary.objects.bulk_create([MonthlySummary(amount=deltas[key][0],
+                    records_count=deltas[key][1], **key_filter(key)) for key in missing])
+        except IntegrityError:
+            for key in missing:
+                add_to_summary(key, *deltas[key])
+
+
+def apply_entries(added=(), removed=()):
+    '''Update the summary with the entries added to and removed from the ledger.'''
+    deltas = summary_deltas(added, removed)
+    if len(deltas) > BULK_THRESHOLD:
+        return add_many_to_summary(deltas)
+    for key in sorted(deltas, key=str):
+        add_to_summary(key, *deltas[key])
+
+
+def detach(**lookup):
+    '''Move the summary rows of a deleted account or category to the "none" key.
+
+    Deleting an account or a category sets the field to ``NULL`` on its
+    records, so their totals are merged into the rows without one.
+    '''
+    field, value = next(iter(lookup.items()))
+    with transaction.atomic():
+        for row in MonthlySummary.objects.filter(**lookup).values(*KEY_FIELDS, 'amount', 'records_count'):
+            row[field] = None
+            add_to_summary(tuple(row[name] for name in KEY_FIELDS), row['amount'], row['records_count'])
+        MonthlySummary.objects.filter(**lookup).delete()
+
+
+def computed_rows(queryset=None):
+    '''Yield the summary rows computed from the records with one grouped query.'''
+    queryset = Records.objects.all() if queryset is None else queryset
+    rows = (queryset.order_by()
+        .annotate(month=TruncMonth('payment_date'))
+        .values('owner_id', 'account_id_id', 'category_id_id', 'record_type', 'month')
+        .annotate(total=Sum('amount'), count=Count('id')))
+    for row in rows.iterator():
+        yield MonthlySummary(owner_id=row['owner_id'], account_id=row['account_id_id'],
+            category_id=row['category_id_id'], record_type=row['record_type'], month=row['month'],
+            amount=row['total'], records_count=row['count'])
+
+
+def differences(queryset=None):
+    '''Return ``(key, stored, computed)`` for every row where the summary is wrong.
+
+    ``stored`` and ``computed`` are ``(amount, records_count)`` tuples or ``None``.
+    '''
+    stored = {tuple(row[:5]): tuple(row[5:]) for row in
+        MonthlySummary.objects.values_list(*KEY_FIELDS, 'amount', 'records_count').iterator()}
+    result = []
+    for summary in computed_rows(queryset):
+        key = tuple(getattr(summary, name) for name in KEY_FIELDS)
+        computed = (summary.amount, summary.records_count)
+        value = stored.pop(key, None)
+        if value != computed:
+            result.append((key, value, computed))
+    result.extend((key, value, None) for key, value in stored.items())
+    return result
+
+
+def rebuild(batch_size=1000):
+    '''Recompute the whole summary from the records. Returns the number of rows.'''
+    with transaction.atomic():
+        MonthlySummary.objects.all().delete()
+        rows = MonthlySummary.objects.bulk_create(computed_rows(), batch_size=batch_size)
+    return len(rows)
+
+
+def report(owner, since=None, until=None, group_by=('month', 'record_type'), **filters):
+    '''Return the totals of ``owner`` between the months ``since`` and ``until``.
+
+    The rows are grouped by the given :data:`DIMENSIONS`; ``filters`` are
+    applied to the summary (e.g. ``account_id=3``).
+    '''
+    rows = MonthlySummary.objects.filter(owner=owner, **filters)
+    if since is not None:
+        rows = rows.filter(month__gte=month_of(since))
+    if until is not None:
+        rows = rows.filter(month__lte=month_of(until))
+    columns = [DIMENSIONS[name] for name in group_by]
+    return (rows.order_by(*columns).values(*columns)
+        .annotate(total=Sum('amount'), count=Sum('records_count')))
@@ -1,3 +1,950 @@
-from django.test import TestCase
+import functools
+import io
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, models
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+
+from apps.backends.sqlite3.base import DatabaseWrapper
+
+from . import (balances, benchmarks, budgets, generator, images, importers, posting, reconciliation, recurring,
+    search, summaries, tree)
+from .models import (Account, BalanceCheckpoint, Budget, BudgetAlert, BudgetSpend, Category, Customer, MethodOfPayment,
+    MonthlySummary, Records, RecurringRecord)
+
+
+class BalancePostingTests(TestCase):
+    '''The account balance follows every create, edit and delete of its records'''
+
+    def setUp(self):
+        self.user = User.objects.create_user('diogenes', password='tonel')
+        self.account = Account.objects.create(owner=self.user, name='Caja', amount=Decimal('1000.00'))
+        self.other = Account.objects.create(owner=self.user, name='Banco', amount=Decimal('500.00'))
+        self.category = Category.objects.create(owner=self.user, name='Vivienda')
+
+    def record(self, **kwargs):
+        values = {'owner': self.user, 'account_id': self.account, 'category_id': self.category,
+            'record_type': Records.RecordType.GASTO, 'amount': Decimal('100.00')}
+        values.update(kwargs)
+        return Records.objects.create(**values)
+
+    def balance(self, account):
+        return Account.objects.get(pk=account.pk).amount
+
+    def test_create_posts_expense_and_income(self):
+        self.record(amount=Decimal('100.00'))
+        self.record(record_type=Records.RecordType.INGRESO, amount=Decimal('30.50'))
+        self.assertEqual(self.balance(self.account), Decimal('930.50'))
+
+    def test_deleting_a_method_of_payment_posts_its_records(self):
+        method = MethodOfPayment.objects.create(owner=self.user, name='Tarjeta')
+        Budget.objects.create(owner=self.user, category=self.category, amount=Decimal('500.00'))
+        self.record(method_of_payment_id=method, payment_date=date(2025, 1, 10))
+        self.record(payment_date=date(2025, 1, 20))
+        balances.build_checkpoints(self.account.pk, date(2025, 1, 31))
+        method.delete()
+        self.assertEqual(self.balance(self.account), Decimal('900.00'))
+        self.assertEqual(balances.balance_at(self.account.pk, date(2025, 1, 31)), Decimal('900.00'))
+        self.assertEqual((summaries.differences(), budgets.differences()), ([], []))
+
+    def test_deleting_the_user_leaves_no_derived_rows(self):
+        Budget.objects.create(owner=self.user, category=self.category, amount=Decimal('500.00'))
+        self.record()
+        self.user.delete()
+        self.assertFalse(MonthlySummary.objects.exists() or BudgetSpend.objects.exists())
+        self.assertEqual((summaries.differences(), budgets.differences()), ([], []))
+
+    def test_create_touches_the_account_with_one_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.record()
+        table = Account._meta.db_table
+        account_queries = [query['sql'] for query in queries if table in query['sql']]
+        self.assertEqual(len(account_queries), 1)
+        self.assertTrue(account_queries[0].startswith('UPDATE'))
+
+    def test_edit_amount_and_type(self):
+        record = self.record(amount=Decimal('100.00'))
+        record.update(amount=Decimal('40.00'))
+        self.assertEqual(self.balance(self.account), Decimal('960.00'))
+        record.update(record_type=Records.RecordType.INGRESO)
+        self.assertEqual(self.balance(self.account), Decimal('1040.00'))
+
+    def test_edit_moves_record_between_accounts(self):
+        record = self.record(amount=Decimal('100.00'))
+        record.account_id = self.other
+        record.save()
+        self.assertEqual(self.balance(self.account), Decimal('1000.00'))
+        self.assertEqual(self.balance(self.other), Decimal('400.00'))
+
+    def test_edit_uses_stored_values_not_stale_instance(self):
+        record = self.record(amount=Decimal('100.00'))
+        stale = Records.objects.get(pk=record.pk)
+        record.update(amount=Decimal('10.00'))
+        stale.update(amount=Decimal('20.00'))
+        self.assertEqual(self.balance(self.account), Decimal('980.00'))
+
+    def test_delete_reverses_record(self):
+        record = self.record(amount=Decimal('100.00'))
+        record.delete()
+        self.assertEqual(self.balance(self.account), Decimal('1000.00'))
+
+    def test_queryset_delete_and_update(self):
+        for amount in ('10.00', '20.00', '30.00'):
+            self.record(amount=Decimal(amount))
+        self.record(account_id=self.other, amount=Decimal('5.00'))
+        Records.objects.filter(amount__gte=Decimal('20.00')).update(account_id=self.other)
+        self.assertEqual(self.balance(self.account), Decimal('990.00'))
+        self.assertEqual(self.balance(self.other), Decimal('445.00'))
+        # bulk_update updates the foreign keys by column
+        moved = list(Records.objects.filter(account_id=self.other))
+        for record in moved:
+            record.account_id = self.account
+        Records.objects.bulk_update(moved, ['account_id'])
+        self.assertEqual(self.balance(self.account), Decimal('935.00'))
+        Records.objects.all().delete()
+        self.assertEqual(self.balance(self.account), Decimal('1000.00'))
+        self.assertEqual(self.balance(self.other), Decimal('500.00'))
+
+    def test_record_without_account(self):
+        record = self.record(account_id=None)
+        record.update(amount=Decimal('1.00'))
+        record.delete()
+        self.assertEqual(self.balance(self.account), Decimal('1000.00'))
+
+    def transfer(self, **kwargs):
+        return self.record(record_type=Records.RecordType.TRANSFERENCIA, destination_account_id=self.other, **kwargs)
+
+    def test_journal_lines_are_balanced(self):
+        for record_type in Records.RecordType.values:
+            entry = posting.Entry(self.user.pk, self.account.pk, None, record_type, Decimal('7.00'), date.today(), 1,
+                self.other.pk)
+            lines = posting.journal_lines(entry)
+            self.assertEqual(sum(line.debit for line in lines), sum(line.credit for line in lines))
+            self.assertEqual(sum(line.debit for line in lines), Decimal('7.00'))
+
+    def test_transfer_moves_the_amount_between_the_accounts(self):
+        with CaptureQueriesContext(connection) as queries:
+            record = self.transfer(amount=Decimal('100.00'))
+        table = Account._meta.db_table
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE "%s"' % table)]), 2)
+        self.assertEqual(self.balance(self.account), Decimal('900.00'))
+        self.assertEqual(self.balance(self.other), Decimal('600.00'))
+        record.update(amount=Decimal('40.00'))
+        self.assertEqual(self.balance(self.account), Decimal('960.00'))
+        self.assertEqual(self.balance(self.other), Decimal('540.00'))
+        # reversed: the other account pays
+        record.update(account_id=self.other, destination_account_id=self.account)
+        self.assertEqual(self.balance(self.account), Decimal('1040.00'))
+        self.assertEqual(self.balance(self.other), Decimal('460.00'))
+        record.update(record_type=Records.RecordType.GASTO)
+        self.assertEqual(self.balance(self.account), Decimal('1000.00'))
+        self.assertEqual(self.balance(self.other), Decimal('460.00'))
+        Records.objects.filter(pk=record.pk).update(record_type=Records.RecordType.TRANSFERENCIA)
+        record.delete()
+        self.assertEqual(self.balance(self.account), Decimal('1000.00'))
+        self.assertEqual(self.balance(self.other), Decimal('500.00'))
+
+    def test_transfer_to_a_deleted_account_left_the_ledger(self):
+        record = self.transfer(amount=Decimal('100.00'))
+        self.other.delete()
+        self.assertEqual(self.balance(self.account), Decimal('900.00'))
+        record.refresh_from_db()
+        self.assertIsNone(record.destination_account_id)
+        record.delete()
+        self.assertEqual(self.balance(self.account), Decimal('1000.00'))
+
+
+class MonthlySummaryTests(TestCase):
+    '''The monthly summary is kept equal to a full recomputation from the records'''
+
+    def setUp(self):
+        self.user = User.objects.create_user('diogenes', password='tonel')
+        self.account = Account.objects.create(owner=self.user, name='Caja')
+        self.other = Account.objects.create(owner=self.user, name='Banco')
+        self.category = Category.objects.create(owner=self.user, name='Vivienda')
+
+    def record(self, **kwargs):
+        values = {'owner': self.user, 'account_id': self.account, 'category_id': self.category,
+            'record_type': Records.RecordType.GASTO, 'amount': Decimal('100.00'), 'payment_date': date(2025, 1, 15)}
+        values.update(kwargs)
+        return Records.objects.create(**values)
+
+    def test_create_edit_delete(self):
+        first = self.record()
+        second = self.record(category_id=None, amount=Decimal('5.00'))
+        self.record(record_type=Records.RecordType.INGRESO, payment_date=date(2025, 2, 1))
+        first.update(payment_date=date(2025, 2, 10), account_id=self.other)
+        second.delete()
+        self.assertEqual(summaries.differences(), [])
+        self.assertEqual(MonthlySummary.objects.count(), 2)
+
+    def test_bulk_paths_and_deleted_account(self):
+        for day in range(1, 11):
+            self.record(payment_date=date(2025, 3, day), category_id=None if day % 2 else self.category)
+        Records.objects.filter(payment_date__day__gt=5).update(amount=Decimal('1.00'))
+        Records.objects.filter(payment_date__day__lt=3).delete()
+        self.other.delete()
+        self.account.delete()
+        self.assertEqual(summaries.differences(), [])
+
+    def test_report_groups_the_summary(self):
+        self.record(amount=Decimal('10.00'))
+        self.record(amount=Decimal('15.00'), payment_date=date(2025, 1, 31))
+        self.record(amount=Decimal('7.00'), payment_date=date(2025, 2, 1))
+        rows = list(summaries.report(self.user, since=date(2025, 1, 1), until=date(2025, 1, 1), group_by=['category']))
+        self.assertEqual(rows, [{'category_id': self.category.pk, 'total': Decimal('25.00'), 'count': 2}])
+
+
+class BalanceCheckpointTests(TestCase):
+    '''The balance at a date read from the checkpoints equals the sum of the records'''
+
+    def setUp(self):
+        self.user = User.objects.create_user('diogenes', password='tonel')
+        self.account = Account.objects.create(owner=self.user, name='Caja', amount=Decimal('1000.00'))
+        for day in range(0, 120, 7):
+            self.record(payment_date=date(2025, 1, 3) + timedelta(days=day),
+                record_type=Records.RecordType.INGRESO if day % 3 else Records.RecordType.GASTO)
+        self.assertEqual(balances.build_checkpoints(self.account.pk, date(2025, 3, 31)), 3)
+
+    def record(self, **kwargs):
+        values = {'owner': self.user, 'account_id': self.account, 'amount': Decimal('10.00'),
+            'payment_date': date(2025, 2, 14)}
+        values.update(kwargs)
+        return Records.objects.create(**values)
+
+    def expected(self, day):
+        balance = Account.objects.get(pk=self.account.pk).amount
+        for record in Records.objects.filter(account_id=self.account, payment_date__gt=day):
+            balance -= posting.signed_amount(record.record_type, record.amount)
+        for record in balances.transfers_in(self.account.pk).filter(payment_date__gt=day):
+            balance -= record.amount
+        return balance
+
+    def assertBalances(self):
+        for day in range(-5, 130, 4):
+            day = date(2025, 1, 1) + timedelta(days=day)
+            self.assertEqual(balances.balance_at(self.account.pk, day), self.expected(day), day)
+
+    def test_balance_at_any_date(self):
+        self.assertBalances()
+
+    def test_backdated_edits_move_the_later_checkpoints(self):
+        self.record(payment_date=date(2025, 1, 20), amount=Decimal('55.00'))
+        record = self.record(payment_date=date(2025, 3, 2), record_type=Records.RecordType.INGRESO)
+        record.update(payment_date=date(2024, 12, 31))
+        Records.objects.filter(payment_date__month=2).delete()
+        self.assertBalances()
+        checkpoint = BalanceCheckpoint.objects.get(account=self.account, period_end=date(2025, 2, 28))
+        self.assertEqual(checkpoint.balance, self.expected(date(2025, 2, 28)))
+
+    def test_direct_change_of_the_balance(self):
+        self.account.adjust(Decimal('2000.00'))
+        self.assertBalances()
+
+    def test_transfers_move_the_checkpoints_of_both_accounts(self):
+        other = Account.objects.create(owner=self.user, name='Banco', amount=Decimal('300.00'))
+        self.record(account_id=other, record_type=Records.RecordType.TRANSFERENCIA, destination_account_id=self.account,
+            payment_date=date(2025, 1, 10), amount=Decimal('75.00'))
+        self.record(record_type=Records.RecordType.TRANSFERENCIA, destination_account_id=other,
+            payment_date=date(2025, 3, 1), amount=Decimal('20.00'))
+        self.assertBalances()
+        posted = list(self.account.checkpoints.values_list('period_end', 'balance'))
+        balances.build_checkpoints(self.account.pk, date(2025, 3, 31))
+        self.assertEqual(posted, list(self.account.checkpoints.values_list('period_end', 'balance')))
+        self.assertEqual(balances.balance_at(other.pk, date(2025, 2, 1)), Decimal('225.00'))
+
+    def test_running_balances(self):
+        records = list(Records.objects.filter(account_id=self.account).order_by('payment_date', 'id')[5:9])
+        expected = [self.expected(record.payment_date) for record in records]
+        with self.assertNumQueries(2):
+            self.assertEqual(balances.running_balances(self.account.pk, records), expected)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), IMAGE_WORKERS=0)
+class UploadProcessingTests(TestCase):
+    '''Uploads get a thumbnail, a preview and their metadata once the save commits'''
+
+    def setUp(self):
+        self.user = User.objects.create_user('diogenes', password='tonel')
+
+    def upload(self, name, size=(1600, 900), mode='RGBA'):
+        output = io.BytesIO()
+        Image.new(mode, size, 'red').save(output, 'PNG')
+        return SimpleUploadedFile(name, output.getvalue())
+
+    def test_voucher_renditions(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            record = Records.objects.create(owner=self.user, amount=Decimal('1.00'), voucher=self.upload('ticket.png'))
+            saved_at = record.updated_at
+        record.refresh_from_db()
+        self.assertEqual((record.voucher_width, record.voucher_height), (1600, 900))
+        # the delta sync sends the record again with its renditions
+        self.assertGreater(record.updated_at, saved_at)
+        self.assertEqual(record.voucher_size, record.voucher.size)
+        with Image.open(record.voucher_thumbnail) as thumbnail:
+            self.assertEqual((thumbnail.format, thumbnail.size), ('JPEG', (240, 135)))
+        with Image.open(record.voucher_preview) as preview:
+            self.assertEqual(preview.size, (1280, 720))
+
+        # a new upload replaces the renditions, a non-image only gets its size
+        record.voucher = SimpleUploadedFile('ticket.pdf', b'%PDF-1.4 not an image')
+        with self.captureOnCommitCallbacks(execute=True):
+            record.save()
+        record.refresh_from_db()
+        self.assertFalse(record.voucher_thumbnail)
+        self.assertEqual((record.voucher_width, record.voucher_size), (None, 21))
+
+        # saving without a new upload does not queue anything
+        with mock.patch.object(images, 'schedule') as schedule:
+            record.update(note='pagado')
+        schedule.assert_not_called()
+
+    def test_pending_uploads_are_processed_by_the_command(self):
+        customer = Customer.objects.create(owner=self.user, name='Cliente', img=self.upload('logo.png', mode='RGB'))
+        self.assertEqual(list(images.pending(Customer, 'img')), [customer])
+        call_command('process_images', stdout=io.StringIO())
+        customer.refresh_from_db()
+        self.assertEqual(customer.img_width, 1600)
+        self.assertTrue(customer.img_thumbnail)
+        self.assertEqual(list(images.pending(Customer, 'img')), [])
+
+
+class RecurringRecordTests(TestCase):
+    '''The scheduler creates each due occurrence once and posts it like any record'''
+
+    def setUp(self):
+        self.user = User.objects.create_user('diogenes', password='tonel')
+        self.account = Account.objects.create(owner=self.user, name='Caja', amount=Decimal('1000.00'))
+        self.category = Category.objects.create(owner=self.user, name='Vivienda')
+
+    def template(self, **kwargs):
+        values = {'owner': self.user, 'account': self.account, 'category': self.category,
+            'amount': Decimal('100.00'), 'start_date': date(2025, 1, 31)}
+        values.update(kwargs)
+        return RecurringRecord.objects.create(**values)
+
+    def dates(self, template):
+        return list(template.records.order_by('payment_date').values_list('payment_date', flat=True))
+
+    def test_catch_up_is_posted_and_idempotent(self):
+        rent = self.template()
+        salary = self.template(record_type=Records.RecordType.INGRESO, amount=Decimal('250.00'),
+            frequency=RecurringRecord.Frequency.SEMANAL, interval=2, start_date=date(2025, 3, 1))
+        self.assertEqual(recurring.materialize(date(2025, 4, 30), chunk_size=1), (2, 9))
+        self.assertEqual(self.dates(rent), [date(2025, 1, 31), date(2025, 2, 28), date(2025, 3, 31), date(2025, 4, 30)])
+        self.assertEqual(self.dates(salary)[-1], date(2025, 4, 26))
+        self.assertEqual(Account.objects.get(pk=self.account.pk).amount, Decimal('1850.00'))
+        self.assertEqual(summaries.differences(), [])
+        self.assertEqual(recurring.materialize(date(2025, 4, 30)), (0, 0))
+        rent.refresh_from_db()
+        self.assertEqual(rent.next_date, date(2025, 5, 31))
+
+    def test_catch_up_of_many_accounts_keeps_checkpoints_and_summary(self):
+        # enough accounts and months for the bulk paths of the posting
+        accounts = [Account.objects.create(owner=self.user, name='Cuenta %d' % n) for n in range(25)]
+        for n, account in enumerate(accounts):
+            Records.objects.create(owner=self.user, account_id=account, record_type=Records.RecordType.INGRESO,
+                amount=Decimal('500.00'), payment_date=date(2024, 12, 1))
+            balances.build_checkpoints(account.pk, date(2025, 6, 30))
+            self.template(account=account, amount=Decimal(10 + n), start_date=date(2025, 1, 15))
+        self.assertEqual(recurring.materialize(date(2025, 6, 30)), (25, 150))
+        self.assertEqual(summaries.differences(), [])
+        for n, account in enumerate(accounts):
+            self.assertEqual(Account.objects.get(pk=account.pk).amount, Decimal(500 - 6 * (10 + n)))
+            posted = list(account.checkpoints.values_list('period_end', 'balance'))
+            balances.build_checkpoints(account.pk, date(2025, 6, 30))
+            self.assertEqual(posted, list(account.checkpoints.values_list('period_end', 'balance')))
+
+    def test_recurring_transfer(self):
+        savings = Account.objects.create(owner=self.user, name='Ahorros')
+        self.template(record_type=Records.RecordType.TRANSFERENCIA, destination_account=savings, category=None)
+        self.assertEqual(recurring.materialize(date(2025, 3, 31)), (1, 3))
+        self.assertEqual(Account.objects.get(pk=self.account.pk).amount, Decimal('700.00'))
+        self.assertEqual(Account.objects.get(pk=savings.pk).amount, Decimal('300.00'))
+
+    def test_end_date_deactivates_the_template(self):
+        yearly = self.template(frequency=RecurringRecord.Frequency.ANUAL, start_date=date(2024, 2, 29),
+            end_date=date(2026, 12, 31))
+        call_command('materialize_recurring', '--until', '2030-01-01', stdout=io.StringIO())
+        yearly.refresh_from_db()
+        self.assertEqual(self.dates(yearly), [date(2024, 2, 29), date(2025, 2, 28), date(2026, 2, 28)])
+        self.assertFalse(yearly.active)
+
+    def test_failed_chunk_is_rolled_back(self):
+        rent = self.template()
+        with mock.patch.object(recurring.posting, 'post', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                recurring.materialize(date(2025, 3, 31))
+        self.assertEqual(self.dates(rent), [])
+        self.assertEqual(recurring.materialize(date(2025, 3, 31)), (1, 3))
+        self.assertEqual(Account.objects.get(pk=self.account.pk).amount, Decimal('700.00'))
+
+
+class BudgetTests(TestCase):
+    '''The spend of a budget counts the expenses of its category and subcategories as they are posted'''
+
+    def setUp(self):
+        self.user = User.objects.create_user('diogenes', password='tonel')
+        self.account = Account.objects.create(owner=self.user, name='Caja', amount=Decimal('1000.00'))
+        self.home = Category.objects.create(owner=self.user, name='Hogar')
+        self.services = Category.objects.create(owner=self.user, name='Servicios', parent=self.home)
+        self.power = Category.objects.create(owner=self.user, name='Luz', parent=self.services)
+        self.leisure = Category.objects.create(owner=self.user, name='Ocio')
+        self.home_budget = Budget.objects.create(owner=self.user, category=self.home, amount=Decimal('100.00'),
+            thresholds='50,100')
+        self.power_budget = Budget.objects.create(owner=self.user, category=self.power, amount=Decimal('40.00'))
+
+    def record(self, **kwargs):
+        values = {'owner': self.user, 'account_id': self.account, 'category_id': self.power,
+            'amount': Decimal('30.00'), 'payment_date': date(2025, 3, 10)}
+        values.update(kwargs)
+        return Records.objects.create(**values)
+
+    def spent(self, budget, month=date(2025, 3, 1)):
+        return BudgetSpend.objects.filter(budget=budget, month=month).values_list('spent', flat=True).first()
+
+    def test_spend_follows_the_records_up_the_tree(self):
+        record = self.record()
+        self.record(category_id=self.services, amount=Decimal('5.00'))
+        self.record(record_type=Records.RecordType.INGRESO, amount=Decimal('500.00'))
+        self.record(category_id=self.leisure)
+        self.assertEqual((self.spent(self.home_budget), self.spent(self.power_budget)), (Decimal('35.00'), Decimal('30.00')))
+        record.update(amount=Decimal('10.00'), payment_date=date(2025, 4, 1))
+        self.assertEqual((self.spent(self.home_budget), self.spent(self.power_budget)), (Decimal('5.00'), Decimal('0.00')))
+        self.assertEqual(self.spent(self.power_budget, date(2025, 4, 1)), Decimal('10.00'))
+        Records.objects.filter(category_id=self.services).delete()
+        self.assertEqual(self.spent(self.home_budget), Decimal('0.00'))
+        self.assertEqual(budgets.differences(), [])
+
+    def test_owners_without_budgets_cost_one_query(self):
+        other = User.objects.create_user('alejandro')
+        entry = posting.Entry(other.pk, None, self.power.pk, Records.RecordType.GASTO, Decimal('1.00'),
+            date(2025, 3, 1), 1)
+        with self.assertNumQueries(1):
+            budgets.apply_entries(added=[entry])
+
+    def test_alerts_are_raised_once_per_threshold(self):
+        raised = []
+        budgets.budget_alert.connect(lambda alert, **kwargs: raised.append(alert.threshold), weak=False,
+            dispatch_uid='test')
+        self.addCleanup(budgets.budget_alert.disconnect, dispatch_uid='test')
+        self.record(amount=Decimal('20.00'))
+        self.assertEqual(raised, [])
+        with self.assertLogs('apps.accounting_records.budgets', 'INFO'):
+            record = self.record(amount=Decimal('35.00'))
+        self.assertEqual(sorted(raised), [50, 80, 100])
+        record.delete()
+        self.record(amount=Decimal('35.00'))
+        self.assertEqual(len(raised), 3)
+        alerts = BudgetAlert.objects.order_by('budget', 'threshold').values_list('budget', 'threshold', 'spent')
+        self.assertEqual(list(alerts), [(self.home_budget.pk, 50, Decimal('55.00')),
+            (self.power_budget.pk, 80, Decimal('55.00')), (self.power_budget.pk, 100, Decimal('55.00'))])
+
+    def test_new_budgets_and_tree_changes_are_rebuilt(self):
+        self.record()
+        leisure_budget = Budget.objects.create(owner=self.user, category=self.leisure, amount=Decimal('10.00'))
+        self.power.move_to(self.leisure)
+        self.assertEqual(self.spent(self.home_budget), None)
+        self.assertEqual(self.spent(leisure_budget), Decimal('30.00'))
+        self.services.delete()
+        self.assertEqual(budgets.differences(), [])
+        self.assertEqual(self.spent(leisure_budget), Decimal('30.00'))
+        self.leisure.delete()
+        self.assertFalse(BudgetSpend.objects.exists())
+
+    def test_status_reads_every_budget_with_one_query(self):
+        self.record(amount=Decimal('60.00'))
+        with self.assertNumQueries(1):
+            rows = budgets.status(self.user, date(2025, 3, 20))
+        self.assertEqual([(row['category_name'], row['spent'], row['percent'], row['reached']) for row in rows],
+            [('Hogar', Decimal('60.00'), Decimal('60.0'), [50]), ('Luz', Decimal('60.00'), Decimal('150.0'), [80, 100])])
+
+    def test_rebuild_command(self):
+        self.record()
+        BudgetSpend.objects.update(spent=0)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_budgets', '--check', stdout=io.StringIO())
+        call_command('rebuild_budgets', stdout=io.StringIO())
+        call_command('rebuild_budgets', '--check', stdout=io.StringIO())
+        self.assertEqual(self.spent(self.home_budget), Decimal('30.00'))
+
+
+class CategoryTreeTests(TestCase):
+    '''The cached category tree of each user and the subtree totals of its rollup'''
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('diogenes', password='tonel')
+        self.other = User.objects.create_user('alejandro')
+        self.account = Account.objects.create(owner=self.user, name='Caja', amount=Decimal('1000.00'))
+        self.home = Category.objects.create(owner=self.user, name='Hogar')
+        self.services = Category.objects.create(owner=self.user, name='Servicios', parent=self.home)
+        self.power = Category.objects.create(owner=self.user, name='Luz', parent=self.services)
+        self.leisure = Category.objects.create(owner=self.user, name='Ocio')
+        self.shared = Category.objects.create(name='Varios')
+        Category.objects.create(owner=self.other, name='Privada')
+
+    def record(self, category, amount, **kwargs):
+        values = {'owner': self.user, 'account_id': self.account, 'category_id': category,
+            'amount': Decimal(amount), 'payment_date': date(2025, 3, 10)}
+        values.update(kwargs)
+        return Records.objects.create(**values)
+
+    def names(self, nodes):
+        return [(node['name'], self.names(node['children'])) for node in nodes]
+
+    def test_rollup_totals_of_the_subtrees(self):
+        self.record(self.power, '30.00')
+        self.record(self.services, '5.00')
+        self.record(self.leisure, '7.00', payment_date=date(2025, 3, 1))
+        self.record(self.power, '500.00', record_type=Records.RecordType.INGRESO)
+        self.record(self.power, '11.00', payment_date=date(2025, 4, 1))
+        Records.objects.create(owner=self.other, category_id=self.shared, amount=Decimal('9.00'),
+            payment_date=date(2025, 3, 10))
+        march = {self.home.pk: (Decimal('0.00'), Decimal('35.00')),
+            self.services.pk: (Decimal('5.00'), Decimal('35.00')),
+            self.power.pk: (Decimal('30.00'), Decimal('30.00')),
+            self.leisure.pk: (Decimal('7.00'), Decimal('7.00'))}
+        # whole months come from the summary, the rest from the records
+        self.assertEqual(tree.rollup_totals(self.user, date(2025, 3, 1), date(2025, 3, 31)), march)
+        self.assertEqual(tree.rollup_totals(self.user, date(2025, 3, 1), date(2025, 3, 30)), march)
+        self.assertEqual(tree.rollup_totals(self.user)[self.home.pk], (Decimal('0.00'), Decimal('46.00')))
+        self.assertEqual(tree.rollup_totals(self.user, record_type=Records.RecordType.INGRESO),
+            {pk: (Decimal('500.00') if pk == self.power.pk else Decimal('0.00'), Decimal('500.00'))
+                for pk in (self.home.pk, self.services.pk, self.power.pk)})
+        home = tree.rollup(self.user, date(2025, 3, 1), date(2025, 3, 31))[0]
+        self.assertEqual((home['name'], home['own'], home['total']), ('Hogar', '0.00', '35.00'))
+
+    def test_rollup_reads_the_routed_database(self):
+        self.record(self.power, '30.00')
+        with mock.patch.object(tree.router, 'db_for_read', return_value='replica') as db_for_read, \
+                mock.patch.object(tree, 'connections', {'replica': connection}):
+            totals = tree.rollup_totals(self.user)
+        db_for_read.assert_called_with(Records)
+        self.assertEqual(totals[self.home.pk], (Decimal('0.00'), Decimal('30.00')))
+
+    def test_tree_is_cached_per_owner(self):
+        expected = [('Hogar', [('Servicios', [('Luz', [])])]), ('Ocio', []), ('Varios', [])]
+        self.assertEqual(self.names(tree.category_tree(self.user)), expected)
+        self.assertEqual(self.names(tree.category_tree(self.other)), [('Privada', []), ('Varios', [])])
+        with mock.patch.object(tree, 'build_tree') as build_tree:
+            self.assertEqual(self.names(tree.category_tree(self.user)), expected)
+        build_tree.assert_not_called()
+
+    def test_tree_changes_invalidate_the_cache(self):
+        # the version tokens are bumped when the transaction commits
+        tree.category_tree(self.user)
+        self.leisure.name = 'Viajes'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.leisure.save()
+        self.assertEqual(self.names(tree.category_tree(self.user)),
+            [('Hogar', [('Servicios', [('Luz', [])])]), ('Varios', []), ('Viajes', [])])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.power.move_to(self.leisure)
+        self.assertEqual(self.names(tree.category_tree(self.user)),
+            [('Hogar', [('Servicios', [])]), ('Varios', []), ('Viajes', [('Luz', [])])])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.services.delete()
+        self.assertEqual(self.names(tree.category_tree(self.user)),
+            [('Hogar', []), ('Varios', []), ('Viajes', [('Luz', [])])])
+        # the shared categories are in every tree
+        tree.category_tree(self.other)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shared.delete()
+        self.assertEqual(self.names(tree.category_tree(self.other)), [('Privada', [])])
+
+
+class StatementImportTests(TestCase):
+    '''CSV and OFX statements are parsed line by line and posted like any other record'''
+
+    OFX = ('OFXHEADER:100\nDATA:OFXSGML\n\n<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>'
+        '<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20250302120000[-3:ART]<TRNAMT>-1.234,50<NAME>Alquiler</STMTTRN>'
+        '<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20250305<TRNAMT>2500.00<NAME>Sueldo<MEMO>Marzo</STMTTRN>'
+        '</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>')
+
+    def setUp(self):
+        self.user = User.objects.create_user('diogenes', password='tonel')
+        self.account = Account.objects.create(owner=self.user, name='Caja', amount=Decimal('1000.00'))
+        self.category = Category.objects.create(owner=self.user, name='Comida')
+
+    def csv(self, *lines, header='Fecha,Importe,Concepto,Categoria,Tipo'):
+        return io.BytesIO('\n'.join((header,) + lines).encode())
+
+    def test_amounts_and_dates(self):
+        for value, amount in [('-1234.56', '-1234.56'), ('-1.234,56', '-1234.56'), ('1,234.56', '1234.56'),
+                ('$ 12,5', '12.50'), ('7', '7.00')]:
+            self.assertEqual(importers.parse_amount(value), Decimal(amount))
+        for value in ('2025-03-31', '31/03/2025', '20250331', '20250331120000[-3:ART]'):
+            self.assertEqual(importers.parse_date(value), date(2025, 3, 31))
+        with self.assertRaises(importers.StatementError):
+            importers.parse_amount('diez')
+        with self.assertRaises(importers.StatementError):
+            importers.parse_date('31-03-2025')
+
+    def test_csv_lines(self):
+        lines = list(importers.parse_csv(self.csv('2025-03-01,-10.00,Almuerzo,comida,', '', ' , , ',
+            '02/03/2025,"1.500,00",Sueldo,,ingreso', '2025-03-03,5.00,Reintegro,,gasto')))
+        self.assertEqual(lines, [
+            importers.StatementLine(date(2025, 3, 1), Decimal('-10.00'), 'Almuerzo', 'comida', None),
+            importers.StatementLine(date(2025, 3, 2), Decimal('1500.00'), 'Sueldo', '', Records.RecordType.INGRESO),
+            importers.StatementLine(date(2025, 3, 3), Decimal('5.00'), 'Reintegro', '', Records.RecordType.GASTO)])
+        with self.assertRaises(importers.StatementError):
+            list(importers.parse_csv(self.csv('2025-03-01,Almuerzo', header='fecha,concepto')))
+
+    def test_ofx_transactions_split_across_chunks(self):
+        with mock.patch.object(importers, 'ofx_tags', functools.partial(importers.ofx_tags, chunk_size=7)):
+            lines = list(importers.parse_ofx(io.BytesIO(self.OFX.encode('latin-1'))))
+        self.assertEqual(lines, [
+            importers.StatementLine(date(2025, 3, 2), Decimal('-1234.50'), 'Alquiler', '', None),
+            importers.StatementLine(date(2025, 3, 5), Decimal('2500.00'), 'Marzo', '', None)])
+        with self.assertRaises(importers.StatementError):
+            list(importers.parse_ofx(io.StringIO('<STMTTRN><TRNAMT>-1.00</STMTTRN>')))
+
+    def test_import_posts_the_records(self):
+        result = importers.import_statement(self.csv('2025-03-01,-10.00,Almuerzo,COMIDA,', '2025-03-02,0,Nada,,',
+            '2025-03-05,250.00,Sueldo,,', '2025-04-01,-40.00,Cena,Comida,'), self.user, self.account, batch_size=2)
+        self.assertEqual((result.rows, result.skipped), (3, 1))
+        self.assertEqual(Account.objects.get(pk=self.account.pk).amount, Decimal('1200.00'))
+        records = Records.objects.order_by('payment_date').values_list('record_type', 'amount', 'category_id')
+        self.assertEqual(list(records), [(Records.RecordType.GASTO, Decimal('10.00'), self.category.pk),
+            (Records.RecordType.INGRESO, Decimal('250.00'), None), (Records.RecordType.GASTO, Decimal('40.00'),
+                self.category.pk)])
+        self.assertEqual(summaries.differences(), [])
+        result = importers.import_statement(io.BytesIO(self.OFX.encode('latin-1')), self.user, self.account, 'ofx')
+        self.assertEqual(result.rows, 2)
+        self.assertEqual(Account.objects.get(pk=self.account.pk).amount, Decimal('2465.50'))
+
+    def test_a_bad_row_imports_nothing(self):
+        statement = self.csv('2025-03-01,-10.00,Almuerzo,,', '2025-03-02,-20.00,Cena,,', '2025-03-03,-,Nada,,')
+        with self.assertRaises(importers.StatementError):
+            importers.import_statement(statement, self.user, self.account, batch_size=1)
+        self.assertFalse(Records.objects.exists())
+        self.assertEqual(Account.objects.get(pk=self.account.pk).amount, Decimal('1000.00'))
+        self.assertFalse(MonthlySummary.objects.exists())
+        with self.assertRaises(importers.StatementError):
+            importers.import_statement(statement, self.user, self.account, 'qif')
+
+
+class GeneratorTests(TestCase):
+    '''The synthetic datasets are reproducible and posted like the real ones'''
+
+    def generate(self, prefix, seed=7):
+        call_command('generate_data', '--users', '2', '--records', '300', '--years', '1', '--category-depth', '3',
+            '--category-branching', '2', '--seed', str(seed), '--prefix', prefix, stdout=io.StringIO())
+        return [list(Records.objects.filter(owner__username=username).order_by('pk')
+            .values_list('payment_date', 'record_type', 'amount', 'note', 'account_id__name', 'category_id__name'))
+            for username in ('%s00000' % prefix, '%s00001' % prefix)]
+
+    def test_same_seed_same_data(self):
+        first = self.generate('uno')
+        self.assertEqual(first, self.generate('dos'))
+        self.assertNotEqual(first, self.generate('tres', seed=8))
+        self.assertEqual(len(first[0]), 300)
+        self.assertNotEqual(first[0], first[1])
+        self.assertTrue(all(date(2025, 1, 1) <= row[0] <= generator.END for row in first[0]))
+
+    def test_ledger_is_consistent(self):
+        self.generate('uno')
+        self.assertEqual(summaries.differences(), [])
+        account = Account.objects.filter(owner__username='uno00000').order_by('pk').first()
+        for checkpoint in account.checkpoints.all():
+            self.assertEqual(checkpoint.balance, balances.balance_at(account.pk, checkpoint.period_end))
+        categories = Category.objects.filter(owner__username='uno00000')
+        self.assertEqual(categories.count(), len(generator.CATEGORY_ROOTS) * 7)
+        for category in categories.filter(level=1):
+            self.assertEqual([child.pk for child in category.get_children()],
+                list(categories.filter(parent=category).order_by('name').values_list('pk', flat=True)))
+            self.assertEqual(category.get_descendant_count(), 2)
+
+    def test_benchmarks_compare_runs(self):
+        self.generate('uno')
+        owner = User.objects.get(username='uno00000')
+        baseline = benchmarks.run(owner, names=['api.records', 'import.csv'], repeat=2)
+        self.assertEqual([result['name'] for result in baseline], ['api.records', 'import.csv'])
+        self.assertEqual(baseline[0]['runs'], 2)
+        self.assertEqual(baseline[1]['rows'], benchmarks.IMPORT_SIZE)
+        self.assertEqual(Records.objects.filter(owner=owner).count(), 300)
+        comparison = benchmarks.compare(baseline, [dict(baseline[0], seconds=baseline[0]['seconds'] / 2)])
+        self.assertEqual(comparison, [('api.records', baseline[0]['seconds'], baseline[0]['seconds'] / 2, 0.5)])
+
+
+class QueryPlanTests(TestCase):
+    '''The main list, report and balance queries must search an index, not scan the table.
+
+    Seeds a ledger big enough for SQLite's planner (after ``ANALYZE``) to
+    prefer a full scan whenever no suitable index exists.
+    '''
+    users = 4
+    records_per_user = 5000
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(5)
+        cls.owners = [User.objects.create_user('user%d' % n) for n in range(cls.users)]
+        records = []
+        for owner in cls.owners:
+            accounts = [Account.objects.create(owner=owner, name='Cuenta %d' % n) for n in range(3)]
+            categories = [Category.objects.create(owner=owner, name='Categoria %d' % n) for n in range(8)]
+            for n in range(cls.records_per_user):
+                records.append(Records(owner=owner, account_id=rng.choice(accounts), category_id=rng.choice(categories),
+                    record_type=rng.choice(Records.RecordType.values[:2]), amount=Decimal(rng.randint(100, 99999)) / 100,
+                    payment_date=date(2023, 1, 1) + timedelta(days=rng.randrange(730))))
+        Records.objects.bulk_create(records, batch_size=2000)
+        summaries.rebuild()
+        cls.owner = cls.owners[0]
+        cls.account = Account.objects.filter(owner=cls.owner).first()
+        cls.category = Category.objects.filter(owner=cls.owner).first()
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('the plans are written for SQLite')
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertSearches(self, queryset, index, sorted_by_index=True):
+        plan = self.plan(queryset)
+        table = queryset.model._meta.db_table
+        self.assertTrue(any(step.startswith('SEARCH %s USING' % table) and index in step for step in plan),
+            'expected a search on %s, got %s' % (index, plan))
+        self.assertFalse(any(step.startswith('SCAN %s' % table) for step in plan), plan)
+        if sorted_by_index:
+            self.assertFalse(any('TEMP B-TREE' in step for step in plan), plan)
+
+    def page(self, queryset, after=None):
+        from apps.api.pagination import KeysetPagination
+        if after is not None:
+            queryset = queryset.filter(KeysetPagination().after(after))
+        return queryset.order_by('payment_date', 'id')[:101]
+
+    def test_records_list_pages(self):
+        records = Records.objects.filter(owner=self.owner)
+        self.assertSearches(self.page(records), 'records_owner_date_idx')
+        self.assertSearches(self.page(records, after=(date(2024, 6, 1), 1000)), 'records_owner_date_idx')
+        dated = records.filter(payment_date__gte=date(2024, 1, 1), payment_date__lte=date(2024, 3, 31))
+        self.assertSearches(self.page(dated), 'records_owner_date_idx')
+
+    def test_records_list_filters(self):
+        records = Records.objects.filter(owner=self.owner)
+        self.assertSearches(self.page(records.filter(account_id=self.account.pk)), 'records_account_date_idx')
+        self.assertSearches(self.page(records.filter(category_id=self.category.pk)), 'records_category_date_idx')
+        self.assertSearches(self.page(records.filter(record_type=Records.RecordType.INGRESO),
+            after=(date(2024, 6, 1), 1000)), 'records_owner_type_date_idx')
+
+    def test_monthly_report(self):
+        report = summaries.report(self.owner, since=date(2024, 1, 1), until=date(2024, 6, 1))
+        self.assertSearches(report, 'monthly_summary_key', sorted_by_index=False)
+
+    def test_balance_sums_are_covered(self):
+        balance = (Records.objects.filter(account_id=self.account.pk, payment_date__lte=date(2024, 3, 31))
+            .values('record_type').annotate(total=Sum('amount')))
+        self.assertSearches(balance, 'COVERING INDEX records_account_date_idx', sorted_by_index=False)
+        rollup = (Records.objects.filter(category_id=self.category.pk, payment_date__gte=date(2024, 1, 1))
+            .values('record_type').annotate(total=Sum('amount')))
+        self.assertSearches(rollup, 'COVERING INDEX records_category_date_idx', sorted_by_index=False)
+
+    def test_balance_sums_with_the_transfers_in(self):
+        day = date(2024, 3, 31)
+        total = (Records.objects.filter(balances.Q(payment_date__lte=day) & (balances.Q(account_id=self.account.pk)
+            | balances.Q(destination_account_id=self.account.pk, record_type=Records.RecordType.TRANSFERENCIA)))
+            .values('record_type').annotate(total=Sum(balances.signed_for(self.account.pk))))
+        plan = self.plan(total)
+        self.assertTrue(any('records_account_date_idx' in step for step in plan), plan)
+        self.assertTrue(any('records_destination_date_idx' in step for step in plan), plan)
+        self.assertFalse(any(step.startswith('SCAN') for step in plan), plan)
+
+    def test_changes_pages(self):
+        changed = (Records.objects.filter(owner=self.owner, updated_at__gte=timezone.now() - timedelta(days=1))
+            .order_by('updated_at', 'id')[:101])
+        self.assertSearches(changed, 'records_owner_updated_idx')
+
+
+class ConcurrentBalanceTests(TransactionTestCase):
+    '''Many threads writing to the same account must not lose any update'''
+
+    threads = 8
+    records_per_thread = 25
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('the threads need a test database shared between connections')
+
+    def test_concurrent_writes_on_one_account(self):
+        user = User.objects.create_user('diogenes', password='tonel')
+        account = Account.objects.create(owner=user, name='Caja', amount=Decimal('10000.00'))
+        errors = []
+
+        def worker(index):
+            try:
+                for n in range(self.records_per_thread):
+                    record_type = Records.RecordType.INGRESO if n % 5 == 0 else Records.RecordType.GASTO
+                    Records.objects.create(owner=user, account_id=account, record_type=record_type,
+                        amount=Decimal('3.00'), payment_date=date(2025, 1, 1 + n % 28))
+            except Exception as exc:  # reported in the main thread
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        # per thread: 5 incomes and 20 expenses of 3.00
+        expected = Decimal('10000.00') + self.threads * 15 * Decimal('-3.00')
+        self.assertEqual(Account.objects.get(pk=account.pk).amount, expected)
+        self.assertEqual(Records.objects.count(), self.threads * self.records_per_thread)
+
+
+class ReconciliationTests(TransactionTestCase):
+    '''The reconciliation finds the balances that no longer match their records and repairs them'''
+
+    def setUp(self):
+        self.user = User.objects.create_user('diogenes', password='tonel')
+        self.accounts = [Account.objects.create(owner=self.user, name='Cuenta %d' % n, amount=Decimal('100.00'))
+            for n in range(5)]
+        for n, account in enumerate(self.accounts):
+            Records.objects.create(owner=self.user, account_id=account, amount=Decimal(n + 1),
+                payment_date=date(2025, 1, 10))
+            Records.objects.create(owner=self.user, account_id=account, record_type=Records.RecordType.TRANSFERENCIA,
+                destination_account_id=self.accounts[n - 1], amount=Decimal('10.00'), payment_date=date(2025, 2, 10))
+            balances.build_checkpoints(account.pk, date(2025, 2, 28))
+
+    def drift(self, account, amount):
+        # behind the back of the posting
+        Account.objects.filter(pk=account.pk).update(amount=Decimal(amount))
+
+    def test_balances_match_their_records(self):
+        # an adjustment of the balance moves the opening balance with it
+        self.accounts[0].adjust(Decimal('500.00'))
+        result = reconciliation.run(full=True)
+        self.assertEqual((result.accounts, result.records, result.discrepancies), (5, 15, []))
+
+    def test_stale_saves_keep_the_balance(self):
+        stale = Account.objects.get(pk=self.accounts[0].pk)
+        Records.objects.create(owner=self.user, account_id=self.accounts[0], amount=Decimal('30.00'))
+        stale.name = 'Renombrada'
+        stale.save()
+        self.assertEqual(Account.objects.get(pk=stale.pk).amount, stale.amount)
+        self.assertEqual(stale.amount, Decimal('69.00'))
+        self.assertEqual(reconciliation.run(full=True).discrepancies, [])
+        # a stale balance written behind the model is drift
+        stale.amount = Decimal('99.00')
+        Account.objects.bulk_update([stale], ['amount'])
+        self.assertEqual([found.account_id for found in reconciliation.run(full=True).discrepancies], [stale.pk])
+
+    def test_repair(self):
+        self.drift(self.accounts[2], '1.00')
+        with self.assertRaises(CommandError):
+            call_command('reconcile_accounts', '--full', stdout=io.StringIO())
+        output = io.StringIO()
+        call_command('reconcile_accounts', '--full', '--repair', stdout=output)
+        self.assertIn('account %d: stored 1.00, records say 97.00 (repaired)' % self.accounts[2].pk, output.getvalue())
+        self.assertEqual(Account.objects.get(pk=self.accounts[2].pk).amount, Decimal('97.00'))
+        self.assertEqual(balances.balance_at(self.accounts[2].pk, date(2025, 1, 31)), Decimal('97.00'))
+        self.assertEqual(reconciliation.run(full=True).discrepancies, [])
+
+    def test_incremental_runs_read_the_accounts_that_may_have_changed(self):
+        self.assertEqual(reconciliation.run().accounts, 5)
+        self.assertEqual(reconciliation.run().accounts, 0)
+        other = Account.objects.create(owner=User.objects.create_user('alejandro'), name='Banco')
+        self.assertEqual(list(reconciliation.pending()), [other])
+        reconciliation.run()
+        # a balance written behind the model
+        self.drift(self.accounts[3], '0.00')
+        result = reconciliation.run()
+        self.assertEqual((result.accounts, [found.account_id for found in result.discrepancies]),
+            (1, [self.accounts[3].pk]))
+        self.assertEqual(list(reconciliation.pending()), [self.accounts[3]])
+        reconciliation.run(repair_them=True)
+        reconciliation.run()
+        # a record written behind the posting: every account of its owner is verified again
+        written = Records.objects.filter(account_id=self.accounts[1], record_type=Records.RecordType.GASTO)
+        models.QuerySet.update(written, amount=Decimal('50.00'), updated_at=timezone.now())
+        result = reconciliation.run()
+        self.assertEqual((result.accounts, [found.account_id for found in result.discrepancies]),
+            (5, [self.accounts[1].pk]))
+
+    def test_parallel_chunks(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('the workers need a test database shared between connections')
+        self.drift(self.accounts[0], '0.00')
+        self.drift(self.accounts[4], '0.00')
+        result = reconciliation.run(full=True, workers=2, chunk_size=2)
+        self.assertEqual((result.accounts, result.records), (5, 15))
+        self.assertEqual(sorted(found.account_id for found in result.discrepancies),
+            [self.accounts[0].pk, self.accounts[4].pk])
+
+
+class ProductionSQLiteTests(SimpleTestCase):
+    '''The backend of the production profile applies its pragmas and takes the write lock on BEGIN'''
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'production.sqlite3')
+        settings_dict = dict(connection.settings_dict, ENGINE='apps.backends.sqlite3', NAME=self.path, OPTIONS={
+            'timeout': 0, 'transaction_mode': 'IMMEDIATE',
+            'init_command': 'PRAGMA journal_mode = WAL; PRAGMA synchronous = NORMAL'})
+        self.db = DatabaseWrapper(settings_dict, alias='production')
+        self.addCleanup(self.db.close)
+
+    def test_pragmas_and_immediate_transactions(self):
+        with self.db.cursor() as cursor:
+            self.assertEqual(cursor.execute('PRAGMA journal_mode').fetchone(), ('wal',))
+            self.assertEqual(cursor.execute('PRAGMA synchronous').fetchone(), (1,))
+            cursor.execute('CREATE TABLE ledger (amount INTEGER)')
+        other = sqlite3.connect(self.path, timeout=0, isolation_level=None)
+        self.addCleanup(other.close)
+        self.db._start_transaction_under_autocommit()
+        # nothing written yet, but the lock is held: a second writer must wait
+        with self.assertRaisesMessage(sqlite3.OperationalError, 'database is locked'):
+            other.execute('BEGIN IMMEDIATE')
+        # while the readers are not blocked by the writer
+        self.assertEqual(other.execute('SELECT COUNT(*) FROM ledger').fetchone(), (0,))
+        self.db.connection.execute('ROLLBACK')
+
+    def test_search_table_is_looked_up_once_per_wrapper(self):
+        self.db.ensure_connection()
+        self.assertFalse(getattr(self.db, 'search_table_exists', False))
+        with self.db.cursor() as cursor:
+            cursor.execute(search.SQLITE_TABLE.format(table=search.TABLE))
+        self.db.close()
+        self.db.ensure_connection()
+        self.assertTrue(self.db.search_table_exists)
+        statements = []
+        self.db.connection.set_trace_callback(statements.append)
+        search.warm_up(self.db)
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn('sqlite_master', statements[0])
+        # migrated back: looked up again
+        self.db.connection.execute('DROP TABLE %s' % search.TABLE)
+        search.warm_up(self.db)
+        self.assertFalse(self.db.search_table_exists)
+
+    def test_unknown_transaction_mode(self):
+        with self.assertRaises(ImproperlyConfigured):
+            DatabaseWrapper(dict(self.db.settings_dict, OPTIONS={'transaction_mode': 'LATER'}), alias='production')
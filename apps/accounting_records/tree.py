@@ -0,0 +1,112 @@
+'''Category tree of a user and subtree rollups on the MPTT intervals.
+
+The serialized tree is cached per owner under the version tokens of the
+user's and the shared categories, so it is only rebuilt after a category is
+created, renamed, moved or deleted. The rollup totals come from a single
+query joining every category with the descendants inside its
+``lft``/``rght`` interval.
+'''
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connections, router
+from django.db.models import Q
+
+from . import summaries, versioning
+from .models import Category, MonthlySummary, Records
+
+
+TREE_TIMEOUT = 24 * 60 * 60
+
+
+def visible_categories(owner):
+    '''Categories of ``owner`` plus the shared ones (without owner).'''
+    return Category.objects.filter(Q(owner=owner) | Q(owner__isnull=True))
+
+
+def build_tree(owner):
+    '''Return the nested list of the categories visible to ``owner``.'''
+    nodes = {}
+    roots = []
+    rows = (visible_categories(owner).order_by('tree_id', 'lft')
+        .values('id', 'name', 'category_type', 'parent_id'))
+    for row in rows:
+        node = {'id': row['id'], 'name': row['name'], 'category_type': row['category_type'], 'children': []}
+        nodes[row['id']] = node
+        parent = nodes.get(row['parent_id'])
+        (parent['children'] if parent else roots).append(node)
+    return roots
+
+
+def category_tree(owner):
+    '''Return the cached tree of ``owner``, building it on a miss.'''
+    tokens = versioning.get_tokens([(owner.pk, 'categories'), (None, 'categories')])
+    key = 'category-tree:%s:%s:%s' % (owner.pk, tokens[owner.pk, 'categories'], tokens[None, 'categories'])
+    tree = cache.get(key)
+    if tree is None:
+        tree = build_tree(owner)
+        cache.set(key, tree, TREE_TIMEOUT)
+    return tree
+
+
+def whole_months(since, until):
+    '''True when the period starts on a first and ends on a last day of month.'''
+    starts = since is None or since.day == 1
+    ends = until is None or until == summaries.month_end(until)
+    return starts and ends
+
+
+def to_decimal(value):
+    # SQLite returns the sums of a raw query as floats
+    return Decimal(value).quantize(Decimal('0.01'))
+
+
+def rollup_totals(owner, since=None, until=None, record_type=Records.RecordType.GASTO):
+    '''Return ``{category_id: (own, subtree)}`` totals of ``owner`` in the period.
+
+    ``own`` sums the records of the category itself and ``subtree`` those of
+    the category and all its descendants. Periods made of whole months are
+    read from the monthly summary instead of the records. The query runs on
+    the database the router reads the records from (e.g. a replica).
+    '''
+    connection = connections[router.db_for_read(Records)]
+    category = Category._meta.db_table
+    if whole_months(since, until):
+        source, category_column, date_column = MonthlySummary._meta.db_table, 'category_id', 'month'
+    else:
+        source, category_column, date_column = Records._meta.db_table, 'category_id_id', 'payment_date'
+    conditions = ['r.owner_id = %s', 'r.record_type = %s']
+    params = [owner.pk, record_type]
+    if since is not None:
+        conditions.append('r.%s >= %%s' % date_column)
+        params.append(connection.ops.adapt_datefield_value(since))
+    if until is not None:
+        conditions.append('r.%s <= %%s' % date_column)
+        params.append(connection.ops.adapt_datefield_value(until))
+    sql = '''
+        SELECT a.id,
+            SUM(CASE WHEN d.id = a.id THEN r.amount ELSE 0 END),
+            SUM(r.amount)
+        FROM {category} a
+        JOIN {category} d ON d.tree_id = a.tree_id AND d.lft BETWEEN a.lft AND a.rght
+        JOIN {source} r ON r.{category_column} = d.id
+        WHERE (a.owner_id = %s OR a.owner_id IS NULL) AND {conditions}
+        GROUP BY a.id
+    '''.format(category=category, source=source, category_column=category_column,
+        conditions=' AND '.join(conditions))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [owner.pk] + params)
+        return {row[0]: (to_decimal(row[1]), to_decimal(row[2])) for row in cursor.fetchall()}
+
+
+def rollup(owner, since=None, until=None, record_type=Records.RecordType.GASTO):
+    '''Return the cached tree of ``owner`` with ``own`` and ``total`` amounts on every node.'''
+    totals = rollup_totals(owner, since, until, record_type)
+
+    def annotate(nodes):
+        result = []
+        for node in nodes:
+            own, total = totals.get(node['id'], (Decimal('0.00'), Decimal('0.00')))
+            result.append(dict(node, own=str(own), total=str(total), children=annotate(node['children'])))
+        return result
+    return annotate(category_tree(owner))
@@ -0,0 +1,53 @@
+'''Per-owner version tokens of the resources, kept in the cache.
+
+Cached data derived from a resource (e.g. the category tree of a user) is
+stored under a key that includes the current token; writes call :func:`bump`
+to issue a new token, so stale entries are never read again and simply
+expire. A lost token is replaced by a fresh one, which only costs a miss.
+'''
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def version_key(owner_id, resource):
+    return 'version:%s:%s' % (resource, owner_id)
+
+
+def new_token():
+    return '%x' % time.time_ns()
+
+
+def get_tokens(pairs):
+    '''Return ``{(owner_id, resource): token}`` for the given pairs with one cache lookup.'''
+    keys = {version_key(owner_id, resource): (owner_id, resource) for owner_id, resource in pairs}
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    for key in missing:
+        cache.add(key, new_token(), timeout=None)
+    if missing:
+        found.update(cache.get_many(missing))
+    return {pair: found[key] for key, pair in keys.items()}
+
+
+def get_versions(owner_id, resources):
+    '''Return ``{resource: token}`` for the resources of ``owner_id``.'''
+    tokens = get_tokens([(owner_id, resource) for resource in resources])
+    return {resource: token for (owner, resource), token in tokens.items()}
+
+
+def get_version(owner_id, resource):
+    return get_versions(owner_id, [resource])[resource]
+
+
+def bump(owner_id, *resources):
+    '''Issue new tokens for the resources of ``owner_id`` once the transaction commits.
+
+    Bumping before the commit would let a concurrent reader cache the old
+    rows under the new token.
+    '''
+    def issue():
+        token = new_token()
+        cache.set_many({version_key(owner_id, resource): token for resource in resources}, timeout=None)
+    transaction.on_commit(issue)
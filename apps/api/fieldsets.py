@@ -0,0 +1,136 @@
+'''Sparse fieldsets and the columnar format of the list endpoints.
+
+A list view with :class:`SparseFieldsMixin` returns only the fields named in
+``?fields=`` (e.g. ``?fields=payment_date,amount``) and reads only their
+columns, plus those of the ordering, with ``only``. With ``?format=columnar``
+(:class:`~apps.api.renderers.ColumnarJSONRenderer`) the results come as one
+array per field instead of one object per row, and :meth:`columnar_list`
+builds the arrays straight from ``values()`` rows, without a model instance
+and a serializer per row.
+'''
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+
+def column_of(model, field):
+    '''Return the ORM path and model field of a serializer field (``owner__username``), or None.
+
+    Only the fields that show a column as it is (or a related object as its
+    pk) have one; e.g. a ``SerializerMethodField`` or an annotation do not.
+    '''
+    if field.source == '*' or isinstance(field, serializers.SerializerMethodField):
+        return None
+    path = []
+    model_field = None
+    for attr in field.source_attrs:
+        if model_field is not None:
+            if not model_field.is_relation or model_field.many_to_many or model_field.one_to_many:
+                return None
+            model = model_field.related_model
+        try:
+            model_field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            return None
+        path.append(attr)
+    if model_field.many_to_many or model_field.one_to_many:
+        return None
+    if model_field.is_relation != isinstance(field, serializers.PrimaryKeyRelatedField):
+        return None
+    return '__'.join(path), model_field
+
+
+def converter(field, model_field, request):
+    '''Return the function that gives the representation of a column value, None if it is shown as it is.'''
+    if isinstance(model_field, models.FileField):
+        storage = model_field.storage
+        return lambda name: request.build_absolute_uri(storage.url(name)) if name else None
+    if isinstance(field, (serializers.DecimalField, serializers.DateField, serializers.DateTimeField)):
+        return field.to_representation
+    return None
+
+
+def value_columns(model, fields, request):
+    '''Return ``{name: (path, converter)}`` of the serializer fields, or None if one has no column.'''
+    columns = OrderedDict()
+    for name, field in fields.items():
+        column = column_of(model, field)
+        if column is None:
+            return None
+        columns[name] = (column[0], converter(field, column[1], request))
+    return columns
+
+
+def to_columns(rows, columns):
+    '''Turn the ``values()`` rows into ``{name: [values]}`` with the ``columns`` of :func:`value_columns`.'''
+    data = OrderedDict()
+    for name, (path, convert) in columns.items():
+        if convert is None:
+            data[name] = [row[path] for row in rows]
+        else:
+            data[name] = [None if row[path] is None else convert(row[path]) for row in rows]
+    return data
+
+
+class SparseFieldsMixin:
+    '''Return and read only the fields of ``?fields=``; serve ``?format=columnar`` from ``values()``.
+
+    The serializer must accept the ``fields`` to keep (``SelectedFieldsMixin``).
+    Views may name the columns they need whatever the fields (e.g. to compute
+    a field) in :meth:`required_columns`.
+    '''
+    fields_query_param = 'fields'
+    columnar_format = 'columnar'
+
+    def requested_fields(self):
+        '''Names of the fields of ``?fields=``, in the order of the serializer; None for all of them.'''
+        if self.request.method not in ('GET', 'HEAD'):
+            return None
+        value = self.request.query_params.get(self.fields_query_param, '')
+        names = {name.strip() for name in value.split(',') if name.strip()}
+        if not names:
+            return None
+        available = list(self.get_serializer_class()().fields)
+        unknown = names - set(available)
+        if unknown:
+            raise ValidationError({self.fields_query_param: 'Choose among: %s.' % ', '.join(available)})
+        return [name for name in available if name in names]
+
+    def required_columns(self):
+        return ()
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.requested_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        names = self.requested_fields()
+        if names is None:
+            return queryset
+        fields = self.get_serializer_class()().fields
+        columns = [column_of(queryset.model, fields[name]) for name in names]
+        paths = {*self.required_columns(), *getattr(self.pagination_class, 'ordering', ())}
+        paths.update(path for path, _ in filter(None, columns))
+        related = {path.split('__')[0] for path in paths if '__' in path}
+        return queryset.select_related(None).select_related(*related).only(*sorted(paths))
+
+    def columnar_response(self):
+        return getattr(self.request.accepted_renderer, 'format', None) == self.columnar_format
+
+    def columnar_list(self):
+        '''The page of the list as ``{field: [values]}``, read with ``values()``; None if a field has no column.'''
+        queryset = self.filter_queryset(self.get_queryset())
+        columns = value_columns(queryset.model, self.get_serializer().fields, self.request)
+        if columns is None:
+            return None
+        ordering = getattr(self.paginator, 'ordering', ())
+        rows = queryset.values(*sorted({path for path, _ in columns.values()} | set(ordering)))
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response(to_columns(rows, columns))
+        return self.get_paginated_response(to_columns(page, columns))
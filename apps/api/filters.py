@@ -0,0 +1,46 @@
+from django.db.models import Q
+from rest_framework.filters import BaseFilterBackend
+
+from apps.accounting_records.models import Records
+from apps.api.serializers import RecordsFilterSerializer
+
+
+class OwnerFilter(BaseFilterBackend):
+    '''Limit the queryset to the objects of the user of the request.
+
+    Views with ``include_shared = True`` also list the objects without owner
+    (e.g. the default categories created by the admin).
+    '''
+
+    def filter_queryset(self, request, queryset, view):
+        user = request.user
+        if not user.is_authenticated:
+            return queryset.none()
+        if getattr(view, 'include_shared', False):
+            return queryset.filter(Q(owner=user) | Q(owner__isnull=True))
+        return queryset.filter(owner=user)
+
+
+class RecordsFilter(BaseFilterBackend):
+    '''Filter the records by date range, account, category and type.
+
+    Every filter is an equality or a range on the leading columns of one of the
+    ``Records`` indexes, so it combines with the keyset pagination. The
+    account also matches the transfers into it (the destination index).
+    '''
+    lookups = {
+        'date_from': 'payment_date__gte',
+        'date_to': 'payment_date__lte',
+        'category': 'category_id',
+        'record_type': 'record_type',
+    }
+
+    def filter_queryset(self, request, queryset, view):
+        query = RecordsFilterSerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        filters = dict(query.validated_data)
+        account = filters.pop('account', None)
+        if account is not None:
+            queryset = queryset.filter(Q(account_id=account)
+                | Q(destination_account_id=account, record_type=Records.RecordType.TRANSFERENCIA))
+        return queryset.filter(**{self.lookups[name]: value for name, value in filters.items()})
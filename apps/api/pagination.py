@@ -0,0 +1,105 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def keyset_after(ordering, position):
+    '''Return the condition for the rows after ``position`` in ``ordering``.
+
+    Written as ``a >= x AND (a > x OR (b >= y AND (b > y OR ...)))`` so the
+    database can seek the index on the leading column.
+    '''
+    condition = None
+    for field, value in reversed(list(zip(ordering, position))):
+        if condition is None:
+            condition = Q(**{field + '__gt': value})
+        else:
+            condition = Q(**{field + '__gte': value}) & (Q(**{field + '__gt': value}) | condition)
+    return condition
+
+
+class KeysetPagination(BasePagination):
+    '''Cursor pagination on a unique ordering, e.g. ``(payment_date, id)``.
+
+    The cursor holds the ordering values of the last row of the page and the
+    next page is read with ``WHERE (payment_date, id) > (cursor)``, so with an
+    index on the ordering every page costs the same as the first one.
+    '''
+    ordering = ('payment_date', 'id')
+    page_size = 100
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        position = self.decode_cursor(request, queryset.model)
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+        rows = list(queryset.order_by(*self.ordering)[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param], strict=True,
+                cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def after(self, position):
+        return keyset_after(self.ordering, position)
+
+    def position(self, row):
+        '''Return the ordering values of a row (model instance or dict).'''
+        if isinstance(row, dict):
+            return [row[field] for field in self.ordering]
+        return [getattr(row, field) for field in self.ordering]
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            values = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            if len(values) != len(self.ordering):
+                raise ValueError
+            return [model._meta.get_field(field).to_python(value) for field, value in zip(self.ordering, values)]
+        except (TypeError, ValueError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position):
+        values = json.dumps([str(value) for value in position])
+        return urlsafe_b64encode(values.encode('utf-8')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param,
+            self.encode_cursor(self.position(self.page[-1])))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
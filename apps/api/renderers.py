@@ -0,0 +1,38 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class PrometheusRenderer(BaseRenderer):
+    '''Text exposition format of Prometheus; the view hands it the text ready.'''
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, str):
+            return data.encode(self.charset)
+        # errors (e.g. 403) come as a dict
+        return ('# %s\n' % data.get('detail', data)).encode(self.charset)
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    '''JSON with the rows of a list as one array per field (``?format=columnar``).
+
+    The views with ``SparseFieldsMixin`` hand it the columns ready; the list of
+    objects of any other view (paginated in ``results`` or not) is turned into
+    columns here. Anything else, e.g. an error, is rendered as it is.
+    '''
+    format = 'columnar'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict) and isinstance(data.get('results'), list):
+            data = dict(data, results=columns(data['results']))
+        elif isinstance(data, list):
+            data = columns(data)
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+def columns(rows):
+    '''Turn a list of objects into ``{field: [values]}``, with the fields of the first one.'''
+    if not rows:
+        return {}
+    return {name: [row[name] for row in rows] for name in rows[0]}
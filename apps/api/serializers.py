@@ -1,6 +1,10 @@
 from rest_framework import serializers
-from ..accounting_records.models import Records, Category, MethodOfPayment, Account
+from ..accounting_records.models import Records, Category, MethodOfPayment, Account, Customer, Budget
+from ..accounting_records.importers import PARSERS
+from ..accounting_records.search import SOURCES as SEARCH_SOURCES
+from ..accounting_records.summaries import DIMENSIONS
 from django.contrib.auth.models import User, Group
+from django.db.models import Q
 
 # Serializers define the API representation.
 #Serializer to represent the Category, Recods, MethodOfPayment, account model
@@ -10,6 +14,14 @@ class AccountSerializer(serializers.ModelSerializer):
         model = Account
         fields = ('id', 'name', 'account_type', 'amount','created_at', 'updated_at', 'owner')
 
+    #a new amount is an adjustment of the balance, the other fields never write it
+    def update(self, instance, validated_data):
+        amount = validated_data.pop('amount', None)
+        instance = super().update(instance, validated_data)
+        if amount is not None and amount != instance.amount:
+            instance.adjust(amount)
+        return instance
+
 class CategorySerializer(serializers.ModelSerializer):
     owner = serializers.ReadOnlyField(source='owner.username')
     class Meta:
@@ -22,17 +34,211 @@ class MethodOfPaymentSerializer(serializers.ModelSerializer):
         model = MethodOfPayment
         fields = ('id', 'name','owner')
 
-class RecordsSerializer(serializers.ModelSerializer):
+#Primary key field that looks every pk up once per context, e.g. for all the records of a batch
+class MemoizedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    def to_internal_value(self, data):
+        memo = self.context.setdefault('related_objects', {}).setdefault(self.field_name, {})
+        if str(data) not in memo:
+            memo[str(data)] = super().to_internal_value(data)
+        return memo[str(data)]
+
+#Serializer that only returns the fields given, e.g. those asked for with ?fields= in a list
+class SelectedFieldsMixin:
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+#A transfer moves the amount from account_id to destination_account_id, which the other types leave empty
+class RecordsSerializer(SelectedFieldsMixin, serializers.ModelSerializer):
+    serializer_related_field = MemoizedPrimaryKeyRelatedField
     owner = serializers.ReadOnlyField(source='owner.username')
     class Meta:
         model = Records
         fields = ('id', 'record_type', 'amount', 'note', 'payment_date', 
-        'category_id', 'account_id','method_of_payment_id', 'owner')
+        'category_id', 'account_id', 'destination_account_id', 'method_of_payment_id', 'owner', 'voucher',
+        'voucher_thumbnail', 'voucher_preview', 'voucher_width', 'voucher_height', 'voucher_size')
+
+    #the related objects must be those of the user, or shared ones like the default categories
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        user = getattr(request, 'user', None)
+        for name, model, shared, message in (('account_id', Account, False, 'Unknown account.'),
+                ('destination_account_id', Account, False, 'Unknown account.'),
+                ('category_id', Category, True, 'Unknown category.'),
+                ('method_of_payment_id', MethodOfPayment, True, 'Unknown method of payment.')):
+            if name not in fields or fields[name].read_only:
+                continue
+            if user is None or not user.is_authenticated:
+                queryset = model.objects.none()
+            elif shared:
+                queryset = model.objects.filter(Q(owner=user) | Q(owner__isnull=True))
+            else:
+                queryset = model.objects.filter(owner=user)
+            fields[name].queryset = queryset
+            fields[name].error_messages['does_not_exist'] = message
+        return fields
+
+    def validate(self, attrs):
+        def value(name, default=None):
+            return attrs[name] if name in attrs else getattr(self.instance, name, default)
+        if value('record_type', Records.RecordType.GASTO) != Records.RecordType.TRANSFERENCIA:
+            if value('destination_account_id') is not None:
+                attrs['destination_account_id'] = None
+            return attrs
+        account, destination = value('account_id'), value('destination_account_id')
+        if account is None:
+            raise serializers.ValidationError({'account_id': 'A transfer needs the account it comes from.'})
+        if destination is None:
+            raise serializers.ValidationError({'destination_account_id': 'A transfer needs the account it goes to.'})
+        if destination == account:
+            raise serializers.ValidationError({'destination_account_id': 'Choose an account other than the origin.'})
+        return attrs
+
+#The thumbnail, preview and dimensions of the image are filled in the background
+class CustomerSerializer(serializers.ModelSerializer):
+    owner = serializers.ReadOnlyField(source='owner.username')
+    class Meta:
+        model = Customer
+        fields = ('id', 'name', 'email', 'phone', 'address', 'website', 'cuil_cuit', 'ivatype',
+        'customertype', 'description', 'img', 'img_thumbnail', 'img_preview', 'img_width', 'img_height',
+        'img_size', 'created_at', 'updated_at', 'owner')
 
-#User serializer
+#Records listed by account, with the balance of the account after each one
+class RunningBalanceRecordsSerializer(RecordsSerializer):
+    balance = serializers.DecimalField(max_digits=15, decimal_places=2, read_only=True)
+    class Meta(RecordsSerializer.Meta):
+        fields = RecordsSerializer.Meta.fields + ('balance',)
+
+#User serializer, the records of the user are listed in records/
 class UserSerializer(serializers.ModelSerializer):
-    records = serializers.PrimaryKeyRelatedField(many=True, queryset=Records.objects.all())
     class Meta:
         model = User
-        fields= ('id', 'username', 'email', 'groups', 'records')
+        fields= ('id', 'username', 'email', 'groups')
+
+
+#Serializer for the upload of a bank statement to import
+class StatementImportSerializer(serializers.Serializer):
+    file = serializers.FileField()
+    account = serializers.PrimaryKeyRelatedField(queryset=Account.objects.all())
+    format = serializers.ChoiceField(choices=sorted(PARSERS), required=False)
+
+    def validate_account(self, account):
+        if account.owner_id != self.context['request'].user.id:
+            raise serializers.ValidationError('Unknown account.')
+        return account
+
+#Serializer for the query parameters of the monthly report
+class MonthlyReportQuerySerializer(serializers.Serializer):
+    since = serializers.DateField(required=False, input_formats=['%Y-%m', 'iso-8601'])
+    until = serializers.DateField(required=False, input_formats=['%Y-%m', 'iso-8601'])
+    group_by = serializers.CharField(required=False, default='month,record_type')
+    account = serializers.IntegerField(required=False)
+    category = serializers.IntegerField(required=False)
+    record_type = serializers.ChoiceField(choices=Records.RecordType.choices, required=False)
+
+    def validate_group_by(self, value):
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in names if name not in DIMENSIONS]
+        if unknown or not names:
+            raise serializers.ValidationError('Choose among: %s.' % ', '.join(DIMENSIONS))
+        return names
+
+#Serializer for the rows of the monthly report, only the grouped columns are present
+class MonthlyReportRowSerializer(serializers.Serializer):
+    month = serializers.DateField(read_only=True)
+    account = serializers.IntegerField(source='account_id', read_only=True)
+    category = serializers.IntegerField(source='category_id', read_only=True)
+    record_type = serializers.CharField(read_only=True)
+    total = serializers.DecimalField(max_digits=15, decimal_places=2, read_only=True)
+    count = serializers.IntegerField(read_only=True)
+
+#Serializer for the query parameters that filter the records
+class RecordsFilterSerializer(serializers.Serializer):
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    account = serializers.IntegerField(required=False)
+    category = serializers.IntegerField(required=False)
+    record_type = serializers.ChoiceField(choices=Records.RecordType.choices, required=False)
+
+#Serializer for the query parameters of the category rollup
+class CategoryRollupQuerySerializer(serializers.Serializer):
+    since = serializers.DateField(required=False)
+    until = serializers.DateField(required=False)
+    record_type = serializers.ChoiceField(choices=Records.RecordType.choices, default=Records.RecordType.GASTO)
+
+#Serializer for the query parameters of the balance of an account at a date
+class AccountBalanceQuerySerializer(serializers.Serializer):
+    date = serializers.DateField()
+
+#Serializer for one operation of a batch of records, its data is validated by RecordsSerializer
+class RecordsBatchOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=['create', 'update', 'delete'])
+    id = serializers.IntegerField(required=False)
+    data = serializers.DictField(required=False)
+
+    def validate(self, attrs):
+        if attrs['op'] != 'create' and 'id' not in attrs:
+            raise serializers.ValidationError({'id': 'This field is required.'})
+        if attrs['op'] != 'delete' and 'data' not in attrs:
+            raise serializers.ValidationError({'data': 'This field is required.'})
+        return attrs
+
+#Serializer for a batch of operations on the records
+class RecordsBatchSerializer(serializers.Serializer):
+    operations = serializers.ListField(child=RecordsBatchOperationSerializer(), min_length=1, max_length=1000)
+
+    def validate_operations(self, operations):
+        ids = [operation['id'] for operation in operations if operation['op'] != 'create']
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError('A record can only appear once in a batch.')
+        return operations
+
+#Serializer for the query parameters of the full-text search
+class SearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=200)
+    resources = serializers.CharField(required=False, default=','.join(SEARCH_SOURCES))
+    offset = serializers.IntegerField(required=False, default=0, min_value=0)
+
+    def validate_resources(self, value):
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in names if name not in SEARCH_SOURCES]
+        if unknown or not names:
+            raise serializers.ValidationError('Choose among: %s.' % ', '.join(SEARCH_SOURCES))
+        return names
+
+#Serializer for the monthly budget of a category, its spend is read from /budgets/status/
+class BudgetSerializer(serializers.ModelSerializer):
+    owner = serializers.ReadOnlyField(source='owner.username')
+    class Meta:
+        model = Budget
+        fields = ('id', 'category', 'amount', 'thresholds', 'created_at', 'updated_at', 'owner')
+
+    #the owner is set by the view, so the unique (owner, category) is checked here
+    def validate_category(self, category):
+        user = self.context['request'].user
+        if category.owner_id not in (None, user.id):
+            raise serializers.ValidationError('Unknown category.')
+        taken = Budget.objects.filter(owner=user, category=category)
+        if self.instance is not None:
+            taken = taken.exclude(pk=self.instance.pk)
+        if taken.exists():
+            raise serializers.ValidationError('The category has a budget already.')
+        return category
+
+#Serializer for the query parameters of the status of the budgets
+class BudgetStatusQuerySerializer(serializers.Serializer):
+    month = serializers.DateField(required=False, input_formats=['%Y-%m', 'iso-8601'])
 
+#Serializer for the status of one budget in a month
+class BudgetStatusRowSerializer(serializers.Serializer):
+    id = serializers.IntegerField(read_only=True)
+    category = serializers.IntegerField(read_only=True)
+    category_name = serializers.CharField(read_only=True)
+    amount = serializers.DecimalField(max_digits=15, decimal_places=2, read_only=True)
+    spent = serializers.DecimalField(max_digits=15, decimal_places=2, read_only=True)
+    remaining = serializers.DecimalField(max_digits=15, decimal_places=2, read_only=True)
+    percent = serializers.DecimalField(max_digits=7, decimal_places=1, read_only=True)
+    reached = serializers.ListField(child=serializers.IntegerField(), read_only=True)
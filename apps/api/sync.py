@@ -0,0 +1,145 @@
+'''Delta sync of the data of a user: the rows changed since a token.
+
+A sync reads every resource in ``(updated_at, id)`` order and then the
+tombstones of the deleted rows, all bounded by the time the sync started, so
+the pages are stable while the user keeps writing. The token handed out at
+the end starts the next sync ``OVERLAP`` before that bound: rows written by
+transactions that were still open then are sent again in the next sync
+instead of being missed (clients apply the changes as upserts).
+'''
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+from apps.accounting_records.models import Account, Category, MethodOfPayment, Records, Tombstone
+from apps.api.pagination import keyset_after
+from apps.api.serializers import AccountSerializer, CategorySerializer, MethodOfPaymentSerializer, RecordsSerializer
+
+
+# name, model, serializer and whether the shared rows (without owner) are synced
+RESOURCES = (
+    ('accounts', Account, AccountSerializer, False),
+    ('categories', Category, CategorySerializer, True),
+    ('methods_of_payment', MethodOfPayment, MethodOfPaymentSerializer, True),
+    ('records', Records, RecordsSerializer, False),
+)
+
+OVERLAP = timedelta(minutes=1)
+
+# tombstones older than this are pruned, older tokens need a full sync
+RETENTION = timedelta(days=90)
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+def encode(values):
+    return urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode(encoded):
+    try:
+        return json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+    except (TypeError, ValueError):
+        raise InvalidToken(encoded)
+
+
+def parse_time(value):
+    try:
+        return datetime.fromisoformat(value) if value is not None else None
+    except (TypeError, ValueError):
+        raise InvalidToken(value)
+
+
+def owned(queryset, user, shared):
+    if shared:
+        return queryset.filter(Q(owner=user) | Q(owner__isnull=True))
+    return queryset.filter(owner=user)
+
+
+def streams(user, since, until):
+    '''Return the ``(name, queryset, ordering, serializer)`` read by a sync, in order.'''
+    result = []
+    for name, model, serializer, shared in RESOURCES:
+        queryset = owned(model.objects.select_related('owner'), user, shared).filter(updated_at__lte=until)
+        if since is not None:
+            queryset = queryset.filter(updated_at__gt=since)
+        result.append((name, queryset, ('updated_at', 'id'), serializer))
+    tombstones = Tombstone.objects.filter(Q(owner=user) | Q(owner__isnull=True), deleted_at__lte=until)
+    if since is not None:
+        tombstones = tombstones.filter(deleted_at__gt=since)
+    else:
+        # a full sync has nothing to delete
+        tombstones = tombstones.none()
+    result.append(('deleted', tombstones, ('deleted_at', 'id'), None))
+    return result
+
+
+def changes_page(user, since, until, position, page_size, context):
+    '''Return one page of changes and the position of the next one (or None).
+
+    ``position`` is ``[stream, updated_at, id]`` of the last row of the
+    previous page, or ``[stream, None, None]`` to start a stream.
+    '''
+    page = {name: [] for name, *_ in RESOURCES}
+    page['deleted'] = {name: [] for name, *_ in RESOURCES}
+    remaining = page_size
+    first, *last = position or (0, None, None)
+    for index, (name, queryset, ordering, serializer) in enumerate(streams(user, since, until)):
+        if index < first:
+            continue
+        if remaining == 0:
+            return page, [index, None, None]
+        if index == first and last[0] is not None:
+            queryset = queryset.filter(keyset_after(ordering, [parse_time(last[0]), last[1]]))
+        rows = list(queryset.order_by(*ordering)[:remaining + 1])
+        full = len(rows) > remaining
+        rows = rows[:remaining]
+        if serializer is None:
+            for tombstone in rows:
+                page['deleted'][tombstone.resource].append(tombstone.object_id)
+        else:
+            page[name] = serializer(rows, many=True, context=context).data
+        if full:
+            row = rows[-1]
+            return page, [index, getattr(row, ordering[0]).isoformat(), row.pk]
+        remaining -= len(rows)
+    return page, None
+
+
+def start(token):
+    '''Return the ``since`` time of a sync token (None for a full sync).'''
+    if not token:
+        return None
+    values = decode(token)
+    since = parse_time(values[0]) if isinstance(values, list) and values else None
+    if since is None or timezone.is_naive(since):
+        raise InvalidToken(token)
+    return since
+
+
+def resume(cursor):
+    '''Return the ``until`` time and the position of the page of a cursor.'''
+    values = decode(cursor)
+    if not isinstance(values, list) or len(values) != 4 or not isinstance(values[1], int):
+        raise InvalidToken(cursor)
+    until = parse_time(values[0])
+    if until is None or timezone.is_naive(until):
+        raise InvalidToken(cursor)
+    return until, values[1:]
+
+
+def cursor(until, position):
+    return encode([until.isoformat()] + position)
+
+
+def expired(since):
+    return since is not None and since < timezone.now() - RETENTION
+
+
+def next_token(until):
+    return encode([(until - OVERLAP).isoformat()])
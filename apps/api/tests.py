@@ -1,3 +1,742 @@
-from django.test import TestCase
+import functools
+import io
+import os
+import sqlite3
+import tempfile
+import time
+import zipfile
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
+from xml.etree import ElementTree
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser, Group, User
+from django.core.cache import cache
+from django.db import connection, connections, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase, APITransactionTestCase
+
+from apps import metrics, routers
+from apps.accounting_records import balances, importers, summaries
+from apps.accounting_records.models import Account, Budget, Category, Customer, MethodOfPayment, Records
+from apps.api import sync
+from apps.api.filters import OwnerFilter, RecordsFilter
+from apps.api.pagination import KeysetPagination
+
+
+class QueryBudgetTests(APITestCase):
+    '''Every list endpoint must run a fixed number of queries, whatever the page size.
+
+    Each endpoint is requested with a small and a large dataset; both must
+    run the same number of queries and stay within the budget.
+    '''
+    budgets = {
+        '/api/records/': 1,
+        '/api/records/?page_size=1000': 1,
+        '/api/records/?fields=payment_date,amount,owner': 1,
+        '/api/records/?fields=payment_date,amount&format=columnar': 1,
+        '/api/categories/': 1,
+        '/api/methods_of_payment/': 1,
+        '/api/accounts/': 1,
+        '/api/customers/': 1,
+        '/api/users/': 2,
+        '/api/reports/monthly/?group_by=month,category': 1,
+        '/api/search/?q=cliente': 2,
+        '/api/budgets/': 1,
+        '/api/budgets/status/?month=2025-01': 1,
+    }
+
+    def setUp(self):
+        self.user = User.objects.create_user('diogenes', password='tonel', is_staff=True)
+        self.client.force_authenticate(self.user)
+
+    def seed(self, size):
+        group = Group.objects.create(name='grupo %d' % size)
+        for n in range(size):
+            user = User.objects.create_user('user %d-%d' % (size, n))
+            user.groups.add(group)
+            account = Account.objects.create(owner=self.user, name='Cuenta %d-%d' % (size, n))
+            category = Category.objects.create(owner=self.user, name='Categoria %d-%d' % (size, n))
+            Budget.objects.create(owner=self.user, category=category, amount=Decimal('25.00'))
+            method = MethodOfPayment.objects.create(owner=self.user, name='Pago %d-%d' % (size, n))
+            Customer.objects.create(owner=self.user, name='Cliente %d-%d' % (size, n))
+            for day in range(3):
+                Records.objects.create(owner=self.user, account_id=account, category_id=category,
+                    method_of_payment_id=method, amount=Decimal('10.00'),
+                    payment_date=date(2025, 1, 1) + timedelta(days=30 * day + n))
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(queries)
+
+    def test_list_endpoints_stay_within_budget(self):
+        self.seed(2)
+        small = {url: self.count_queries(url) for url in self.budgets}
+        self.seed(30)
+        large = {url: self.count_queries(url) for url in self.budgets}
+        for url, budget in self.budgets.items():
+            self.assertEqual(small[url], large[url], '%s depends on the number of rows' % url)
+            self.assertLessEqual(large[url], budget, url)
+
+
+class RecordsExportTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('diogenes', password='tonel')
+        other = User.objects.create_user('alejandro')
+        self.client.force_authenticate(self.user)
+        account = Account.objects.create(owner=self.user, name='Caja')
+        for day in range(1, 4):
+            Records.objects.create(owner=self.user, account_id=account, amount=Decimal('1.50') * day,
+                payment_date=date(2025, 1, day), note='nota <%d>' % day)
+        Records.objects.create(owner=other, amount=Decimal('99.00'), payment_date=date(2025, 1, 1))
+
+    def content(self, response):
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_csv_export_streams_the_filtered_records_of_the_user(self):
+        response = self.client.get('/api/records/export/csv/?date_from=2025-01-02')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="registros.csv"')
+        lines = self.content(response).decode('utf-8-sig').splitlines()
+        self.assertEqual(lines[0].split(',')[:4], ['id', 'fecha', 'tipo', 'importe'])
+        self.assertEqual([line.split(',')[1:4] for line in lines[1:]],
+            [['2025-01-02', 'GAST', '3.00'], ['2025-01-03', 'GAST', '4.50']])
+
+    def test_xlsx_export_is_a_valid_workbook(self):
+        archive = zipfile.ZipFile(io.BytesIO(self.content(self.client.get('/api/records/export/xlsx/'))))
+        self.assertIsNone(archive.testzip())
+        sheet = ElementTree.fromstring(archive.read('xl/worksheets/sheet1.xml'))
+        rows = sheet.findall('.//{http://schemas.openxmlformats.org/spreadsheetml/2006/main}row')
+        self.assertEqual(len(rows), 4)
+        self.assertIn(b'nota &lt;3&gt;', archive.read('xl/worksheets/sheet1.xml'))
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get('/api/records/export/pdf/').status_code, 404)
+
+
+class SparseFieldsTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('diogenes', password='tonel')
+        self.client.force_authenticate(self.user)
+        self.account = Account.objects.create(owner=self.user, name='Caja', amount=Decimal('100.00'))
+        for day in range(1, 6):
+            Records.objects.create(owner=self.user, account_id=self.account, amount=Decimal('1.25') * day,
+                payment_date=date(2025, 2, day), note='nota %d' % day)
+        Records.objects.filter(payment_date=date(2025, 2, 3)).update(voucher='vouchers/ticket.pdf')
+
+    def test_fields_narrow_the_response_and_the_select(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/records/?fields=amount,payment_date&page_size=2')
+        self.assertEqual(response.data['results'], [{'amount': '1.25', 'payment_date': '2025-02-01'},
+            {'amount': '2.50', 'payment_date': '2025-02-02'}])
+        select = queries[-1]['sql'].split(' FROM ')[0]
+        self.assertIn('"amount"', select)
+        self.assertNotIn('"note"', select)
+        response = self.client.get(response.data['next'])
+        self.assertEqual([row['payment_date'] for row in response.data['results']], ['2025-02-03', '2025-02-04'])
+        self.assertEqual(self.client.get('/api/records/?fields=owner').data['results'][0], {'owner': 'diogenes'})
+        response = self.client.get('/api/records/?fields=amount,saldo')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('fields', response.data)
+
+    def test_columnar_format_matches_the_objects(self):
+        rows = self.client.get('/api/records/').data['results']
+        response = self.client.get('/api/records/?format=columnar')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        columns = response.json()['results']
+        self.assertEqual(list(columns), list(rows[0]))
+        for name, values in columns.items():
+            self.assertEqual(values, [row[name] for row in rows], name)
+        self.assertEqual(columns['voucher'][2], 'http://testserver/media/vouchers/ticket.pdf')
+
+        response = self.client.get('/api/records/?fields=payment_date,amount&format=columnar&page_size=3')
+        self.assertEqual(response.json()['results'], {'amount': ['1.25', '2.50', '3.75'],
+            'payment_date': ['2025-02-01', '2025-02-02', '2025-02-03']})
+        self.assertEqual(self.client.get(response.json()['next']).json()['results']['amount'], ['5.00', '6.25'])
+
+    def test_running_balance_in_columns(self):
+        response = self.client.get('/api/records/?account=%d&fields=amount,balance&format=columnar' % self.account.pk)
+        self.assertEqual(response.json()['results']['balance'], ['98.75', '96.25', '92.50', '87.50', '81.25'])
+
+
+class KeysetPaginationTests(APITestCase):
+    '''The cursor of a page holds its last ``(payment_date, id)``, so equal dates never repeat or skip rows'''
+
+    def setUp(self):
+        self.user = User.objects.create_user('diogenes', password='tonel')
+        self.account = Account.objects.create(owner=self.user, name='Caja', amount=Decimal('100.00'))
+        days = [date(2025, 1, 2)] * 7 + [date(2025, 1, 1), date(2025, 1, 3)]
+        self.records = [Records.objects.create(owner=self.user, account_id=self.account, amount=Decimal('1.00'),
+            payment_date=day) for day in days]
+
+    def page(self, url):
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(Records.objects.all(), Request(APIRequestFactory().get(url)))
+        return [record.pk for record in page], paginator.get_next_link()
+
+    def test_pages_of_equal_dates(self):
+        expected = [record.pk for record in sorted(self.records, key=lambda record: (record.payment_date, record.pk))]
+        seen = []
+        ids, url = self.page('/api/records/?page_size=3')
+        while True:
+            seen += ids
+            if url is None:
+                break
+            if len(seen) == 3:
+                # rows deleted before the cursor, or added with its date, do not move the next pages
+                Records.objects.filter(pk=seen[0]).delete()
+                Records.objects.create(owner=self.user, account_id=self.account, amount=Decimal('1.00'),
+                    payment_date=date(2025, 1, 1))
+            ids, url = self.page(url)
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursors_and_page_sizes(self):
+        for cursor in ('nada', 'WyIyMDI1LTAxLTAyIl0=', 'WyJheWVyIiwgIjEiXQ=='):
+            with self.assertRaises(NotFound):
+                self.page('/api/records/?cursor=%s' % cursor)
+        self.assertEqual(len(self.page('/api/records/?page_size=0')[0]), 9)
+        with mock.patch.object(KeysetPagination, 'max_page_size', 2):
+            self.assertEqual(len(self.page('/api/records/?page_size=5')[0]), 2)
+
+
+class FilterTests(APITestCase):
+    '''OwnerFilter keeps every user to their own rows, RecordsFilter narrows them down'''
+
+    def setUp(self):
+        self.user = User.objects.create_user('diogenes', password='tonel')
+        self.other = User.objects.create_user('alejandro')
+        self.account = Account.objects.create(owner=self.user, name='Caja', amount=Decimal('100.00'))
+        self.savings = Account.objects.create(owner=self.user, name='Ahorro', amount=Decimal('0.00'))
+        self.foreign = Account.objects.create(owner=self.other, name='Caja', amount=Decimal('100.00'))
+        self.category = Category.objects.create(owner=self.user, name='Comida')
+        self.shared = Category.objects.create(name='Varios')
+        self.lunch = Records.objects.create(owner=self.user, account_id=self.account, category_id=self.category,
+            amount=Decimal('10.00'), payment_date=date(2025, 1, 5))
+        self.transfer = Records.objects.create(owner=self.user, account_id=self.savings,
+            destination_account_id=self.account, record_type=Records.RecordType.TRANSFERENCIA,
+            amount=Decimal('5.00'), payment_date=date(2025, 1, 10))
+        self.foreign_lunch = Records.objects.create(owner=self.other, account_id=self.foreign,
+            category_id=self.shared, amount=Decimal('7.00'), payment_date=date(2025, 1, 5))
+
+    def request(self, user, url='/api/records/'):
+        request = Request(APIRequestFactory().get(url))
+        request.user = user
+        return request
+
+    def filtered(self, queryset, user, url='/api/records/', view=None, backends=(OwnerFilter, RecordsFilter)):
+        request = self.request(user, url)
+        for backend in backends:
+            queryset = backend().filter_queryset(request, queryset, view)
+        return set(queryset.values_list('pk', flat=True))
+
+    def test_owner_isolation(self):
+        self.assertEqual(self.filtered(Records.objects.all(), self.user), {self.lunch.pk, self.transfer.pk})
+        self.assertEqual(self.filtered(Records.objects.all(), self.other), {self.foreign_lunch.pk})
+        self.assertEqual(self.filtered(Records.objects.all(), AnonymousUser()), set())
+        # filtering on the ids of another user finds nothing
+        self.assertEqual(self.filtered(Records.objects.all(), self.user, '/api/records/?account=%s&category=%s'
+            % (self.foreign.pk, self.shared.pk)), set())
+        self.assertEqual(self.filtered(Records.objects.all(), self.other, '/api/records/?account=%s'
+            % self.account.pk), set())
+
+    def test_shared_objects(self):
+        view = mock.Mock(include_shared=True)
+        self.assertEqual(self.filtered(Category.objects.all(), self.user, backends=[OwnerFilter]),
+            {self.category.pk})
+        self.assertEqual(self.filtered(Category.objects.all(), self.user, view=view, backends=[OwnerFilter]),
+            {self.category.pk, self.shared.pk})
+        self.assertEqual(self.filtered(Category.objects.all(), self.other, view=view, backends=[OwnerFilter]),
+            {self.shared.pk})
+
+    def test_records_filters(self):
+        self.assertEqual(self.filtered(Records.objects.all(), self.user, '/api/records/?account=%s'
+            % self.account.pk), {self.lunch.pk, self.transfer.pk})
+        self.assertEqual(self.filtered(Records.objects.all(), self.user, '/api/records/?account=%s'
+            % self.savings.pk), {self.transfer.pk})
+        self.assertEqual(self.filtered(Records.objects.all(), self.user,
+            '/api/records/?date_from=2025-01-06&date_to=2025-01-31'), {self.transfer.pk})
+        self.assertEqual(self.filtered(Records.objects.all(), self.user, '/api/records/?record_type=GAST&category=%s'
+            % self.category.pk), {self.lunch.pk})
+        with self.assertRaises(ValidationError):
+            self.filtered(Records.objects.all(), self.user, '/api/records/?date_from=ayer')
+
+
+class RecordsImportTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('diogenes', password='tonel')
+        self.client.force_authenticate(self.user)
+        self.account = Account.objects.create(owner=self.user, name='Caja', amount=Decimal('100.00'))
+
+    def upload(self, *lines):
+        statement = io.BytesIO('\n'.join(('fecha,importe,concepto',) + lines).encode())
+        statement.name = 'extracto.csv'
+        return self.client.post('/api/records/import/', {'file': statement, 'account': self.account.pk},
+            format='multipart')
+
+    def test_a_bad_line_imports_nothing(self):
+        with mock.patch('apps.api.views.import_statement', functools.partial(importers.import_statement, batch_size=1)):
+            response = self.upload('2025-01-02,-10.00,uno', '2025-01-03,-10.00,dos', '2025-01-04,diez,tres')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Records.objects.exists())
+        self.assertEqual(Account.objects.get(pk=self.account.pk).amount, Decimal('100.00'))
+        response = self.upload('2025-01-02,-10.00,uno', '2025-01-03,-10.00,dos', '2025-01-04,-10.00,tres')
+        self.assertEqual(response.data['rows'], 3)
+        self.assertEqual(Account.objects.get(pk=self.account.pk).amount, Decimal('70.00'))
+
+
+class AccountBalanceTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('diogenes', password='tonel')
+        self.client.force_authenticate(self.user)
+        self.account = Account.objects.create(owner=self.user, name='Caja', amount=Decimal('100.00'))
+        for day in range(1, 5):
+            Records.objects.create(owner=self.user, account_id=self.account, amount=Decimal('10.00'),
+                payment_date=date(2025, 1, day * 7))
+        balances.build_checkpoints(self.account.pk, date(2025, 1, 31))
+
+    def test_balance_at_a_date(self):
+        response = self.client.get('/api/accounts/%d/balance/?date=2025-01-25' % self.account.pk)
+        self.assertEqual(response.data['balance'], '70.00')
+        other = Account.objects.create(owner=User.objects.create_user('alejandro'), name='Banco')
+        response = self.client.get('/api/accounts/%d/balance/?date=2025-01-25' % other.pk)
+        self.assertEqual(response.status_code, 404)
+
+    def test_records_only_reach_the_objects_of_the_user(self):
+        other = User.objects.create_user('alejandro')
+        bank = Account.objects.create(owner=other, name='Banco', amount=Decimal('500.00'))
+        savings = Account.objects.create(owner=other, name='Ahorros')
+        shared = Category.objects.create(name='Comida')
+        foreign = Category.objects.create(owner=other, name='Ajena')
+        data = {'amount': '500.00', 'payment_date': '2025-01-10'}
+        response = self.client.post('/api/records/', dict(data, record_type='TRAN', account_id=bank.pk,
+            destination_account_id=savings.pk), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['account_id'], ['Unknown account.'])
+        self.assertEqual(self.client.post('/api/records/', dict(data, account_id=bank.pk), format='json').status_code,
+            400)
+        response = self.client.post('/api/records/', dict(data, account_id=self.account.pk, category_id=foreign.pk),
+            format='json')
+        self.assertEqual(response.data['category_id'], ['Unknown category.'])
+        response = self.client.post('/api/records/batch/', {'operations': [{'op': 'create',
+            'data': dict(data, account_id=bank.pk)}]}, format='json')
+        self.assertNotEqual(response.data['results'][0]['status'], 201)
+        self.assertEqual(Account.objects.get(pk=bank.pk).amount, Decimal('500.00'))
+        response = self.client.post('/api/records/', dict(data, account_id=self.account.pk, category_id=shared.pk),
+            format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_edits_of_the_account(self):
+        response = self.client.patch('/api/accounts/%d/' % self.account.pk, {'name': 'Efectivo'}, format='json')
+        self.assertEqual(response.data['amount'], '60.00')
+        response = self.client.patch('/api/accounts/%d/' % self.account.pk, {'amount': '80.00'}, format='json')
+        self.assertEqual(response.data['amount'], '80.00')
+        self.assertEqual(self.client.get('/api/accounts/%d/balance/?date=2025-01-25' % self.account.pk).data['balance'],
+            '90.00')
+
+    def test_records_of_an_account_list_the_running_balance(self):
+        response = self.client.get('/api/records/?account=%d&page_size=2' % self.account.pk)
+        self.assertEqual([row['balance'] for row in response.data['results']], ['90.00', '80.00'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([row['balance'] for row in response.data['results']], ['70.00', '60.00'])
+        response = self.client.get('/api/records/?account=%d&record_type=GAST' % self.account.pk)
+        self.assertNotIn('balance', response.data['results'][0])
+
+    def test_transfers(self):
+        savings = Account.objects.create(owner=self.user, name='Ahorros', amount=Decimal('50.00'))
+        foreign = Account.objects.create(owner=User.objects.create_user('alejandro'), name='Banco')
+        data = {'record_type': 'TRAN', 'amount': '25.00', 'payment_date': '2025-01-10', 'account_id': self.account.pk}
+        response = self.client.post('/api/records/', data, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('destination_account_id', response.data)
+        for destination in (self.account, foreign):
+            response = self.client.post('/api/records/', dict(data, destination_account_id=destination.pk),
+                format='json')
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/records/', dict(data, destination_account_id=savings.pk), format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Account.objects.get(pk=self.account.pk).amount, Decimal('35.00'))
+        self.assertEqual(Account.objects.get(pk=savings.pk).amount, Decimal('75.00'))
+        # the transfer is listed in both accounts, with their own running balance
+        response = self.client.get('/api/records/?account=%d' % savings.pk)
+        self.assertEqual([row['balance'] for row in response.data['results']], ['75.00'])
+        response = self.client.get('/api/records/?account=%d' % self.account.pk)
+        self.assertEqual([row['balance'] for row in response.data['results']], ['90.00', '65.00', '55.00', '45.00', '35.00'])
+        self.assertEqual(self.client.get('/api/accounts/%d/balance/?date=2025-01-12' % savings.pk).data['balance'], '75.00')
+        response = self.client.patch('/api/records/%d/' % response.data['results'][1]['id'],
+            {'record_type': 'GAST'}, format='json')
+        self.assertIsNone(response.data['destination_account_id'])
+        self.assertEqual(Account.objects.get(pk=savings.pk).amount, Decimal('50.00'))
+
+
+class BudgetStatusTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('diogenes', password='tonel')
+        self.client.force_authenticate(self.user)
+        self.account = Account.objects.create(owner=self.user, name='Caja', amount=Decimal('100.00'))
+        self.home = Category.objects.create(owner=self.user, name='Hogar')
+        self.power = Category.objects.create(owner=self.user, name='Luz', parent=self.home)
+
+    def test_budget_status_of_the_month(self):
+        Records.objects.create(owner=self.user, account_id=self.account, category_id=self.power,
+            amount=Decimal('45.00'), payment_date=date(2025, 5, 3))
+        response = self.client.post('/api/budgets/', {'category': self.home.pk, 'amount': '50.00'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.client.post('/api/budgets/', {'category': self.home.pk, 'amount': '10.00'},
+            format='json').status_code, 400)
+        other = Category.objects.create(owner=User.objects.create_user('alejandro'), name='Ajena')
+        self.assertEqual(self.client.post('/api/budgets/', {'category': other.pk, 'amount': '10.00'},
+            format='json').status_code, 400)
+        self.assertEqual(self.client.post('/api/budgets/', {'category': self.power.pk, 'amount': '10.00',
+            'thresholds': '80,abc'}, format='json').status_code, 400)
+        response = self.client.get('/api/budgets/status/?month=2025-05')
+        self.assertEqual(response.data['month'], date(2025, 5, 1))
+        self.assertEqual(response.data['budgets'][0]['spent'], '45.00')
+        self.assertEqual(response.data['budgets'][0]['reached'], [80])
+        self.client.post('/api/records/', {'amount': '10.00', 'payment_date': '2025-05-20',
+            'account_id': self.account.pk, 'category_id': self.power.pk}, format='json')
+        row = self.client.get('/api/budgets/status/?month=2025-05').data['budgets'][0]
+        self.assertEqual((row['spent'], row['remaining'], row['reached']), ('55.00', '-5.00', [80, 100]))
+        self.assertEqual(self.client.get('/api/budgets/status/').data['budgets'][0]['spent'], '0.00')
+
+
+class ConditionalGetTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('diogenes', password='tonel')
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.account = Account.objects.create(owner=self.user, name='Caja')
+
+    def test_unchanged_resources_answer_304_without_queries(self):
+        response = self.client.get('/api/accounts/')
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/accounts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        response = self.client.get('/api/accounts/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        # another URL of the same resource has its own ETag
+        self.assertNotEqual(self.client.get('/api/accounts/%d/' % self.account.pk)['ETag'], etag)
+
+    def test_writes_change_the_etag(self):
+        etag = self.client.get('/api/accounts/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Records.objects.create(owner=self.user, account_id=self.account, amount=Decimal('5.00'))
+        response = self.client.get('/api/accounts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['amount'], '-5.00')
+
+        etag = self.client.get('/api/methods_of_payment/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            MethodOfPayment.objects.create(name='Efectivo')
+        self.assertEqual(self.client.get('/api/methods_of_payment/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class RecordsBatchTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('diogenes', password='tonel')
+        self.client.force_authenticate(self.user)
+        self.account = Account.objects.create(owner=self.user, name='Caja', amount=Decimal('100.00'))
+        self.other = Account.objects.create(owner=self.user, name='Banco')
+        self.first = Records.objects.create(owner=self.user, account_id=self.account, amount=Decimal('10.00'),
+            payment_date=date(2025, 1, 1))
+        self.second = Records.objects.create(owner=self.user, account_id=self.account, amount=Decimal('20.00'),
+            payment_date=date(2025, 1, 2))
+
+    def batch(self, *operations):
+        return self.client.post('/api/records/batch/', {'operations': list(operations)}, format='json')
+
+    def balance(self, account):
+        return Account.objects.get(pk=account.pk).amount
+
+    def test_operations_are_applied_with_one_update_per_account(self):
+        create = {'op': 'create', 'data': {'amount': '5.00', 'payment_date': '2025-02-01', 'account_id': self.account.pk}}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.batch(create, create,
+                {'op': 'update', 'id': self.first.pk, 'data': {'account_id': self.other.pk}},
+                {'op': 'delete', 'id': self.second.pk})
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual([result['status'] for result in response.data['results']], [201, 201, 200, 204])
+        self.assertEqual(response.data['results'][2]['data']['account_id'], self.other.pk)
+        self.assertTrue(Records.objects.filter(pk=response.data['results'][0]['data']['id']).exists())
+        self.assertEqual(self.balance(self.account), Decimal('90.00'))
+        self.assertEqual(self.balance(self.other), Decimal('-10.00'))
+        self.assertEqual(summaries.differences(), [])
+        account_updates = [query['sql'] for query in queries
+            if query['sql'].startswith('UPDATE "%s"' % Account._meta.db_table)]
+        self.assertEqual(len(account_updates), 2)
+
+    def test_partial_updates_of_transfers(self):
+        savings = Account.objects.create(owner=self.user, name='Ahorros')
+        transfer = Records.objects.create(owner=self.user, account_id=self.account, destination_account_id=self.other,
+            record_type=Records.RecordType.TRANSFERENCIA, amount=Decimal('25.00'), payment_date=date(2025, 1, 3))
+        response = self.batch({'op': 'update', 'id': transfer.pk, 'data': {'destination_account_id': savings.pk}})
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['results'][0]['data']['destination_account_id'], savings.pk)
+        self.assertEqual((self.balance(self.account), self.balance(self.other), self.balance(savings)),
+            (Decimal('45.00'), Decimal('0.00'), Decimal('25.00')))
+        response = self.batch({'op': 'update', 'id': transfer.pk, 'data': {'destination_account_id': self.account.pk}})
+        self.assertEqual(response.data['results'][0]['errors'], {'destination_account_id':
+            ['Choose an account other than the origin.']})
+        response = self.batch({'op': 'update', 'id': transfer.pk, 'data': {'record_type': 'GAST'}})
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertIsNone(Records.objects.get(pk=transfer.pk).destination_account_id)
+        self.assertEqual((self.balance(self.account), self.balance(savings)), (Decimal('45.00'), Decimal('0.00')))
+
+    def test_nothing_is_applied_if_an_operation_fails(self):
+        stranger = Records.objects.create(owner=User.objects.create_user('alejandro'), amount=Decimal('1.00'))
+        response = self.batch({'op': 'delete', 'id': self.first.pk},
+            {'op': 'update', 'id': self.second.pk, 'data': {'note': 'ok'}},
+            {'op': 'create', 'data': {'amount': '-1'}},
+            {'op': 'delete', 'id': stranger.pk})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([result['status'] for result in response.data['results']], [424, 424, 400, 404])
+        self.assertTrue(Records.objects.filter(pk=self.first.pk).exists())
+        self.assertEqual(self.batch({'op': 'delete', 'id': self.first.pk},
+            {'op': 'update', 'id': self.first.pk, 'data': {}}).status_code, 400)
+
+
+class ChangesTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('diogenes', password='tonel')
+        self.client.force_authenticate(self.user)
+        self.account = Account.objects.create(owner=self.user, name='Caja')
+        Category.objects.create(name='Compartida')
+        Category.objects.create(owner=User.objects.create_user('alejandro'), name='Ajena')
+        self.records = [Records.objects.create(owner=self.user, account_id=self.account, amount=Decimal('1.00'))
+            for _ in range(3)]
+        # written long before the syncs of the tests
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        for model in (Account, Category, MethodOfPayment, Records):
+            model.objects.update(updated_at=an_hour_ago)
+
+    def sync(self, token=None, page_size=2):
+        url = '/api/changes/?page_size=%d' % page_size + ('&since=%s' % token if token else '')
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.data)
+            pages.append(response.data)
+            url = response.data['next']
+        return pages
+
+    def ids(self, pages, resource):
+        return [row['id'] for page in pages for row in page[resource]]
+
+    def test_full_sync_then_only_the_changes(self):
+        pages = self.sync()
+        self.assertEqual(self.ids(pages, 'accounts'), [self.account.pk])
+        self.assertEqual([row['name'] for page in pages for row in page['categories']], ['Compartida'])
+        self.assertEqual(self.ids(pages, 'records'), [record.pk for record in self.records])
+        self.assertIsNone(pages[0]['token'])
+        token = pages[-1]['token']
+
+        self.records[0].update(note='editado')
+        deleted = self.records[1].pk
+        self.records[1].delete()
+        pages = self.sync(token)
+        self.assertEqual(self.ids(pages, 'records'), [self.records[0].pk])
+        # the balance of the account changed with the deletion
+        self.assertEqual(self.ids(pages, 'accounts'), [self.account.pk])
+        self.assertEqual([pk for page in pages for pk in page['deleted']['records']], [deleted])
+        self.assertEqual(self.ids(pages, 'categories'), [])
+
+    def test_records_left_without_their_category_are_sent_again(self):
+        category = Category.objects.create(owner=self.user, name='Comida')
+        Records.objects.filter(pk=self.records[2].pk).update(category_id=category)
+        token = self.sync()[-1]['token']
+        deleted = category.pk
+        category.delete()
+        pages = self.sync(token)
+        self.assertEqual([(row['id'], row['category_id']) for page in pages for row in page['records']],
+            [(self.records[2].pk, None)])
+        self.assertEqual([pk for page in pages for pk in page['deleted']['categories']], [deleted])
+
+    def test_invalid_and_expired_tokens(self):
+        self.assertEqual(self.client.get('/api/changes/?since=nonsense').status_code, 400)
+        expired = sync.encode([(timezone.now() - timedelta(days=365)).isoformat()])
+        self.assertEqual(self.client.get('/api/changes/?since=%s' % expired).status_code, 410)
+
+
+class SearchTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('diogenes', password='tonel')
+        self.client.force_authenticate(self.user)
+        self.account = Account.objects.create(owner=self.user, name='Caja')
+        self.once = self.record('Pago al plomero')
+        self.twice = self.record('plomero, plomero urgente')
+        Records.objects.create(owner=User.objects.create_user('alejandro'), amount=Decimal('1.00'), note='plomero')
+        self.customer = Customer.objects.create(owner=self.user, name='Plomería Gómez', description='Caños')
+        self.category = Category.objects.create(name='Plomería')
+
+    def record(self, note):
+        return Records.objects.create(owner=self.user, account_id=self.account, amount=Decimal('1.00'), note=note)
+
+    def search(self, query):
+        response = self.client.get('/api/search/?' + query)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [(hit['resource'], hit['id']) for hit in response.data['results']]
+
+    def test_ranked_owner_scoped_and_accent_insensitive(self):
+        self.assertEqual(self.search('q=PLOMERO'), [('records', self.twice.pk), ('records', self.once.pk)])
+        self.assertEqual(sorted(self.search('q=plomeria')),
+            [('categories', self.category.pk), ('customers', self.customer.pk)])
+        self.assertEqual(self.search('q=canos gomez'), [('customers', self.customer.pk)])
+        self.assertEqual(len(self.search('q=plom')), 4)
+        self.assertEqual(self.search('q=plom&resources=customers'), [('customers', self.customer.pk)])
+        self.assertEqual(self.client.get('/api/search/?q=plom&resources=accounts').status_code, 400)
+        self.assertEqual(self.search('q=%22%29 OR *'), [])
+
+    def test_index_follows_the_writes(self):
+        self.once.update(note='Electricista')
+        Records.objects.filter(pk=self.twice.pk).update(note='gasista')
+        self.customer.delete()
+        self.assertEqual(self.search('q=plomero'), [])
+        self.assertEqual(self.search('q=electricista'), [('records', self.once.pk)])
+        self.assertEqual(self.search('q=gasista'), [('records', self.twice.pk)])
+        self.assertEqual(self.search('q=plomeria'), [('categories', self.category.pk)])
+
+    def test_pages(self):
+        response = self.client.get('/api/search/?q=plom&page_size=3')
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertEqual(response.data['results'][0]['object']['id'], response.data['results'][0]['id'])
+        rest = self.client.get(response.data['next']).data
+        self.assertEqual(len(rest['results']), 1)
+        self.assertIsNone(rest['next'])
+
+
+class MetricsTests(APITestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.staff = User.objects.create_user('diogenes', password='tonel', is_staff=True)
+        self.user = User.objects.create_user('alejandro', password='magno')
+        Account.objects.create(owner=self.user, name='Caja')
+
+    def test_views_are_measured_for_the_staff_only(self):
+        self.client.force_authenticate(self.user)
+        for _ in range(3):
+            self.assertEqual(self.client.get('/api/accounts/').status_code, 200)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        self.client.force_authenticate(self.staff)
+        views = {(stats['view'], stats['method']): stats for stats in self.client.get('/api/metrics/').data['views']}
+        accounts = views['/api/accounts/', 'GET']
+        self.assertEqual(accounts['latency']['count'], 3)
+        self.assertEqual(accounts['queries']['max'], 1)
+        self.assertLessEqual(accounts['latency']['p50'], accounts['latency']['p99'])
+        self.assertEqual(views['/api/metrics/', 'GET']['latency']['count'], 1)
+
+    def test_prometheus_format(self):
+        self.client.force_authenticate(self.staff)
+        self.client.get('/api/accounts/')
+        response = self.client.get('/api/metrics/?format=prometheus')
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        lines = response.content.decode().splitlines()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', lines)
+        labels = 'view="/api/accounts/",method="GET"'
+        self.assertIn('http_request_sql_queries_bucket{%s,le="1.0"} 1' % labels, lines)
+        self.assertIn('http_request_sql_queries_bucket{%s,le="+Inf"} 1' % labels, lines)
+        self.assertIn('http_request_duration_seconds_count{%s} 1' % labels, lines)
+
+    @override_settings(METRICS_SAMPLE_RATE=1, METRICS_SLOW_QUERY_MS=0)
+    def test_traced_queries_are_logged_with_their_call_site(self):
+        self.client.force_authenticate(self.user)
+        with self.assertLogs('apps.metrics', 'WARNING') as logs:
+            self.client.get('/api/accounts/%d/balance/' % Account.objects.get().pk)
+        self.assertIn('/api/accounts/<int:pk>/balance/', logs.output[0])
+        slowest = metrics.snapshot()['slowest_queries']
+        self.assertTrue(slowest)
+        self.assertTrue(all(query['call_site'].startswith('apps' + os.sep) for query in slowest))
+
+    def test_quantiles(self):
+        histogram = metrics.Histogram((1, 2, 5, 10))
+        for value in range(1, 11):
+            histogram.observe(value)
+        self.assertEqual(histogram.quantile(0.5), 5)
+        self.assertAlmostEqual(histogram.quantile(0.99), 9.9)
+        self.assertEqual(histogram.max, 10)
+
+
+class ReplicaRoutingTests(APITransactionTestCase):
+    '''The list and report views read from the replica, with the primary as fallback'''
+
+    def setUp(self):
+        if connection.vendor != 'sqlite' or connection.is_in_memory_db():
+            self.skipTest('the replica is a copy of the SQLite test database')
+        self.user = User.objects.create_user('diogenes', password='tonel')
+        self.caja = Account.objects.create(owner=self.user, name='Caja')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.replica = os.path.join(directory.name, 'replica.sqlite3')
+        connection.ensure_connection()
+        with sqlite3.connect(self.replica) as copy:
+            connection.connection.backup(copy)
+        copy.close()
+        # written after the copy: only on the primary
+        self.banco = Account.objects.create(owner=self.user, name='Banco')
+        self.add_replica('replica', self.replica)
+        self.addCleanup(routers._down.clear)
+        self.client.force_authenticate(self.user)
+
+    def add_replica(self, alias, path):
+        connections.settings[alias] = dict(connection.settings_dict, NAME='file:%s?mode=ro' % path)
+        self.addCleanup(connections.settings.pop, alias)
+        self.addCleanup(connections.__delitem__, alias)
+        self.addCleanup(lambda: connections[alias].close())
+
+    def names(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return sorted(account['name'] for account in response.data)
+
+    def test_lists_read_the_replica(self):
+        with self.settings(DATABASE_REPLICAS=['replica'], REPLICA_LAG_SECONDS=0):
+            self.assertEqual(self.names('/api/accounts/'), ['Caja'])
+            # a detail is read from the primary
+            self.assertEqual(self.client.get('/api/accounts/%d/' % self.banco.pk).status_code, 200)
+            response = self.client.post('/api/accounts/', {'name': 'Ahorros'}, format='json')
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.names('/api/accounts/'), ['Ahorros', 'Banco', 'Caja'])
+
+    def test_resources_written_within_the_lag_are_read_from_the_primary(self):
+        with self.settings(DATABASE_REPLICAS=['replica'], REPLICA_LAG_SECONDS=60):
+            response = self.client.get('/api/accounts/')
+            self.assertEqual(sorted(account['name'] for account in response.data), ['Banco', 'Caja'])
+            self.assertEqual(self.client.get('/api/accounts/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+            # written long ago: the replica has them
+            with mock.patch('time.time', return_value=time.time() + 120):
+                self.assertEqual(self.names('/api/accounts/'), ['Caja'])
+
+    def test_reads_after_a_write_or_in_a_transaction_stay_on_the_primary(self):
+        with self.settings(DATABASE_REPLICAS=['replica']), routers.replica_reads():
+            self.assertEqual(Account.objects.count(), 1)
+            with transaction.atomic():
+                self.assertEqual(Account.objects.count(), 2)
+            Account.objects.create(owner=self.user, name='Ahorros')
+            self.assertEqual(Account.objects.count(), 3)
+
+    def test_replica_down_falls_back_to_the_primary(self):
+        self.add_replica('missing', os.path.join(os.path.dirname(self.replica), 'missing.sqlite3'))
+        with self.settings(DATABASE_REPLICAS=['missing'], REPLICA_LAG_SECONDS=0):
+            with self.assertLogs('apps.routers', 'WARNING'):
+                self.assertEqual(self.names('/api/accounts/'), ['Banco', 'Caja'])
+            # not tried again meanwhile
+            with self.assertNoLogs('apps.routers', 'WARNING'):
+                self.assertEqual(self.names('/api/accounts/'), ['Banco', 'Caja'])
+        self.assertIn('missing', routers._down)
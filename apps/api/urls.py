@@ -5,14 +5,29 @@ from apps.api import views
 urlpatterns = [
     path('records/', views.RecordsList.as_view()),
     path('records/<int:pk>/', views.RecordsDetail.as_view()),
+    path('records/import/', views.RecordsImport.as_view()),
+    path('records/batch/', views.RecordsBatch.as_view()),
+    path('records/export/<str:kind>/', views.RecordsExport.as_view()),
     path('categories/', views.CategoryList.as_view()),
     path('categories/<int:pk>/', views.CategoryDetail.as_view()),
+    path('categories/tree/', views.CategoryTree.as_view()),
+    path('categories/rollup/', views.CategoryRollup.as_view()),
     path('methods_of_payment/', views.MethodOfPaymentList.as_view()),
     path('methods_of_payment/<int:pk>/', views.MethodOfPaymentDetail.as_view()),
     path('accounts/', views.AccountList.as_view()),
     path('accounts/<int:pk>/', views.AccountDetail.as_view()),
+    path('accounts/<int:pk>/balance/', views.AccountBalance.as_view()),
+    path('customers/', views.CustomerList.as_view()),
+    path('customers/<int:pk>/', views.CustomerDetail.as_view()),
+    path('budgets/', views.BudgetList.as_view()),
+    path('budgets/<int:pk>/', views.BudgetDetail.as_view()),
+    path('budgets/status/', views.BudgetStatus.as_view()),
     path('users/', views.UserList.as_view()),
     path('users/<int:pk>/', views.UserDetail.as_view()),
+    path('reports/monthly/', views.MonthlyReport.as_view()),
+    path('changes/', views.Changes.as_view()),
+    path('search/', views.Search.as_view()),
+    path('metrics/', views.Metrics.as_view()),
 
 ]
 
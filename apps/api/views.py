@@ -1,68 +1,467 @@
-from apps.accounting_records.models import Category, MethodOfPayment, Records, Account
-from apps.api.serializers import CategorySerializer, MethodOfPaymentSerializer, RecordsSerializer, AccountSerializer, UserSerializer
+from apps.accounting_records.models import Category, MethodOfPayment, Records, Account, Customer, Budget
+from apps.accounting_records import balances, budgets, posting, search, summaries, tree
+from apps.accounting_records.exporters import CONTENT_TYPES, export_records
+from apps.accounting_records.importers import StatementError, guess_format, import_statement
+from apps import metrics
+from apps.routers import ReplicaReadsMixin
+from apps.api.conditional import ConditionalGetMixin
+from apps.api.fieldsets import SparseFieldsMixin
+from apps.api.filters import OwnerFilter, RecordsFilter
+from apps.api import sync
+from apps.api.pagination import KeysetPagination
+from apps.api.renderers import ColumnarJSONRenderer, PrometheusRenderer
+from apps.api.serializers import CategorySerializer, MethodOfPaymentSerializer, RecordsSerializer, AccountSerializer, UserSerializer, StatementImportSerializer, MonthlyReportQuerySerializer, MonthlyReportRowSerializer, CategoryRollupQuerySerializer, RunningBalanceRecordsSerializer, AccountBalanceQuerySerializer, CustomerSerializer, RecordsBatchSerializer, SearchQuerySerializer, BudgetSerializer, BudgetStatusQuerySerializer, BudgetStatusRowSerializer
 from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.http import Http404, StreamingHttpResponse
+from django.utils import timezone
 from rest_framework import generics
 from rest_framework import permissions
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.views import APIView
 
 # Create your views here.
 
-class RecordsList(generics.ListCreateAPIView):
-    queryset = Records.objects.all()
+class RecordsList(ReplicaReadsMixin, ConditionalGetMixin, SparseFieldsMixin, generics.ListCreateAPIView):
+    '''Records of the user; ?fields= narrows them (e.g. payment_date,amount), ?format=columnar lists one array per field'''
+    version_resources = ('records', 'accounts', 'categories', 'methods_of_payment', 'customers')
+    queryset = Records.objects.select_related('owner')
     serializer_class = RecordsSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    filter_backends = [OwnerFilter, RecordsFilter]
+    pagination_class = KeysetPagination
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [ColumnarJSONRenderer]
+
+    def running_balance_account(self):
+        '''Account filtered alone, whose balance after each record is listed'''
+        params = self.request.query_params
+        if self.request.method != 'GET' or {'category', 'record_type'} & set(params):
+            return None
+        if params.get('account', '').isdigit():
+            return int(params['account'])
+
+    def get_serializer_class(self):
+        if self.running_balance_account() is not None:
+            return RunningBalanceRecordsSerializer
+        return super().get_serializer_class()
+
+    def required_columns(self):
+        # the running balance is computed from the posting of every record
+        if self.running_balance_account() is not None:
+            return ('record_type', 'amount', 'payment_date', 'owner', 'account_id', 'category_id',
+                'destination_account_id')
+        return ()
+
+    def list(self, request, *args, **kwargs):
+        account = self.running_balance_account()
+        if account is None and self.columnar_response():
+            response = self.columnar_list()
+            if response is not None:
+                return response
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        if account is not None:
+            for record, balance in zip(page, balances.running_balances(account, page)):
+                record.balance = balance
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
-class RecordsDetail(generics.RetrieveUpdateDestroyAPIView):
+class RecordsImport(APIView):
+    '''Import a CSV or OFX bank statement into the records of an account'''
+    parser_classes = [MultiPartParser]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, format=None):
+        serializer = StatementImportSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        statement = serializer.validated_data['file']
+        fmt = serializer.validated_data.get('format') or guess_format(statement.name)
+        try:
+            result = import_statement(statement, request.user, serializer.validated_data['account'], fmt=fmt)
+        except StatementError as exc:
+            return Response({'file': [str(exc)]}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'rows': result.rows, 'skipped': result.skipped, 'seconds': round(result.seconds, 3),
+            'rows_per_second': round(result.rows_per_second, 1)}, status=status.HTTP_201_CREATED)
+
+class RecordsBatch(APIView):
+    '''Create, update and delete many records in one transaction.
+
+    The body is ``{"operations": [{"op": "create", "data": {...}},
+    {"op": "update", "id": 1, "data": {...}}, {"op": "delete", "id": 2}]}``;
+    updates are partial. The creates are validated with one
+    ``RecordsSerializer`` list and every update against its stored record,
+    the related objects looked up once for all of them; if any item fails,
+    nothing is applied. The records are written with bulk queries and their balances
+    posted once, one ``UPDATE`` per account.
+    '''
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, format=None):
+        batch = RecordsBatchSerializer(data=request.data)
+        batch.is_valid(raise_exception=True)
+        operations = batch.validated_data['operations']
+        with transaction.atomic():
+            ids = [operation['id'] for operation in operations if operation['op'] != 'create']
+            stored = Records.objects.select_for_update().filter(owner=request.user).in_bulk(ids)
+            results = self.validate(request, operations, stored)
+            if any(result['status'] >= 400 for result in results):
+                for result in results:
+                    if result['status'] < 400:
+                        # valid, but not applied because of the others
+                        result['status'] = status.HTTP_424_FAILED_DEPENDENCY
+                    result.pop('record', None)
+                    result.pop('fields', None)
+                return Response({'results': results}, status=status.HTTP_400_BAD_REQUEST)
+            self.apply(request, operations, results)
+        written = [result for result in results if 'record' in result]
+        data = RecordsSerializer([result.pop('record') for result in written], many=True,
+            context={'request': request}).data
+        for result, item in zip(written, data):
+            result['data'] = item
+        return Response({'results': results})
+
+    def validate(self, request, operations, stored):
+        '''Return the result of every operation, with the record to write if it is valid.'''
+        results = [None] * len(operations)
+        context = {'request': request}
+        indexes = [index for index, operation in enumerate(operations) if operation['op'] == 'create']
+        serializer = RecordsSerializer(data=[operations[index]['data'] for index in indexes], many=True,
+            context=context)
+        if serializer.is_valid():
+            for index, data in zip(indexes, serializer.validated_data):
+                results[index] = self.written(Records(owner=request.user), data, status.HTTP_201_CREATED)
+        else:
+            for index, errors in zip(indexes, serializer.errors):
+                results[index] = {'status': status.HTTP_400_BAD_REQUEST, 'errors': errors} if errors else {
+                    'status': status.HTTP_201_CREATED}
+        for index, operation in enumerate(operations):
+            if operation['op'] != 'update' or operation['id'] not in stored:
+                continue
+            # the validation of a transfer reads the fields left as they are from the stored record
+            record = stored[operation['id']]
+            serializer = RecordsSerializer(record, data=operation['data'], partial=True, context=context)
+            if serializer.is_valid():
+                results[index] = self.written(record, serializer.validated_data, status.HTTP_200_OK)
+            else:
+                results[index] = {'status': status.HTTP_400_BAD_REQUEST, 'errors': serializer.errors}
+        for index, operation in enumerate(operations):
+            if operation['op'] != 'create' and operation['id'] not in stored:
+                results[index] = {'status': status.HTTP_404_NOT_FOUND, 'errors': {'id': ['Not found.']}}
+            elif operation['op'] == 'delete':
+                results[index] = {'status': status.HTTP_204_NO_CONTENT}
+        return results
+
+    def written(self, record, data, status_code):
+        for name, value in data.items():
+            setattr(record, name, value)
+        return {'status': status_code, 'record': record, 'fields': set(data)}
+
+    def apply(self, request, operations, results):
+        created = [result['record'] for result in results if result['status'] == status.HTTP_201_CREATED]
+        updated = [result['record'] for result in results if result['status'] == status.HTTP_200_OK]
+        fields = set().union(*(result.pop('fields') for result in results if 'fields' in result)) - {'owner'}
+        now = timezone.now()
+        for record in updated:
+            record.updated_at = now
+        deleted = [operation['id'] for operation in operations if operation['op'] == 'delete']
+        with posting.deferred():
+            if connection.features.can_return_rows_from_bulk_insert:
+                Records.objects.bulk_create(created)
+            else:
+                # without RETURNING the ids are only known inserting one by one
+                for record in created:
+                    record.save_base(force_insert=True)
+            posting.post(added=[posting.entry_for(record) for record in created])
+            if updated:
+                Records.objects.bulk_update(updated, sorted(fields | {'updated_at'}))
+            if deleted:
+                Records.objects.filter(pk__in=deleted).delete()
+
+class RecordsExport(ReplicaReadsMixin, ConditionalGetMixin, generics.GenericAPIView):
+    '''Stream the (filtered) records of the user as a CSV or XLSX file'''
+    version_resources = ('records', 'accounts', 'categories', 'methods_of_payment', 'customers')
     queryset = Records.objects.all()
+    permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [OwnerFilter, RecordsFilter]
+
+    def get(self, request, kind, format=None):
+        if kind not in CONTENT_TYPES:
+            raise Http404
+        records = self.filter_queryset(self.get_queryset())
+        # the rows are read while streaming, after the view returned: pin the replica now
+        records = records.using(records.db)
+        response = StreamingHttpResponse(export_records(records, kind), content_type=CONTENT_TYPES[kind])
+        response['Content-Disposition'] = 'attachment; filename="registros.%s"' % kind
+        return response
+
+class RecordsDetail(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
+    version_resources = ('records', 'accounts', 'categories', 'methods_of_payment', 'customers')
+    queryset = Records.objects.select_related('owner')
     serializer_class = RecordsSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    filter_backends = [OwnerFilter]
 
-class CategoryList(generics.ListCreateAPIView):
-    queryset = Category.objects.all()
+class CategoryList(ReplicaReadsMixin, ConditionalGetMixin, generics.ListCreateAPIView):
+    version_resources = ('categories',)
+    queryset = Category.objects.select_related('owner')
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    filter_backends = [OwnerFilter]
+    include_shared = True
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
-class CategoryDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Category.objects.all()
+class CategoryDetail(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
+    version_resources = ('categories',)
+    queryset = Category.objects.select_related('owner')
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    filter_backends = [OwnerFilter]
+    include_shared = True
 
-class MethodOfPaymentList(generics.ListCreateAPIView):
-    queryset = MethodOfPayment.objects.all()
+class CategoryTree(ReplicaReadsMixin, ConditionalGetMixin, APIView):
+    '''Nested categories of the user (and the shared ones), served from the cache'''
+    version_resources = ('categories',)
+    permission_classes = [permissions.IsAuthenticated]
+    include_shared = True
+
+    def get(self, request, format=None):
+        return Response(tree.category_tree(request.user))
+
+class CategoryRollup(ReplicaReadsMixin, ConditionalGetMixin, APIView):
+    '''Category tree with the own and subtree-inclusive totals of a period'''
+    version_resources = ('categories', 'records')
+    permission_classes = [permissions.IsAuthenticated]
+    include_shared = True
+
+    def get(self, request, format=None):
+        query = CategoryRollupQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        return Response(tree.rollup(request.user, since=params.get('since'), until=params.get('until'),
+            record_type=params['record_type']))
+
+class MethodOfPaymentList(ReplicaReadsMixin, ConditionalGetMixin, generics.ListCreateAPIView):
+    version_resources = ('methods_of_payment',)
+    queryset = MethodOfPayment.objects.select_related('owner')
     serializer_class = MethodOfPaymentSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    filter_backends = [OwnerFilter]
+    include_shared = True
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
-class MethodOfPaymentDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = MethodOfPayment.objects.all()
+class MethodOfPaymentDetail(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
+    version_resources = ('methods_of_payment',)
+    queryset = MethodOfPayment.objects.select_related('owner')
     serializer_class = MethodOfPaymentSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    filter_backends = [OwnerFilter]
+    include_shared = True
 
-class AccountList(generics.ListCreateAPIView):
-    queryset = Account.objects.all()
+class AccountList(ReplicaReadsMixin, ConditionalGetMixin, generics.ListCreateAPIView):
+    version_resources = ('accounts',)
+    queryset = Account.objects.select_related('owner')
     serializer_class = AccountSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    filter_backends = [OwnerFilter]
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
-class AccountDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Account.objects.all()
+class AccountDetail(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
+    version_resources = ('accounts',)
+    queryset = Account.objects.select_related('owner')
     serializer_class = AccountSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    filter_backends = [OwnerFilter]
+
+class AccountBalance(ConditionalGetMixin, generics.GenericAPIView):
+    '''Balance of an account at the end of a date, from the nearest checkpoint'''
+    version_resources = ('accounts', 'records')
+    queryset = Account.objects.all()
+    permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [OwnerFilter]
+
+    def get(self, request, pk, format=None):
+        account = self.get_object()
+        query = AccountBalanceQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        day = query.validated_data['date']
+        return Response({'account': account.pk, 'date': day, 'balance': str(balances.balance_at(account.pk, day))})
+
+class CustomerList(ReplicaReadsMixin, ConditionalGetMixin, generics.ListCreateAPIView):
+    version_resources = ('customers',)
+    queryset = Customer.objects.select_related('owner')
+    serializer_class = CustomerSerializer
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    filter_backends = [OwnerFilter]
+
+    def perform_create(self, serializer):
+        serializer.save(owner=self.request.user)
+
+class CustomerDetail(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
+    version_resources = ('customers',)
+    queryset = Customer.objects.select_related('owner')
+    serializer_class = CustomerSerializer
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    filter_backends = [OwnerFilter]
+
+class BudgetList(ConditionalGetMixin, generics.ListCreateAPIView):
+    version_resources = ('budgets',)
+    queryset = Budget.objects.select_related('owner')
+    serializer_class = BudgetSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [OwnerFilter]
+
+    def perform_create(self, serializer):
+        serializer.save(owner=self.request.user)
+
+class BudgetDetail(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
+    version_resources = ('budgets',)
+    queryset = Budget.objects.select_related('owner')
+    serializer_class = BudgetSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [OwnerFilter]
+
+class BudgetStatus(APIView):
+    '''Budgets of the user with their spend of a month (the current one by default), in one query'''
+    permission_classes = [permissions.IsAuthenticated]
 
+    def get(self, request, format=None):
+        query = BudgetStatusQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        month = summaries.month_of(query.validated_data.get('month') or timezone.localdate())
+        rows = budgets.status(request.user, month)
+        return Response({'month': month, 'budgets': BudgetStatusRowSerializer(rows, many=True).data})
 
-class UserList(generics.ListCreateAPIView):
-    queryset = User.objects.all()
+
+class UserQuerysetMixin:
+    '''Staff users see every user, the rest only themselves'''
+
+    def get_queryset(self):
+        user = self.request.user
+        queryset = super().get_queryset()
+        if user.is_staff:
+            return queryset
+        if not user.is_authenticated:
+            return queryset.none()
+        return queryset.filter(pk=user.pk)
+
+class UserList(UserQuerysetMixin, generics.ListCreateAPIView):
+    queryset = User.objects.prefetch_related('groups')
     serializer_class = UserSerializer
 
-class UserDetail(generics.RetrieveAPIView):
-    queryset = User.objects.all()
-    serializer_class = UserSerializer
\ No newline at end of file
+class UserDetail(UserQuerysetMixin, generics.RetrieveAPIView):
+    queryset = User.objects.prefetch_related('groups')
+    serializer_class = UserSerializer
+
+
+class MonthlyReport(ReplicaReadsMixin, ConditionalGetMixin, APIView):
+    '''Totals per month, account, category and/or type read from the monthly summary'''
+    version_resources = ('records',)
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, format=None):
+        query = MonthlyReportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        filters = {}
+        for name, field in (('account', 'account_id'), ('category', 'category_id'), ('record_type', 'record_type')):
+            if name in params:
+                filters[field] = params[name]
+        rows = summaries.report(request.user, since=params.get('since'), until=params.get('until'),
+            group_by=params['group_by'], **filters)
+        return Response(MonthlyReportRowSerializer(rows, many=True).data)
+
+
+
+class Search(ConditionalGetMixin, APIView):
+    '''Records, customers and categories of the user matching a text, best first.
+
+    ``q`` is searched as words (the last one as a prefix) in the notes of the
+    records, the names and descriptions of the customers and the names of
+    the categories, ignoring case and accents. The pages are followed with
+    ``next``.
+    '''
+    version_resources = ('records', 'customers', 'categories')
+    permission_classes = [permissions.IsAuthenticated]
+    include_shared = True
+    serializers = {'records': RecordsSerializer, 'customers': CustomerSerializer, 'categories': CategorySerializer}
+
+    def get(self, request, format=None):
+        query = SearchQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        page_size = KeysetPagination().get_page_size(request)
+        hits = search.search(request.user, params['q'], params['resources'], limit=page_size + 1,
+            offset=params['offset'])
+        next_link = None
+        if len(hits) > page_size:
+            hits = hits[:page_size]
+            next_link = replace_query_param(request.build_absolute_uri(), 'offset', params['offset'] + page_size)
+        return Response({'next': next_link, 'results': self.results(hits)})
+
+    def results(self, hits):
+        '''Serialize the hits with one query per resource, skipping the rows deleted meanwhile.'''
+        objects = {}
+        for resource in {resource for resource, _, _ in hits}:
+            model, _ = search.SOURCES[resource]
+            ids = [pk for hit_resource, pk, _ in hits if hit_resource == resource]
+            objects[resource] = model.objects.select_related('owner').in_bulk(ids)
+        context = {'request': self.request}
+        return [{'resource': resource, 'id': pk, 'score': score,
+            'object': self.serializers[resource](objects[resource][pk], context=context).data}
+            for resource, pk, score in hits if pk in objects[resource]]
+
+
+class Changes(APIView):
+    '''Accounts, categories, payment methods and records changed since a sync token.
+
+    Without ``since`` every row is sent. The pages are followed with ``next``
+    and the last one carries the ``token`` for the next sync; the ids of the
+    rows deleted since the token are listed in ``deleted``.
+    '''
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, format=None):
+        try:
+            since = sync.start(request.query_params.get('since'))
+            if request.query_params.get('cursor'):
+                until, position = sync.resume(request.query_params['cursor'])
+            else:
+                until, position = timezone.now(), None
+        except sync.InvalidToken:
+            raise ValidationError({'since': ['Invalid token or cursor.']})
+        if sync.expired(since):
+            return Response({'detail': 'The token expired, sync from scratch.'}, status=status.HTTP_410_GONE)
+        page, position = sync.changes_page(request.user, since, until, position,
+            KeysetPagination().get_page_size(request), {'request': request})
+        if position is None:
+            links = {'next': None, 'token': sync.next_token(until)}
+        else:
+            links = {'next': replace_query_param(request.build_absolute_uri(), 'cursor', sync.cursor(until, position)),
+                'token': None}
+        return Response(dict(links, **page))
+
+
+class Metrics(APIView):
+    '''Latency, query count and SQL time percentiles per view of this process.
+
+    ``?format=prometheus`` answers the histograms in the Prometheus text format.
+    '''
+    permission_classes = [permissions.IsAdminUser]
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [PrometheusRenderer]
+
+    def get(self, request, format=None):
+        if request.accepted_renderer.format == PrometheusRenderer.format:
+            return Response(metrics.exposition())
+        return Response(metrics.snapshot())
@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+
+
+class AuthenticationConfig(AppConfig):
+    name = 'apps.authentication'
+
+    def ready(self):
+        from . import checks  # noqa: F401
+        from .backends import forget_user
+        post_save.connect(forget_user, sender=settings.AUTH_USER_MODEL, dispatch_uid='forget_cached_user')
+        post_delete.connect(forget_user, sender=settings.AUTH_USER_MODEL, dispatch_uid='forget_cached_user')
@@ -0,0 +1,33 @@
+'''Authentication backend with the users cached between requests.
+
+``AuthenticationMiddleware`` loads the user of the session on every
+authenticated request; :class:`CachedModelBackend` answers it from the cache
+for ``USER_CACHE_TIMEOUT`` seconds. Saving or deleting a user drops its
+entry (see :mod:`.apps`), so a password change or a deactivation is seen by
+the next request; a bulk ``update()`` of users is seen within the timeout.
+'''
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+
+USER_CACHE_TIMEOUT = 5 * 60
+
+
+def user_cache_key(user_id):
+    return 'auth:user:%s' % user_id
+
+
+def forget_user(sender, instance, **kwargs):
+    cache.delete(user_cache_key(instance.pk))
+
+
+class CachedModelBackend(ModelBackend):
+
+    def get_user(self, user_id):
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, USER_CACHE_TIMEOUT)
+        return user if user is not None and self.user_can_authenticate(user) else None
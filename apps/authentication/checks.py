@@ -0,0 +1,41 @@
+'''System checks of the cache the sessions and the version tokens rely on.'''
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+
+# caches that every process keeps for itself
+LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def local_cache():
+    backend = settings.CACHES['default']['BACKEND']
+    return backend in LOCAL_CACHES
+
+
+@register(Tags.caches)
+def check_write_behind_cache(app_configs, **kwargs):
+    '''The write-behind sessions need a cache shared by the workers.'''
+    if settings.SESSION_WRITE_BEHIND_SECONDS > 0 and local_cache():
+        return [Error(
+            'SESSION_WRITE_BEHIND_SECONDS needs a cache shared by the workers, not %s.'
+                % settings.CACHES['default']['BACKEND'],
+            hint='Set CACHE_BACKEND to file or redis, or SESSION_WRITE_BEHIND_SECONDS to 0.',
+            id='authentication.E001',
+        )]
+    return []
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    '''With a cache of the process every worker has its own users and version tokens.'''
+    if local_cache():
+        return [Warning(
+            'The default cache is local to each process: with several workers the cached users '
+            'and the version tokens (ETags) of the workers disagree.',
+            hint='Set CACHE_BACKEND to file or redis.',
+            id='authentication.W001',
+        )]
+    return []
@@ -0,0 +1,61 @@
+'''Sessions read from the cache and written behind to the database.
+
+``SESSION_ENGINE = 'apps.authentication.sessions'``. Like Django's
+``cached_db`` engine a session is read from the cache, and from the
+database only when the cache lost it, so an authenticated request costs no
+session query. The writes differ: a session saved again within
+``SESSION_WRITE_BEHIND_SECONDS`` of its last write to the database only
+updates the cache, and the database copy catches up with a later save. A
+session lost by the cache meanwhile (eviction, restart of a local cache)
+comes back as it was at that last write, which for a session (the login,
+the messages) is an acceptable loss. With several workers the cache must
+be shared (file or Redis), since a worker falls back to the database copy;
+the system checks (:mod:`.checks`) reject a write-behind window over a cache
+of the process.
+
+The sessions logged in before ``CachedModelBackend`` name Django's
+``ModelBackend``, which is no longer in ``AUTHENTICATION_BACKENDS``: they are
+loaded with the cached backend instead, so the users stay logged in.
+'''
+import time
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY
+from django.contrib.sessions.backends import cached_db
+
+
+# backend of the sessions logged in before the cached one
+MODEL_BACKEND = 'django.contrib.auth.backends.ModelBackend'
+CACHED_BACKEND = 'apps.authentication.backends.CachedModelBackend'
+
+
+class SessionStore(cached_db.SessionStore):
+    '''Cached database session whose saves within the write-behind window only go to the cache.'''
+
+    @property
+    def persisted_key(self):
+        '''Cache key of the time of the last write of the session to the database.'''
+        return self.cache_key + ':persisted'
+
+    def load(self):
+        data = super().load()
+        if data.get(BACKEND_SESSION_KEY) == MODEL_BACKEND:
+            data[BACKEND_SESSION_KEY] = CACHED_BACKEND
+        return data
+
+    def save(self, must_create=False):
+        now = time.time()
+        if not must_create and self.session_key is not None:
+            persisted = self._cache.get(self.persisted_key)
+            if persisted is not None and now - persisted < settings.SESSION_WRITE_BEHIND_SECONDS:
+                self._cache.set(self.cache_key, self._session, self.get_expiry_age())
+                return
+        super().save(must_create)
+        self._cache.set(self.persisted_key, now, self.get_expiry_age())
+
+    def delete(self, session_key=None):
+        if session_key is None and self.session_key is not None:
+            session_key = self.session_key
+        super().delete(session_key)
+        if session_key is not None:
+            self._cache.delete(self.cache_key_prefix + session_key + ':persisted')
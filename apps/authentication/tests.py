@@ -3,6 +3,105 @@
 Copyright (c) 2019 - present AppSeed.us
 """
 
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.test import TestCase, override_settings
+
+from .checks import check_shared_cache, check_write_behind_cache
+from .sessions import SessionStore
+
+
+class CachedAuthenticationTests(TestCase):
+    '''The session and the user of a request come from the cache, and a change of the user drops it'''
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('diogenes', password='tonel')
+        self.client.force_login(self.user)
+
+    def test_an_authenticated_request_reads_neither_session_nor_user(self):
+        self.client.get('/api/accounts/')
+        # only the accounts
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/accounts/')
+        self.assertEqual(response.status_code, 200)
+
+    def request_user(self):
+        return self.client.get('/').wsgi_request.user
+
+    def test_deactivating_the_user_logs_it_out(self):
+        self.assertEqual(self.request_user(), self.user)
+        self.user.is_active = False
+        self.user.save()
+        self.assertFalse(self.request_user().is_authenticated)
+
+    def test_changing_the_password_ends_the_session(self):
+        self.assertEqual(self.request_user(), self.user)
+        self.user.set_password('barril')
+        self.user.save()
+        self.assertFalse(self.request_user().is_authenticated)
+
+
+@override_settings(SESSION_WRITE_BEHIND_SECONDS=60)
+class WriteBehindSessionTests(TestCase):
+    '''A session saved again within the window is written to the cache only'''
+
+    def setUp(self):
+        cache.clear()
+
+    def stored(self, session):
+        return SessionStore().decode(Session.objects.get(session_key=session.session_key).session_data)
+
+    @mock.patch('apps.authentication.sessions.time.time')
+    def test_the_database_catches_up_after_the_window(self, now):
+        now.return_value = 1000
+        session = SessionStore()
+        session['step'] = 1
+        session.save()
+        self.assertEqual(self.stored(session), {'step': 1})
+
+        now.return_value = 1030
+        session['step'] = 2
+        with self.assertNumQueries(0):
+            session.save()
+        self.assertEqual(self.stored(session), {'step': 1})
+        self.assertEqual(SessionStore(session.session_key).load(), {'step': 2})
+
+        now.return_value = 1061
+        session['step'] = 3
+        session.save()
+        self.assertEqual(self.stored(session), {'step': 3})
+
+    def test_a_deleted_session_is_gone_from_both(self):
+        session = SessionStore()
+        session['step'] = 1
+        session.save()
+        session.delete()
+        self.assertFalse(Session.objects.exists())
+        self.assertEqual(SessionStore(session.session_key).load(), {})
+
+
+class SharedCacheTests(TestCase):
+
+    def test_sessions_of_the_model_backend_stay_logged_in(self):
+        user = User.objects.create_user('diogenes', password='tonel')
+        session = SessionStore()
+        session.update({SESSION_KEY: str(user.pk), BACKEND_SESSION_KEY: 'django.contrib.auth.backends.ModelBackend',
+            HASH_SESSION_KEY: user.get_session_auth_hash()})
+        session.save()
+        self.client.cookies['sessionid'] = session.session_key
+        response = self.client.get('/')
+        self.assertEqual(response.wsgi_request.user, user)
+
+    def test_write_behind_needs_a_shared_cache(self):
+        self.assertEqual(check_write_behind_cache(None), [])
+        with self.settings(SESSION_WRITE_BEHIND_SECONDS=60):
+            self.assertEqual([error.id for error in check_write_behind_cache(None)], ['authentication.E001'])
+            self.assertEqual([warning.id for warning in check_shared_cache(None)], ['authentication.W001'])
+        with self.settings(SESSION_WRITE_BEHIND_SECONDS=60, CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/tmp/diogenes'}}):
+            self.assertEqual(check_write_behind_cache(None) + check_shared_cache(None), [])
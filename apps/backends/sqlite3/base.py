@@ -0,0 +1,50 @@
+'''SQLite backend with the ``transaction_mode`` and ``init_command`` options.
+
+Both options are read from ``OPTIONS`` with the meaning they have in the
+backend of Django 5.1, so upgrading only needs the ``ENGINE`` changed back:
+
+* ``transaction_mode``: ``IMMEDIATE`` starts the transactions (``atomic``)
+  with ``BEGIN IMMEDIATE``, taking the write lock up front. With the default
+  deferred ``BEGIN`` a transaction that read before writing can not upgrade
+  its lock while another one writes and fails at once with "database is
+  locked", without waiting for ``timeout``.
+* ``init_command``: statements (``;`` separated) run on every new
+  connection, e.g. the ``PRAGMA`` of the production profile.
+'''
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        options = self.settings_dict['OPTIONS']
+        self.transaction_mode = options.get('transaction_mode')
+        if self.transaction_mode is not None and self.transaction_mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured('transaction_mode must be one of %s' % ', '.join(TRANSACTION_MODES))
+        self.init_command = options.get('init_command')
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        # not arguments of sqlite3.connect()
+        params.pop('transaction_mode', None)
+        params.pop('init_command', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        if self.init_command:
+            for statement in self.init_command.split(';'):
+                if statement.strip():
+                    conn.execute(statement)
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.transaction_mode is None:
+            super()._start_transaction_under_autocommit()
+        else:
+            self.cursor().execute('BEGIN %s' % self.transaction_mode.upper())
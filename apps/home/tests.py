@@ -3,6 +3,70 @@
 Copyright (c) 2019 - present AppSeed.us
 """
 
+from datetime import date
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from apps.accounting_records.models import Account, Category, Customer, Records
+
+
+class DashboardTests(TestCase):
+    '''The dashboard KPIs are served from the cache until a record, account or customer changes'''
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('diogenes', password='tonel')
+        self.client.force_login(self.user)
+        self.account = Account.objects.create(owner=self.user, name='Caja', amount=Decimal('500.00'))
+        self.category = Category.objects.create(owner=self.user, name='Alquiler', category_type=Category.CategoryType.FIJO)
+        self.customer = Customer.objects.create(owner=self.user, name='Tonel SA')
+
+    def record(self, **kwargs):
+        values = {'owner': self.user, 'account_id': self.account, 'category_id': self.category,
+            'amount': Decimal('100.00'), 'payment_date': date.today()}
+        values.update(kwargs)
+        with self.captureOnCommitCallbacks(execute=True):
+            return Records.objects.create(**values)
+
+    def test_dashboard_is_cached_until_a_record_is_posted(self):
+        self.record(customer_id=self.customer)
+        response = self.client.get('/')
+        dashboard = response.context['dashboard']
+        self.assertEqual(dashboard['balances'][0]['total'], Decimal('400.00'))
+        self.assertEqual(dashboard['month_spend'][0]['total'], Decimal('100.00'))
+        self.assertEqual(dashboard['top_customers'][0]['name'], 'Tonel SA')
+        self.assertContains(response, 'Tonel SA')
+
+        # session, user and dashboard all come from the cache
+        with self.assertNumQueries(0):
+            self.client.get('/')
+
+        self.record(amount=Decimal('50.00'))
+        dashboard = self.client.get('/').context['dashboard']
+        self.assertEqual(dashboard['balances'][0]['total'], Decimal('350.00'))
+        self.assertEqual(dashboard['month_spend_total'], Decimal('150.00'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer.name = 'Barril SA'
+            self.customer.save()
+        self.assertContains(self.client.get('/'), 'Barril SA')
+
+    def test_top_customers_are_ranked_by_income(self):
+        barrel = Customer.objects.create(owner=self.user, name='Barril SA')
+        cask = Customer.objects.create(owner=self.user, name='Tonelete SRL')
+        savings = Account.objects.create(owner=self.user, name='Ahorro', amount=Decimal('0.00'))
+        self.record(customer_id=self.customer, amount=Decimal('900.00'))
+        self.record(customer_id=self.customer, record_type=Records.RecordType.INGRESO, amount=Decimal('50.00'))
+        self.record(customer_id=self.customer, record_type=Records.RecordType.TRANSFERENCIA,
+            destination_account_id=savings, amount=Decimal('5000.00'))
+        self.record(customer_id=barrel, record_type=Records.RecordType.INGRESO, amount=Decimal('300.00'))
+        self.record(customer_id=barrel, amount=Decimal('100.00'))
+        self.record(customer_id=cask, record_type=Records.RecordType.INGRESO, amount=Decimal('120.00'))
+        customers = self.client.get('/').context['dashboard']['top_customers']
+        self.assertEqual([(row['name'], row['income'], row['total'], row['records']) for row in customers], [
+            ('Barril SA', Decimal('300.00'), Decimal('200.00'), 2),
+            ('Tonelete SRL', Decimal('120.00'), Decimal('120.00'), 1),
+            ('Tonel SA', Decimal('50.00'), Decimal('-850.00'), 2)])
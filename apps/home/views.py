@@ -9,10 +9,12 @@ from django.http import HttpResponse, HttpResponseRedirect
 from django.template import loader
 from django.urls import reverse
 
+from apps.accounting_records.dashboard import dashboard
+
 
 @login_required(login_url="/login/")
 def index(request):
-    context = {'segment': 'index'}
+    context = {'segment': 'index', 'dashboard': dashboard(request.user)}
 
     html_template = loader.get_template('home/index.html')
     return HttpResponse(html_template.render(context, request))
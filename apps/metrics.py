@@ -0,0 +1,250 @@
+'''Per-view latency and SQL instrumentation.
+
+:class:`MetricsMiddleware` times every request and counts the queries it runs
+(and their time) on every database, and adds them to in-process histograms
+per view (the URL route and the method). :func:`snapshot` summarizes them
+with their p50/p95/p99 and :func:`exposition` writes them in the Prometheus
+text format; both are served to the staff at ``/api/metrics/``.
+
+The histograms have fixed buckets, so recording a request is a few integer
+increments under a lock and the quantiles are interpolated within a bucket.
+They live in the worker process: each gunicorn worker reports its own.
+
+A fraction ``METRICS_SAMPLE_RATE`` of the requests (none by default) is also
+traced: their queries slower than ``METRICS_SLOW_QUERY_MS`` are logged with
+the line of the project that ran them, and the slowest ``SLOWEST_QUERIES`` are
+kept for the endpoint. Looking up the call site walks the stack, so it is only
+done for those queries.
+'''
+import heapq
+import logging
+import os
+import random
+import threading
+import traceback
+from bisect import bisect_left
+from contextlib import ExitStack
+from time import perf_counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+# upper bounds of the buckets, the last one is +Inf
+SECONDS_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10)
+QUERIES_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+SLOWEST_QUERIES = 20
+
+# statements are cut to this length in the log and the endpoint
+SQL_LENGTH = 500
+
+# frames of these files are skipped looking for the call site of a query
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+LIBRARY_DIRS = ('site-packages', 'dist-packages')
+
+
+class Histogram:
+    '''Counts of the observed values per bucket, plus their sum and maximum.'''
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        '''Estimate the ``q`` quantile, linearly within its bucket.'''
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.bounds[index - 1] if index else 0
+                upper = self.bounds[index] if index < len(self.bounds) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return 0
+
+    def summary(self):
+        summary = {'count': self.count, 'sum': round(self.sum, 6), 'max': round(self.max, 6)}
+        for q in QUANTILES:
+            summary['p%d' % (q * 100)] = round(self.quantile(q), 6)
+        return summary
+
+
+class ViewStats:
+    def __init__(self):
+        self.latency = Histogram(SECONDS_BUCKETS)
+        self.queries = Histogram(QUERIES_BUCKETS)
+        self.sql_time = Histogram(SECONDS_BUCKETS)
+
+
+_lock = threading.Lock()
+_views = {}
+# min-heap of (seconds, sequence, query) of the slowest traced queries
+_slowest = []
+_sequence = 0
+
+
+def record(view, method, seconds, queries, sql_seconds):
+    with _lock:
+        stats = _views.get((view, method))
+        if stats is None:
+            stats = _views[view, method] = ViewStats()
+        stats.latency.observe(seconds)
+        stats.queries.observe(queries)
+        stats.sql_time.observe(sql_seconds)
+
+
+def slow_enough(seconds):
+    '''Whether a traced query is kept among the slowest or logged.'''
+    return (seconds * 1000 >= settings.METRICS_SLOW_QUERY_MS
+        or len(_slowest) < SLOWEST_QUERIES or seconds > _slowest[0][0])
+
+
+def record_query(query):
+    global _sequence
+    with _lock:
+        _sequence += 1
+        item = (query['seconds'], _sequence, query)
+        if len(_slowest) < SLOWEST_QUERIES:
+            heapq.heappush(_slowest, item)
+        elif item > _slowest[0]:
+            heapq.heapreplace(_slowest, item)
+
+
+def reset():
+    global _sequence
+    with _lock:
+        _views.clear()
+        _slowest.clear()
+        _sequence = 0
+
+
+def snapshot():
+    '''Return the summary of every view, slowest p95 first, and the slowest traced queries.'''
+    with _lock:
+        views = [{'view': view, 'method': method, 'latency': stats.latency.summary(),
+            'queries': stats.queries.summary(), 'sql_time': stats.sql_time.summary()}
+            for (view, method), stats in _views.items()]
+        slowest = [query for _, _, query in sorted(_slowest, reverse=True)]
+    views.sort(key=lambda stats: (-stats['latency']['p95'], stats['view'], stats['method']))
+    return {'views': views, 'slowest_queries': slowest}
+
+
+def label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def bound(value):
+    return '+Inf' if value is None else repr(float(value))
+
+
+# metric name, help and attribute of ViewStats of each histogram
+METRICS = (
+    ('http_request_duration_seconds', 'Time to answer a request.', 'latency'),
+    ('http_request_sql_queries', 'SQL queries run by a request.', 'queries'),
+    ('http_request_sql_duration_seconds', 'Time spent in the SQL queries of a request.', 'sql_time'),
+)
+
+
+def exposition():
+    '''Return the histograms in the Prometheus text format.'''
+    with _lock:
+        views = sorted(_views.items())
+        lines = []
+        for name, help_text, attribute in METRICS:
+            lines += ['# HELP %s %s' % (name, help_text), '# TYPE %s histogram' % name]
+            for (view, method), stats in views:
+                histogram = getattr(stats, attribute)
+                labels = 'view="%s",method="%s"' % (label(view), label(method))
+                cumulative = 0
+                for upper, count in zip(histogram.bounds + (None,), histogram.counts):
+                    cumulative += count
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound(upper), cumulative))
+                lines.append('%s_sum{%s} %r' % (name, labels, float(histogram.sum)))
+                lines.append('%s_count{%s} %d' % (name, labels, histogram.count))
+    return '\n'.join(lines) + '\n'
+
+
+def call_site():
+    '''Return ``file:line in function`` of the innermost project frame of the stack.'''
+    for frame in reversed(traceback.extract_stack()):
+        filename = frame.filename
+        if (filename.startswith(PROJECT_DIR) and filename != __file__
+                and not any(directory in filename for directory in LIBRARY_DIRS)):
+            return '%s:%d in %s' % (os.path.relpath(filename, PROJECT_DIR), frame.lineno, frame.name)
+    return None
+
+
+class QueryRecorder:
+    '''Database execute wrapper that counts and times the queries of a request.'''
+
+    def __init__(self, view_of, traced):
+        self.view_of = view_of
+        self.traced = traced
+        self.count = 0
+        self.seconds = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            seconds = perf_counter() - start
+            self.count += 1
+            self.seconds += seconds
+            if self.traced and slow_enough(seconds):
+                self.trace(sql, seconds, context['connection'].alias)
+
+    def trace(self, sql, seconds, alias):
+        query = {'sql': sql[:SQL_LENGTH], 'seconds': round(seconds, 6), 'database': alias,
+            'call_site': call_site(), 'view': self.view_of()}
+        if seconds * 1000 >= settings.METRICS_SLOW_QUERY_MS:
+            logger.warning('Slow query (%.1f ms) at %s in %s: %s', seconds * 1000, query['call_site'],
+                query['view'], query['sql'])
+        record_query(query)
+
+
+def view_name(request):
+    '''The route of the view that answered ``request`` (``unmatched`` for a 404 of the resolver).'''
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return '/' + match.route if match.route else match.view_name or match._func_path
+
+
+class MetricsMiddleware:
+    '''Record the latency, query count and SQL time of every request.
+
+    Keep it first in ``MIDDLEWARE`` so the time of the others (sessions,
+    authentication) is counted too.
+    '''
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        traced = settings.METRICS_SAMPLE_RATE > 0 and random.random() < settings.METRICS_SAMPLE_RATE
+        recorder = QueryRecorder(lambda: view_name(request), traced)
+        start = perf_counter()
+        with ExitStack() as stack:
+            for db in connections.all():
+                stack.enter_context(db.execute_wrapper(recorder))
+            response = self.get_response(request)
+        record(view_name(request), request.method, perf_counter() - start, recorder.count, recorder.seconds)
+        return response
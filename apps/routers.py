@@ -0,0 +1,138 @@
+'''Routing of the reads of the list, report and export views to the replicas.
+
+The views with :class:`ReplicaReadsMixin` run their ``GET`` requests inside
+:func:`replica_reads`: while it lasts :class:`ReplicaRouter` sends the reads
+to one of the ``DATABASE_REPLICAS`` (the same one for the whole request).
+Everything else stays on the primary:
+
+* the writes, and every read of the request after its first write, so a
+  request always reads what it wrote;
+* the reads inside a transaction opened during the request (e.g. with
+  ``select_for_update``), which must see the rows it locks;
+* the reads of any other request.
+
+A view may also send the rest of its reads to the primary with
+:func:`read_from_primary`, e.g. ``ConditionalGetMixin`` when the resources
+it reads were written less than ``REPLICA_LAG_SECONDS`` ago: the ETag comes
+from the version tokens of the primary, and a body read from a replica that
+has not caught up yet would be cached by the client under it.
+
+A replica that can not be connected to is skipped for
+``REPLICA_RETRY_SECONDS``; with none left the reads go to the primary.
+'''
+import contextvars
+import logging
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+
+logger = logging.getLogger(__name__)
+
+REPLICA_RETRY_SECONDS = 30
+
+# state of the request reading from a replica: the replica chosen, whether
+# it wrote and the depth of the transactions of the primary when it started
+_reads = contextvars.ContextVar('replica_reads', default=None)
+
+# replica alias: monotonic time until which it is not tried again
+_down = {}
+
+
+class ReplicaReads:
+    def __init__(self):
+        self.alias = None
+        self.wrote = False
+        self.primary = False
+        self.depth = len(connections[DEFAULT_DB_ALIAS].atomic_blocks)
+
+
+@contextmanager
+def replica_reads():
+    '''Let the reads of the block go to a replica, until it writes.'''
+    token = _reads.set(ReplicaReads())
+    try:
+        yield
+    finally:
+        _reads.reset(token)
+
+
+def read_from_primary():
+    '''Send the rest of the reads of the current request to the primary.'''
+    reads = _reads.get()
+    if reads is not None:
+        reads.primary = True
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', ())
+
+
+def available(alias):
+    '''Whether ``alias`` answers; a failure keeps it out for ``REPLICA_RETRY_SECONDS``.'''
+    if _down.get(alias, 0) > time.monotonic():
+        return False
+    try:
+        connections[alias].ensure_connection()
+    except DatabaseError as exc:
+        logger.warning('Replica %s is down, reading from the primary: %s', alias, exc)
+        _down[alias] = time.monotonic() + REPLICA_RETRY_SECONDS
+        return False
+    _down.pop(alias, None)
+    return True
+
+
+def choose_replica():
+    '''Return a random available replica, or None.'''
+    candidates = list(replicas())
+    random.shuffle(candidates)
+    for alias in candidates:
+        if available(alias):
+            return alias
+    return None
+
+
+class ReplicaRouter:
+    '''Database router of the replicas (``DATABASE_ROUTERS``).'''
+
+    def db_for_read(self, model, **hints):
+        reads = _reads.get()
+        if reads is None or reads.wrote or reads.primary or not replicas():
+            return None
+        if len(connections[DEFAULT_DB_ALIAS].atomic_blocks) > reads.depth:
+            return DEFAULT_DB_ALIAS
+        if reads.alias is None or reads.alias not in replicas() or _down.get(reads.alias):
+            reads.alias = choose_replica() or DEFAULT_DB_ALIAS
+        return reads.alias
+
+    def db_for_write(self, model, **hints):
+        reads = _reads.get()
+        if reads is not None:
+            reads.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replicas get the schema from the primary
+        if db in replicas():
+            return False
+        return None
+
+
+class ReplicaReadsMixin:
+    '''Read the ``GET``/``HEAD`` requests of the view from a replica.'''
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        with replica_reads():
+            return super().dispatch(request, *args, **kwargs)
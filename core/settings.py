@@ -40,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'apps.home',  # Enable the inner home (home)
+    'apps.authentication',  # Enable the inner authentication (sessions and users cached)
     #'apps.api', # Enable the inner api (api)
     'apps.accounting_records', # Enable the inner accounting_records (accounting_records)    
     'rest_framework',
@@ -47,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'apps.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -100,8 +102,84 @@ else:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': 'db.sqlite3',
+            # a file (instead of the in-memory default) lets the concurrency
+            # tests open one connection per thread against the test database
+            'TEST': {
+                'NAME': 'test_db.sqlite3',
+            },
         }
     }
+    # Production profile (SQLITE_PRODUCTION=True): WAL, so the readers never
+    # wait for a writer; transactions taking the write lock up front, so the
+    # writers queue up for `timeout` seconds instead of failing with
+    # "database is locked"; and connections kept between requests
+    if env.bool('SQLITE_PRODUCTION', default=False):
+        DATABASES['default'].update({
+            'ENGINE': 'apps.backends.sqlite3',
+            'NAME': env('SQLITE_PATH', default='db.sqlite3'),
+            'CONN_MAX_AGE': env.int('CONN_MAX_AGE', default=600),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'timeout': env.int('SQLITE_BUSY_TIMEOUT', default=20),
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': ';'.join((
+                    'PRAGMA journal_mode = WAL',
+                    # durable at every checkpoint instead of every commit (safe with WAL)
+                    'PRAGMA synchronous = NORMAL',
+                    # 64 MB of page cache and 256 MB memory mapped, per connection
+                    'PRAGMA cache_size = -64000',
+                    'PRAGMA mmap_size = 268435456',
+                    'PRAGMA temp_store = MEMORY',
+                )),
+            },
+        })
+
+# Read replicas (DB_REPLICAS, comma separated): the hosts of MySQL replicas
+# with the name and credentials of the primary, or the paths of copies of the
+# SQLite database, opened read-only. The list, report and export views read
+# from them (apps/routers.py)
+DATABASE_REPLICAS = []
+for number, replica in enumerate(env.list('DB_REPLICAS', default=[]), 1):
+    alias = 'replica%d' % number
+    DATABASES[alias] = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+    if 'mysql' in DATABASES[alias]['ENGINE']:
+        DATABASES[alias]['HOST'] = replica
+    else:
+        DATABASES[alias]['NAME'] = 'file:%s?mode=ro' % replica
+        # nothing is written there, so no write lock is taken either
+        DATABASES[alias]['OPTIONS'] = {name: value for name, value in DATABASES[alias].get('OPTIONS', {}).items()
+            if name != 'transaction_mode'}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['apps.routers.ReplicaRouter']
+# the views with ETags read from the primary the resources written within
+# this many seconds, which must cover the lag of the replicas
+REPLICA_LAG_SECONDS = env.int('REPLICA_LAG_SECONDS', default=10)
+
+# Cache of the sessions, the users, the version tokens and the dashboards.
+# CACHE_BACKEND: locmem (one per process), file (a CACHE_LOCATION directory
+# shared by the workers of the host) or redis (a CACHE_LOCATION url, needs the
+# redis package); any other value is used as the dotted path of a backend
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+}
+CACHE_BACKEND = env('CACHE_BACKEND', default='locmem')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS.get(CACHE_BACKEND, CACHE_BACKEND),
+        'LOCATION': env('CACHE_LOCATION', default=os.path.join(CORE_DIR, 'cache') if CACHE_BACKEND == 'file' else ''),
+    }
+}
+
+# Sessions and users of the requests read from the cache; a session saved
+# again within SESSION_WRITE_BEHIND_SECONDS of its last write to the database
+# only updates the cache (0 writes it through every time). The window needs a
+# cache shared by the workers, so it is off by default with locmem
+SESSION_ENGINE = 'apps.authentication.sessions'
+SESSION_WRITE_BEHIND_SECONDS = env.int('SESSION_WRITE_BEHIND_SECONDS', default=0 if CACHE_BACKEND == 'locmem' else 60)
+AUTHENTICATION_BACKENDS = ['apps.authentication.backends.CachedModelBackend']
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -147,6 +225,23 @@ STATICFILES_DIRS = (
     os.path.join(CORE_DIR, 'apps/static'),
 )
 
+# Uploaded vouchers and customer images
+MEDIA_ROOT = env('MEDIA_ROOT', default=os.path.join(CORE_DIR, 'media'))
+MEDIA_URL = '/media/'
+
+# Threads that generate the thumbnails and previews of the uploads after the
+# request commits; 0 processes them synchronously (tests, scripts)
+IMAGE_WORKERS = env.int('IMAGE_WORKERS', default=2)
+IMAGE_THUMBNAIL_SIZE = (240, 240)
+IMAGE_PREVIEW_SIZE = (1280, 1280)
+
+# Per-view latency and SQL histograms, served to the staff at /api/metrics/.
+# A fraction METRICS_SAMPLE_RATE of the requests logs its queries slower than
+# METRICS_SLOW_QUERY_MS with the line that ran them (0 disables the tracing)
+METRICS_ENABLED = env.bool('METRICS_ENABLED', default=True)
+METRICS_SAMPLE_RATE = env.float('METRICS_SAMPLE_RATE', default=0.0)
+METRICS_SLOW_QUERY_MS = env.float('METRICS_SLOW_QUERY_MS', default=100)
+
 
 #############################################################
 #############################################################
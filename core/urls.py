@@ -3,6 +3,8 @@
 Copyright (c) 2019 - present AppSeed.us
 """
 
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include  # add this
 
@@ -12,6 +14,9 @@ urlpatterns = [
     path('api-auth/', include('rest_framework.urls')),
     path('api/', include('apps.api.urls')),
 
+    # uploads (served by the web server in production)
+    *static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT),
+
     # ADD NEW Routes HERE
 
     # Leave `Home.Urls` as last the last line